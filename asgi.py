@@ -0,0 +1,18 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Serves the same API as wsgi.py from an event loop, e.g.
+    uvicorn asgi:app --port 8000
+"""
+
+import os
+from service.async_app import create_asgi_app
+
+PORT = int(os.getenv("PORT", "8000"))
+
+app = create_asgi_app()
+
+if __name__ == "__main__":
+    import uvicorn  # pylint: disable=import-outside-toplevel
+
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
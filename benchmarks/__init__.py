@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the Shopcart service
+
+Each module in this package is a standalone script that can be run with
+``python -m benchmarks.<module>``. They are not collected by pytest.
+"""
@@ -0,0 +1,200 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: WSGI app behind sync workers vs. the ASGI app at high concurrency
+
+Seeds --carts carts and sends the same mix of reads (get_shopcarts,
+list_items and a page of list_shopcarts) to both apps in-process, from
+--concurrency clients at once:
+
+    wsgi  client threads share --wsgi-workers request slots, the way
+          gunicorn's sync workers (one in Procfile) take one request each
+    asgi  client tasks share one event loop and the app's async database
+
+Latency includes the time a request waits for a free worker. No sockets
+are involved, so the numbers compare the two apps rather than servers.
+The read cache of the Flask app is off unless --cache is given.
+--latency-ms delays every statement of both apps to stand in for the
+round trip to a database on another host.
+
+Usage:
+    python -m benchmarks.bench_asgi --carts 1000 --requests 2000 --concurrency 1 16 64 256
+    ASYNC_DB_EXECUTOR=threads python -m benchmarks.bench_asgi --latency-ms 2
+"""
+import argparse
+import asyncio
+import collections
+import threading
+import time
+
+from sqlalchemy import event
+from werkzeug.wsgi import ClosingIterator
+
+from benchmarks.bench_endpoints import drive, summarize
+from benchmarks.common import print_table, reset_database, seed, setup_app
+from service.async_app import create_asgi_app
+from service.common.cache import CACHE
+from service.models import db
+from tests.asgi_client import AsgiClient
+
+
+class SyncWorkers:  # pylint: disable=too-few-public-methods
+    """WSGI middleware that serves at most workers requests at a time
+
+    Requests wait for a worker in the order they arrived, like connections
+    in the listen queue of gunicorn's sync workers
+    """
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.free = workers
+        self.waiting = collections.deque()
+        self.changed = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        self.acquire()
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.release()
+            raise
+        # the worker is busy until the whole body has been sent
+        return ClosingIterator(body, self.release)
+
+    def acquire(self):
+        """Waits for a free worker, first come first served"""
+        with self.changed:
+            ticket = object()
+            self.waiting.append(ticket)
+            self.changed.wait_for(lambda: self.free and self.waiting[0] is ticket)
+            self.waiting.popleft()
+            self.free -= 1
+            self.changed.notify_all()
+
+    def release(self):
+        """Frees the worker"""
+        with self.changed:
+            self.free += 1
+            self.changed.notify_all()
+
+
+def add_latency(engine, latency_ms):
+    """Makes every statement of a synchronous engine wait latency_ms first
+
+    Stands in for the network round trip to a remote database. The
+    thread running the statement is blocked, as it would be on a socket.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def round_trip(*_):
+        time.sleep(latency_ms / 1000)
+
+    return round_trip
+
+
+def reads(shopcart_ids):
+    """Returns the function that builds the nth request of the mix"""
+
+    def request(n):
+        shopcart_id = shopcart_ids[n % len(shopcart_ids)]
+        urls = (
+            f"/shopcarts/{shopcart_id}",
+            f"/shopcarts/{shopcart_id}/items",
+            f"/shopcarts?customer_id={shopcart_id % 1000}&limit=20",
+        )
+        return urls[n % len(urls)], None
+
+    return request
+
+
+async def drive_asgi(client, request, numbers, concurrency):
+    """Sends the numbered requests from concurrency tasks and returns the results"""
+    counter = iter(numbers)
+    samples = []
+    errors = []
+
+    async def worker():
+        for n in counter:
+            url, _ = request(n)
+            start = time.perf_counter()
+            resp = await client.request("GET", url)
+            samples.append((time.perf_counter() - start) * 1000)
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - start, errors)
+
+
+def row(interface, concurrency, result):
+    """Returns the table row of one run"""
+    return [
+        interface,
+        concurrency,
+        f"{result['rps']:.0f}",
+        f"{result['p50']:.1f}",
+        f"{result['p95']:.1f}",
+        f"{result['p99']:.1f}",
+        result["errors"],
+    ]
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--wsgi-workers", type=int, default=1, help="sync workers of the WSGI app")
+    parser.add_argument("--cache", action="store_true", help="keep the read cache of the Flask app on")
+    parser.add_argument("--latency-ms", type=float, default=0, help="round trip added to every statement")
+    args = parser.parse_args()
+
+    app = setup_app()
+    if not args.cache:
+        CACHE.configure(max_entries=0, ttl=0, enabled=False)
+    app.wsgi_app = SyncWorkers(app.wsgi_app, args.wsgi_workers)
+    reset_database()
+    request = reads(seed(args.carts, args.items))
+    asgi_app = create_asgi_app()
+    client = AsgiClient(asgi_app)
+    client.run(asgi_app.startup())
+    if args.latency_ms:
+        if asgi_app.database.executor != "threads":
+            parser.error("--latency-ms blocks the event loop of the asyncio executor, use ASYNC_DB_EXECUTOR=threads")
+        add_latency(db.engine, args.latency_ms)
+        add_latency(asgi_app.database.engine, args.latency_ms)
+
+    rows = []
+    numbers = range(args.requests)
+    for concurrency in args.concurrency:
+        drive(app, "GET", request, range(concurrency), concurrency)  # warm up
+        rows.append(row(f"wsgi x{args.wsgi_workers}", concurrency, drive(app, "GET", request, numbers, concurrency)))
+        client.run(drive_asgi(client, request, range(concurrency), concurrency))
+        rows.append(row("asgi", concurrency, client.run(drive_asgi(client, request, numbers, concurrency))))
+
+    print(f"ASGI database executor: {asgi_app.database.executor}")
+    print_table(["app", "clients", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"], rows)
+    client.run(asgi_app.database.dispose())
+    client.close()
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: many writers incrementing the same item in one shopcart
+
+Every writer thread repeatedly GETs the item and PUTs it back with the
+quantity incremented by one, through the Flask test client. Two modes are
+compared:
+
+    blind     PUT without If-Match, as clients did before version columns
+    if-match  PUT with the ETag in If-Match, retrying on 412
+
+The table shows committed increments per second, the number of 412
+responses and how many increments were lost (expected minus actual
+quantity). Only the if-match mode should never lose an update.
+
+Each writer holds a pooled connection, so raise DB_MAX_OVERFLOW to run more
+writers than DB_POOL_SIZE + DB_MAX_OVERFLOW allow.
+
+Usage:
+    python -m benchmarks.bench_concurrency --writers 1 2 4 8 --increments 50
+"""
+import argparse
+
+from benchmarks.common import (
+    pool_capacity,
+    print_table,
+    reset_database,
+    run_threads,
+    seed,
+    setup_app,
+)
+from service.common import status
+from service.models import db, Item
+
+
+def writer(app, url, increments, if_match, conflicts):
+    """Increments the quantity of the item at url, counting 412 responses"""
+    client = app.test_client()
+    done = failed = 0
+    while done < increments:
+        resp = client.get(url)
+        item = resp.get_json()
+        item["quantity"] += 1
+        headers = {"If-Match": resp.headers["ETag"]} if if_match else {}
+        resp = client.put(url, json=item, headers=headers)
+        if resp.status_code == status.HTTP_412_PRECONDITION_FAILED:
+            failed += 1
+            if if_match:
+                continue  # somebody else won, read it again and retry
+        done += 1
+    conflicts.append(failed)
+
+
+def run(app, writers, increments, if_match):
+    """Runs the writers against a fresh item and returns one table row"""
+    reset_database()
+    shopcart_id = seed(1, 1)[0]
+    item = Item.find_by_shopcart(shopcart_id).one()
+    start_quantity = item.quantity
+    url = f"/shopcarts/{shopcart_id}/items/{item.id}"
+
+    db.session.commit()
+    conflicts = []
+    elapsed = run_threads(writer, writers, (app, url, increments, if_match, conflicts))
+
+    db.session.expire_all()
+    applied = Item.find(item.id).quantity - start_quantity
+    return [
+        "if-match" if if_match else "blind",
+        writers,
+        f"{applied / elapsed:.0f}",
+        sum(conflicts),
+        writers * increments - applied,
+    ]
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--increments", type=int, default=50, help="per writer")
+    args = parser.parse_args()
+
+    app = setup_app()
+    capacity = pool_capacity()
+    if max(args.writers) > capacity:
+        parser.error(f"at most {capacity} writers fit in the pool, raise DB_MAX_OVERFLOW")
+
+    rows = []
+    for writers in args.writers:
+        for if_match in (False, True):
+            rows.append(run(app, writers, args.increments, if_match))
+
+    print_table(["mode", "writers", "increments/s", "412s", "lost"], rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
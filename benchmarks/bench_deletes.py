@@ -0,0 +1,81 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: clearing a shopcart, per-row vs. set-based DELETE
+
+Seeds carts of increasing size and clears them two ways: the old
+implementation that loads every item and deletes (and commits) them one at
+a time, and Item.delete_by_shopcart which issues a single DELETE ... WHERE
+shopcart_id = :id.
+
+Usage:
+    python -m benchmarks.bench_deletes --items 10 100 500
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.common import print_table, reset_database, seed, setup_app
+from service.models import Shopcart, Item
+
+
+def per_row_clear(shopcart_id):
+    """The pre-bulk implementation of clear_items"""
+    shopcart = Shopcart.find(shopcart_id)
+    for item in list(shopcart.items):
+        item.delete()
+
+
+def set_based_clear(shopcart_id):
+    """The current implementation of clear_items"""
+    Item.delete_by_shopcart(shopcart_id)
+
+
+def time_each(func, shopcart_ids):
+    """Returns the median milliseconds func takes per shopcart"""
+    samples = []
+    for shopcart_id in shopcart_ids:
+        start = time.perf_counter()
+        func(shopcart_id)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--carts", type=int, default=10, help="carts cleared per run")
+    args = parser.parse_args()
+
+    setup_app()
+    rows = []
+    for items in args.items:
+        reset_database()
+        shopcart_ids = seed(args.carts * 2, items)
+        per_row = time_each(per_row_clear, shopcart_ids[: args.carts])
+        set_based = time_each(set_based_clear, shopcart_ids[args.carts:])
+        rows.append(
+            [items, f"{per_row:.2f}", f"{set_based:.2f}", f"{per_row / set_based:.0f}x"]
+        )
+
+    print_table(["items/cart", "per-row ms", "set-based ms", "speedup"], rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: latency and throughput of every route with baseline diffs
+
+Seeds --carts carts with --items items each, then drives every route of
+service/routes.py through the Flask test client from --concurrency
+threads and reports p50/p95/p99 latency and requests per second. Each
+route gets --warmup unmeasured requests first. Reads and updates rotate
+over the seeded rows; the DELETE routes get spare carts and items of
+their own so every request finds something to delete.
+
+The results are compared with the JSON baseline in --baseline when it
+exists and for the same parameters, flagging routes whose p95 rose or
+whose throughput fell by more than --tolerance percent. --save writes the
+results as the new baseline; --check exits with status 1 on a regression.
+
+Usage:
+    python -m benchmarks.bench_endpoints --carts 1000 --requests 200 --concurrency 4
+    python -m benchmarks.bench_endpoints --save
+    python -m benchmarks.bench_endpoints --check
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks.common import (
+    pool_capacity,
+    print_table,
+    reset_database,
+    run_threads,
+    seed,
+    setup_app,
+)
+from service.models import db, Item
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "endpoints.json")
+
+# Results are only compared with a baseline seeded and driven the same way
+PARAMETERS = ("carts", "items", "requests", "concurrency")
+
+# A rise in p95 smaller than this is timer noise on the fastest routes
+MIN_P95_CHANGE_MS = 1.0
+
+
+def scenarios(data):
+    """Returns (name, endpoint, method, request) for every scenario
+
+    request(n) returns the url and JSON body of the n-th request so that
+    concurrent requests never update or delete the same row.
+    """
+
+    def cart(n):
+        return data["carts"][n % len(data["carts"])]
+
+    def customer(n):
+        return data["customers"][n % len(data["customers"])]
+
+    def item_url(items, n):
+        shopcart_id, item_id, _ = items[n % len(items)]
+        return f"/shopcarts/{shopcart_id}/items/{item_id}"
+
+    def item_body(n):
+        # an item keeps its name, which no other item of its cart has
+        shopcart_id, item_id, name = data["items"][n % len(data["items"])]
+        return {
+            "id": item_id,
+            "shopcart_id": shopcart_id,
+            "name": name,
+            "description": "benchmark item",
+            "quantity": 1 + n % 10,
+            "price": 1.5,
+        }
+
+    new_item = {"name": "Milk", "description": "benchmark item", "quantity": 1, "price": 1.5}
+    return [
+        ("GET /health", "health_check", "GET", lambda n: ("/health", None)),
+        ("GET /metrics", "metrics", "GET", lambda n: ("/metrics", None)),
+        ("GET /", "index", "GET", lambda n: ("/", None)),
+        (
+            "POST /shopcarts",
+            "create_shopcart",
+            "POST",
+            lambda n: ("/shopcarts", {"customer_id": 1_000_000 + n}),
+        ),
+        ("GET /shopcarts/<id>", "get_shopcarts", "GET", lambda n: (f"/shopcarts/{cart(n)}", None)),
+        ("GET /shopcarts?limit=100", "list_shopcarts", "GET", lambda n: ("/shopcarts?limit=100", None)),
+        (
+            "GET /shopcarts?customer_id=",
+            "list_shopcarts",
+            "GET",
+            lambda n: (f"/shopcarts?customer_id={customer(n)}", None),
+        ),
+        (
+            "PUT /shopcarts/<id>",
+            "update_shopcarts",
+            "PUT",
+            lambda n: (f"/shopcarts/{cart(n)}", {"customer_id": customer(n), "items": []}),
+        ),
+        (
+            "GET /shopcarts/<id>/totals",
+            "get_shopcart_totals",
+            "GET",
+            lambda n: (f"/shopcarts/{cart(n)}/totals", None),
+        ),
+        (
+            "GET /shopcarts/totals?ids= (100)",
+            "list_shopcart_totals",
+            "GET",
+            lambda n: ("/shopcarts/totals?ids=" + ",".join(str(cart(n + i)) for i in range(100)), None),
+        ),
+        (
+            "POST /shopcarts/<id>/items",
+            "create_items",
+            "POST",
+            lambda n: (f"/shopcarts/{cart(n)}/items", dict(new_item, id=None, name=f"Milk {n}")),
+        ),
+        (
+            "POST /shopcarts/<id>/items?merge=true",
+            "create_items",
+            "POST",
+            lambda n: (f"/shopcarts/{cart(n)}/items?merge=true", dict(new_item, id=None)),
+        ),
+        (
+            "GET /shopcarts/<id>/items/<id>",
+            "get_items",
+            "GET",
+            lambda n: (item_url(data["items"], n), None),
+        ),
+        (
+            "GET /shopcarts/<id>/items",
+            "list_items",
+            "GET",
+            lambda n: (f"/shopcarts/{cart(n)}/items", None),
+        ),
+        (
+            "PUT /shopcarts/<id>/items/<id>",
+            "update_item",
+            "PUT",
+            lambda n: (item_url(data["items"], n), item_body(n)),
+        ),
+        (
+            "DELETE /shopcarts/<id>/items/<id>",
+            "delete_items",
+            "DELETE",
+            lambda n: (item_url(data["spare_items"], n), None),
+        ),
+        (
+            "DELETE /shopcarts/<id>/items",
+            "clear_items",
+            "DELETE",
+            lambda n: (f"/shopcarts/{data['spare_clear'][n]}/items", None),
+        ),
+        (
+            "DELETE /shopcarts/<id>",
+            "delete_shopcarts",
+            "DELETE",
+            lambda n: (f"/shopcarts/{data['spare_delete'][n]}", None),
+        ),
+    ]
+
+
+def prepare(carts, items, spares):
+    """Seeds the carts to read and update plus the spares to delete"""
+    reset_database()
+    shopcart_ids = seed(carts, items)
+    spare_delete = seed(spares, items, first_customer=carts + 1)
+    spare_clear = seed(spares, items, first_customer=carts + spares + 1)
+    spare_items = seed(spares, 1, first_customer=carts + 2 * spares + 1)
+
+    def item_ids(shopcart_ids):
+        rows = (
+            db.session.query(Item.shopcart_id, Item.id, Item.name)
+            .filter(Item.shopcart_id.in_(shopcart_ids))
+            .order_by(Item.id)
+        )
+        return [tuple(row) for row in rows]
+
+    data = {
+        "carts": shopcart_ids,
+        # seed numbers the customers from 1
+        "customers": list(range(1, carts + 1)),
+        "items": item_ids(shopcart_ids),
+        "spare_delete": spare_delete,
+        "spare_clear": spare_clear,
+        "spare_items": item_ids(spare_items),
+    }
+    db.session.commit()
+    return data
+
+
+def drive(app, method, request, numbers, concurrency):
+    """Sends the numbered requests from concurrency threads and returns the results"""
+    lock = threading.Lock()
+    counter = iter(numbers)
+    samples = []
+    errors = []
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            url, body = request(n)
+            start = time.perf_counter()
+            resp = client.open(url, method=method, json=body)
+            resp.get_data()  # read streamed lists to the end
+            resp.close()  # and give their connection back
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                samples.append(elapsed)
+                if resp.status_code >= 400:
+                    errors.append(resp.status_code)
+
+    wall = run_threads(worker, concurrency)
+    return summarize(samples, wall, errors)
+
+
+def percentile(samples, pct):
+    """Returns the nearest-rank percentile of sorted samples"""
+    rank = max(1, -(-len(samples) * pct // 100))
+    return samples[int(rank) - 1]
+
+
+def summarize(samples, wall, errors):
+    """Returns the latency percentiles in ms and the requests per second"""
+    samples.sort()
+    return {
+        "p50": round(percentile(samples, 50), 3),
+        "p95": round(percentile(samples, 95), 3),
+        "p99": round(percentile(samples, 99), 3),
+        "rps": round(len(samples) / wall, 1),
+        "errors": len(errors),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the diff table rows and the names of the regressed routes"""
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            rows.append([name, "-", f"{result['p95']:.2f}", "", "-", f"{result['rps']:.0f}", "", "new"])
+            continue
+        p95_change = change(before["p95"], result["p95"])
+        rps_change = change(before["rps"], result["rps"])
+        p95_regressed = p95_change > tolerance and result["p95"] - before["p95"] > MIN_P95_CHANGE_MS
+        regressed = p95_regressed or rps_change < -tolerance
+        if regressed:
+            regressions.append(name)
+        rows.append(
+            [
+                name,
+                f"{before['p95']:.2f}",
+                f"{result['p95']:.2f}",
+                f"{p95_change:+.1f}%",
+                f"{before['rps']:.0f}",
+                f"{result['rps']:.0f}",
+                f"{rps_change:+.1f}%",
+                "REGRESSION" if regressed else "ok",
+            ]
+        )
+    return rows, regressions
+
+
+def change(before, after):
+    """Returns the change from before to after in percent"""
+    return (after - before) / before * 100 if before else 0.0
+
+
+def load_baseline(path, parameters):
+    """Returns the baseline in path if it was recorded with the same parameters"""
+    if not os.path.exists(path):
+        print(f"No baseline in {path}, run with --save to record one")
+        return None
+    with open(path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline["parameters"] != parameters:
+        print(f"Baseline in {path} was recorded with {baseline['parameters']}, not comparing")
+        return None
+    return baseline
+
+
+def save_baseline(path, parameters, results):
+    """Writes the results as the new baseline"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "recorded": datetime.now(timezone.utc).isoformat(),
+                "parameters": parameters,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+        file.write("\n")
+    print(f"Saved the baseline to {path}")
+
+
+def run(app, args):
+    """Seeds the database and drives every scenario, returning the results"""
+    data = prepare(args.carts, args.items, args.warmup + args.requests)
+    routes = scenarios(data)
+    covered = {endpoint for _, endpoint, _, _ in routes}
+    missing = {rule.endpoint for rule in app.url_map.iter_rules()} - covered - {"static"}
+    if missing:
+        print(f"Routes without a scenario: {', '.join(sorted(missing))}")
+
+    results = {}
+    for name, _, method, request in routes:
+        drive(app, method, request, range(args.warmup), args.concurrency)
+        results[name] = drive(
+            app, method, request, range(args.warmup, args.warmup + args.requests), args.concurrency
+        )
+    return results
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=10.0, help="percent")
+    parser.add_argument("--save", action="store_true", help="record the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with 1 on a regression")
+    args = parser.parse_args()
+
+    app = setup_app()
+    capacity = pool_capacity()
+    if args.concurrency > capacity:
+        parser.error(f"at most {capacity} threads fit in the pool, raise DB_MAX_OVERFLOW")
+    parameters = {name: getattr(args, name) for name in PARAMETERS}
+
+    results = run(app, args)
+    print_table(
+        ["route", "p50 ms", "p95 ms", "p99 ms", "req/s", "errors"],
+        [
+            [name, f"{r['p50']:.2f}", f"{r['p95']:.2f}", f"{r['p99']:.2f}", f"{r['rps']:.0f}", r["errors"]]
+            for name, r in results.items()
+        ],
+    )
+
+    regressions = []
+    baseline = load_baseline(args.baseline, parameters)
+    if baseline:
+        print()
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print_table(
+            ["route", "base p95", "p95", "change", "base req/s", "req/s", "change", ""], rows
+        )
+    if args.save:
+        save_baseline(args.baseline, parameters, results)
+    reset_database()
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
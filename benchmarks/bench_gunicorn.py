@@ -0,0 +1,181 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: gunicorn worker classes under gunicorn.conf.py over real sockets
+
+Seeds --carts carts, then for every worker class starts gunicorn with the
+production config and the same environment apart from
+GUNICORN_WORKER_CLASS, and sends the read mix of bench_asgi from
+--concurrency client threads, each on its own keep-alive connection.
+Worker and thread counts are the ones gunicorn.conf.py derives for this
+machine unless GUNICORN_WORKERS / GUNICORN_THREADS are set.
+
+The clients run in this process, so on a small machine they compete with
+the workers for the CPU. --latency-ms delays every statement of the app to
+stand in for the round trip to a database on another host.
+
+Usage:
+    python -m benchmarks.bench_gunicorn --classes sync gthread gevent --concurrency 1 16 64
+    python -m benchmarks.bench_gunicorn --latency-ms 2
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.bench_asgi import add_latency, reads, row
+from benchmarks.bench_endpoints import summarize
+from benchmarks.common import print_table, reset_database, seed, setup_app
+from service import create_app
+from service.models import db
+
+HOST = "127.0.0.1"
+
+
+def latency_app(latency_ms):
+    """Returns the Flask app with latency_ms added to every statement
+
+    gunicorn calls it from the app spec benchmarks.bench_gunicorn:latency_app(2.0)
+    """
+    app = create_app()
+    with app.app_context():
+        add_latency(db.engine, latency_ms)
+    return app
+
+
+def start(worker_class, port, app_spec):
+    """Starts gunicorn with a worker class and waits until it answers"""
+    env = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_BIND": f"{HOST}:{port}",
+        "GUNICORN_LOG_LEVEL": "warning",
+    }
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", app_spec], env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn {worker_class} exited with {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=1)
+            connection.request("GET", "/health")
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn {worker_class} did not start")
+
+
+def stop(server):
+    """Shuts gunicorn down gracefully"""
+    server.terminate()
+    server.wait(timeout=60)
+
+
+def get(connection, url):
+    """Sends a GET on a keep-alive connection and returns the status code
+
+    A worker replaced after max_requests closes its idle connections, so
+    like any HTTP client the request is sent again once on a new one.
+    """
+    for _ in range(2):
+        try:
+            connection.request("GET", url)
+            resp = connection.getresponse()
+            resp.read()
+            return resp.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+    return 599
+
+
+def drive_http(port, request, numbers, concurrency):
+    """Sends the numbered requests from concurrency keep-alive clients"""
+    counter = iter(numbers)
+    lock = threading.Lock()
+    samples = []
+    errors = []
+
+    def client():
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            url, _ = request(n)
+            begin = time.perf_counter()
+            status = get(connection, url)
+            elapsed = (time.perf_counter() - begin) * 1000
+            with lock:
+                samples.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - begin, errors)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--classes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0, help="round trip added to every statement")
+    args = parser.parse_args()
+
+    setup_app()
+    reset_database()
+    request = reads(seed(args.carts, args.items))
+    db.session.remove()
+    app_spec = f"benchmarks.bench_gunicorn:latency_app({args.latency_ms})" if args.latency_ms else "wsgi:app"
+
+    rows = []
+    for worker_class in args.classes:
+        server = start(worker_class, args.port, app_spec)
+        try:
+            for concurrency in args.concurrency:
+                drive_http(args.port, request, range(concurrency), concurrency)  # warm up
+                result = drive_http(args.port, request, range(args.requests), concurrency)
+                rows.append(row(worker_class, concurrency, result))
+        finally:
+            stop(server)
+
+    print(f"CPUs: {len(os.sched_getaffinity(0))}, latency per statement: {args.latency_ms} ms")
+    print_table(["workers", "clients", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"], rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
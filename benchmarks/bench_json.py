@@ -0,0 +1,98 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: stdlib vs. orjson JSON provider on large cart lists
+
+Serializes carts built with the test factories (no database needed) and
+times, for each provider, the three ways the service uses JSON: one
+jsonify() response for the whole list, one dumps() per record as the
+streamed list does, and loads() of the list as request.get_json() would.
+
+Usage:
+    python -m benchmarks.bench_json --sizes 1000 10000 --items 3
+"""
+import argparse
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.common import measure, print_table
+from benchmarks.bench_serialize import build_shopcart
+from service.common.json_provider import OrjsonProvider, orjson
+
+
+def payload(carts, items):
+    """Returns carts serialized to dicts, as the list endpoints build them"""
+    return [build_shopcart(items).serialize() for _ in range(carts)]
+
+
+def operations(provider, records, body):
+    """Returns the JSON operations to time by name"""
+    return {
+        "jsonify": lambda: provider.response(records).get_data(),
+        "dumps per record": lambda: [provider.dumps(record) for record in records],
+        "loads": lambda: provider.loads(body),
+    }
+
+
+def compare(stdlib, fast, records, repeat):
+    """Times every operation with both providers and returns the table rows"""
+    body = stdlib.response(records).get_data()
+    # both providers must send exactly the same bytes
+    assert fast.response(records).get_data() == body
+    before = operations(stdlib, records, body)
+    after = operations(fast, records, body)
+    rows = []
+    for operation, func in before.items():
+        stdlib_ms = measure(func, repeat=repeat, warmup=1)["p50"]
+        orjson_ms = measure(after[operation], repeat=repeat, warmup=1)["p50"]
+        rows.append(
+            [
+                len(records),
+                f"{len(body) / 2**20:.1f}",
+                operation,
+                f"{stdlib_ms:.1f}",
+                f"{orjson_ms:.1f}",
+                f"{stdlib_ms / orjson_ms:.1f}x",
+            ]
+        )
+    return rows
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    if orjson is None:
+        parser.error("orjson is not installed")
+
+    app = Flask(__name__)
+    stdlib = DefaultJSONProvider(app)
+    fast = OrjsonProvider(app)
+    rows = []
+    with app.app_context():
+        for size in args.sizes:
+            rows.extend(compare(stdlib, fast, payload(size, args.items), args.repeat))
+
+    print_table(["carts", "MiB", "operation", "stdlib ms", "orjson ms", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: filtered GET /shopcarts as the table grows
+
+Seeds increasingly large tables and times GET /shopcarts filtered by
+customer_id and by item_name. With the filters pushed into SQL and the
+supporting indexes in place the latency should stay flat as the table grows.
+The old behavior (load everything, filter in Python) can be timed alongside
+with --legacy, which is only practical for the smaller sizes.
+
+Usage:
+    python -m benchmarks.bench_list_filters --sizes 1000 10000 100000
+"""
+import argparse
+
+from sqlalchemy import func, update
+
+from benchmarks.common import (
+    measure,
+    print_table,
+    reset_database,
+    seed,
+    setup_app,
+)
+from service.models import db, Shopcart, Item
+
+
+def legacy_filter(customer_id, item_name):
+    """The pre-SQL implementation: hydrate every cart and filter in Python"""
+    shopcarts = Shopcart.all()
+    if customer_id:
+        shopcarts = [sc for sc in shopcarts if sc.customer_id == customer_id]
+    if item_name:
+        shopcarts = [
+            sc for sc in shopcarts if any(item.name == item_name for item in sc.items)
+        ]
+    return [shopcart.serialize() for shopcart in shopcarts]
+
+
+def time_size(client, size, args):
+    """Seeds a table of the given size and returns one row of results"""
+    reset_database()
+    shopcart_ids = seed(size, args.items)
+    # a customer in the middle of the table and an item only one cart holds
+    customer_id = size // 2
+    first_item = db.select(func.min(Item.id)).where(Item.shopcart_id == shopcart_ids[size // 2])
+    db.session.execute(update(Item).where(Item.id == first_item.scalar_subquery()).values(name="Caviar"))
+    db.session.commit()
+
+    by_customer = measure(
+        lambda: client.get("/shopcarts", query_string={"customer_id": customer_id}),
+        repeat=args.repeat,
+    )
+    by_item = measure(
+        lambda: client.get("/shopcarts", query_string={"item_name": "Caviar"}),
+        repeat=args.repeat,
+    )
+    row = [size, f"{by_customer['p50']:.2f}", f"{by_item['p50']:.2f}"]
+    if args.legacy:
+        legacy = measure(lambda: legacy_filter(customer_id, None), repeat=3)
+        row.append(f"{legacy['p50']:.2f}")
+    return row
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--legacy", action="store_true", help="also time the Python-side filter"
+    )
+    args = parser.parse_args()
+
+    client = setup_app().test_client()
+    rows = [time_size(client, size, args) for size in args.sizes]
+
+    headers = ["carts", "customer_id p50 ms", "item_name p50 ms"]
+    if args.legacy:
+        headers.append("legacy p50 ms")
+    print_table(headers, rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
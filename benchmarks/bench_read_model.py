@@ -0,0 +1,123 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: ORM instances vs. the row tuple read model on the read endpoints
+
+Seeds --carts carts and times building the response data of the three read
+endpoints both ways: loading model instances (items by selectin) and
+calling serialize(), or selecting just the needed columns and building the
+dicts from row tuples. Both produce the same data, which is checked first.
+
+    list_shopcarts  a page of --limit carts with their items
+    stream          every cart, --batch rows at a time
+    list_items      the items of one cart
+    get_shopcarts   one cart and its ETag
+
+Usage:
+    python -m benchmarks.bench_read_model --carts 10000 --items 3 --limit 1000
+"""
+import argparse
+
+from benchmarks.common import measure, print_table, reset_database, seed, setup_app
+from service.models import db, Shopcart, Item
+
+
+def orm_list(query):
+    """The ORM path of a list: load instances, then serialize them"""
+    db.session.expunge_all()
+    return [shopcart.serialize() for shopcart in Shopcart.with_items(query).all()]
+
+
+def orm_stream(query, batch_size):
+    """The ORM path of a streamed list"""
+    db.session.expunge_all()
+    return [record.serialize() for record in Shopcart.with_items(query).yield_per(batch_size)]
+
+
+def orm_items(shopcart_id):
+    """The ORM path of list_items"""
+    db.session.expunge_all()
+    return [item.serialize() for item in Item.find_by_shopcart(shopcart_id)]
+
+
+def orm_get(shopcart_id):
+    """The ORM path of get_shopcarts"""
+    db.session.expunge_all()
+    shopcart = Shopcart.find(shopcart_id)
+    return shopcart.etag(), shopcart.serialize()
+
+
+def scenarios(shopcart_id, limit, batch_size):
+    """Returns (name, orm, core) for every scenario"""
+    page = Shopcart.keyset_query(Shopcart.find_by_filters(), limit)
+    everything = Shopcart.find_by_filters()
+    items = Item.find_by_shopcart(shopcart_id).order_by(Item.id)
+    return [
+        ("list_shopcarts", lambda: orm_list(page), lambda: Shopcart.read_serialized(page)),
+        (
+            "stream",
+            lambda: orm_stream(everything, batch_size),
+            lambda: list(Shopcart.stream_serialized(everything, batch_size)),
+        ),
+        ("list_items", lambda: orm_items(shopcart_id), lambda: Item.read_serialized(items)),
+        ("get_shopcarts", lambda: orm_get(shopcart_id), lambda: Shopcart.read_by_id(shopcart_id)),
+    ]
+
+
+def same(orm, core):
+    """Returns True when both paths built the same data"""
+
+    def by_id(data):
+        # the ORM does not order the items of a cart
+        if isinstance(data, dict) and "items" in data:
+            return {**data, "items": sorted(data["items"], key=lambda item: item["id"])}
+        if isinstance(data, (list, tuple)):
+            return [by_id(record) for record in data]
+        return data
+
+    return by_id(orm) == by_id(core)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    parser.add_argument("--limit", type=int, default=1000, help="carts per page")
+    parser.add_argument("--batch", type=int, default=500, help="rows per streamed batch")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    setup_app()
+    reset_database()
+    shopcart_ids = seed(args.carts, args.items)
+    shopcart_id = shopcart_ids[len(shopcart_ids) // 2]
+
+    rows = []
+    for name, orm, core in scenarios(shopcart_id, args.limit, args.batch):
+        if not same(orm(), core()):
+            raise SystemExit(f"{name}: the read model does not match serialize()")
+        orm_ms = measure(orm, repeat=args.repeat)["p50"]
+        core_ms = measure(core, repeat=args.repeat)["p50"]
+        rows.append([name, f"{orm_ms:.2f}", f"{core_ms:.2f}", f"{orm_ms / core_ms:.1f}x"])
+
+    print_table(["endpoint", "orm ms", "core ms", "speedup"], rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: time and allocations of the model serialize/deserialize methods
+
+Builds transient carts with the test factories (no database needed) and
+times Item.serialize, Item().deserialize, Shopcart.serialize and
+Shopcart().deserialize for carts of each size in --sizes. The time is the
+best of --repeat runs of timeit's autorange, per call. The allocations
+are measured with tracemalloc around a single call: the peak size of the
+Python heap above where it started, and the number of memory blocks the
+call allocated that were still alive when it returned (its result).
+
+Usage:
+    python -m benchmarks.bench_serialize --sizes 1 10 100 1000
+"""
+import argparse
+import timeit
+import tracemalloc
+
+from benchmarks.common import print_table
+from service.models import Shopcart, Item
+from tests.factories import ShopcartFactory, ItemFactory
+
+
+def build_shopcart(items):
+    """Returns a transient shopcart with the given number of items"""
+    shopcart = ShopcartFactory()
+    ItemFactory.create_batch(items, shopcart=shopcart, shopcart_id=shopcart.id)
+    return shopcart
+
+
+def operations(items):
+    """Returns the operations to measure by name for a cart of items"""
+    shopcart = build_shopcart(items)
+    item = shopcart.items[0]
+    shopcart_data = shopcart.serialize()
+    item_data = item.serialize()
+    return {
+        "Item.serialize": item.serialize,
+        "Item.deserialize": lambda: Item().deserialize(item_data),
+        "Shopcart.serialize": shopcart.serialize,
+        "Shopcart.deserialize": lambda: Shopcart().deserialize(shopcart_data),
+    }
+
+
+def time_per_call(func, repeat):
+    """Returns the best time of one call of func in microseconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def allocations(func):
+    """Returns the peak KiB and the blocks still allocated after one call"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return (peak - start) / 1024, blocks
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        for name, func in operations(size).items():
+            if name.startswith("Item.") and size != args.sizes[0]:
+                continue  # a single item does not depend on the cart size
+            micros = time_per_call(func, args.repeat)
+            peak_kib, blocks = allocations(func)
+            items = 1 if name.startswith("Item.") else size
+            rows.append(
+                [
+                    name,
+                    items,
+                    f"{micros:.1f}",
+                    f"{micros / items:.2f}",
+                    f"{peak_kib:.1f}",
+                    blocks,
+                ]
+            )
+
+    print_table(["operation", "items", "us/call", "us/item", "peak KiB", "blocks"], rows)
+
+
+if __name__ == "__main__":
+    main()
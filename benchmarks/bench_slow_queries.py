@@ -0,0 +1,104 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: plans and timings of the suspect model queries as tables grow
+
+Seeds carts of increasing count and runs Shopcart.all(), Item.find() and
+Shopcart.find_by_customer() with the slow query recorder at a threshold of
+zero, so every statement is recorded with its EXPLAIN (ANALYZE off) plan.
+The table shows the time of each statement and the top node of its plan;
+the full records are appended to captures/slow_queries.log.
+
+Usage:
+    python -m benchmarks.bench_slow_queries --sizes 1000 10000 50000
+"""
+import argparse
+import json
+import logging
+
+from sqlalchemy import event
+
+from benchmarks.common import print_table, reset_database, seed, setup_app
+from service.common.slow_queries import SlowQueryRecorder, slow_query_logger
+from service.models import db, Shopcart, Item
+
+
+class Capture(logging.Handler):
+    """Keeps the slow query records logged while it is attached"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+def capture(func):
+    """Runs func and returns the slow query record of its last statement"""
+    # a threshold of zero records every statement
+    recorder = SlowQueryRecorder(threshold_ms=0)
+    handler = Capture()
+    slow_query_logger.addHandler(handler)
+    event.listen(db.engine, "before_cursor_execute", recorder.before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", recorder.after_cursor_execute)
+    try:
+        db.session.expire_all()
+        func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", recorder.before_cursor_execute)
+        event.remove(db.engine, "after_cursor_execute", recorder.after_cursor_execute)
+        slow_query_logger.removeHandler(handler)
+    return handler.records[-1]
+
+
+def suspect_queries(item_id, customer_id):
+    """Returns the queries to capture by name"""
+    return {
+        "Shopcart.all()": Shopcart.all,
+        "Item.find()": lambda: Item.find(item_id),
+        "find_by_customer()": lambda: Shopcart.find_by_customer(customer_id).all(),
+    }
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    args = parser.parse_args()
+
+    setup_app()
+    slow_query_logger.setLevel(logging.WARNING)
+
+    rows = []
+    for size in args.sizes:
+        reset_database()
+        shopcart_ids = seed(size, args.items)
+        middle = shopcart_ids[len(shopcart_ids) // 2]
+        item_id = Item.find_by_shopcart(middle).first().id
+        customer_id = Shopcart.find(middle).customer_id
+        for name, func in suspect_queries(item_id, customer_id).items():
+            record = capture(func)
+            rows.append([size, name, f"{record['duration_ms']:.2f}", record["plan"].split("  (")[0]])
+
+    print_table(["carts", "query", "ms", "plan"], rows)
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: cold start of a worker, from interpreter start to first response
+
+Starts a fresh interpreter --runs times per DB_SCHEMA_STARTUP mode, the way
+gunicorn starts a worker without preload, and times each phase:
+
+    process   interpreter start up to the first line of the worker
+    import    import service
+    create    create_app(), including the schema work of the mode
+    first     the first request, GET /shopcarts?limit=1, which opens the
+              first pooled connection
+    total     wall time of the whole process as seen from outside
+
+and counts the SQL statements create_app() sends. Medians are compared
+with the JSON baseline in --baseline like bench_endpoints does; --save
+records a new one and --check exits with status 1 when a phase got slower
+by more than --tolerance percent.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --save
+    python -m benchmarks.bench_startup --check
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_endpoints import change, load_baseline, save_baseline
+from benchmarks.common import print_table
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "startup.json")
+
+PARAMETERS = ("runs",)
+
+PHASES = ("process", "import", "create", "first", "total")
+
+# Changes smaller than this are noise however large in percent
+MIN_CHANGE_MS = 5.0
+
+# Runs in the fresh interpreter; imports nothing before it starts the clock
+WORKER = """
+import time
+started = time.perf_counter()
+import json, logging
+import service
+imported = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+app = service.create_app()
+created = time.perf_counter()
+count = len(statements)
+logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+status = app.test_client().get("/shopcarts?limit=1").status_code
+answered = time.perf_counter()
+print(json.dumps({
+    "started": started,
+    "import": (imported - started) * 1000,
+    "create": (created - imported) * 1000,
+    "first": (answered - created) * 1000,
+    "statements": count,
+    "status": status,
+}))
+"""
+
+
+def cold_start(mode):
+    """Runs one worker in a fresh interpreter and returns its timings in ms"""
+    env = {**os.environ, "DB_SCHEMA_STARTUP": mode}
+    begin = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER], env=env, capture_output=True, text=True, check=True
+    )
+    total = (time.perf_counter() - begin) * 1000
+    timings = json.loads(output.stdout.strip().splitlines()[-1])
+    if timings["status"] != 200:
+        raise RuntimeError(f"First request failed with {timings['status']}")
+    # perf_counter is the same monotonic clock in both processes on Linux
+    timings["process"] = (timings.pop("started") - begin) * 1000
+    timings["total"] = total
+    return timings
+
+
+def run(modes, runs):
+    """Returns the median timings of every mode
+
+    The modes take turns so that a busy moment of the machine slows all of
+    them down instead of just one.
+    """
+    samples = {mode: [] for mode in modes}
+    for mode in modes:
+        cold_start(mode)  # brings the schema to the mode and warms the OS caches
+    for _ in range(runs):
+        for mode in modes:
+            samples[mode].append(cold_start(mode))
+    return {
+        mode: {
+            phase: round(statistics.median(sample[phase] for sample in samples[mode]), 1)
+            for phase in PHASES + ("statements",)
+        }
+        for mode in modes
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the diff rows and the regressed mode/phase names"""
+    rows = []
+    regressions = []
+    for mode, result in results.items():
+        before = baseline["results"].get(mode)
+        if before is None:
+            continue
+        for phase in PHASES:
+            delta = change(before[phase], result[phase])
+            regressed = delta > tolerance and result[phase] - before[phase] > MIN_CHANGE_MS
+            if regressed:
+                regressions.append(f"{mode} {phase}")
+            rows.append(
+                [mode, phase, before[phase], result[phase], f"{delta:+.1f}%", "REGRESSION" if regressed else "ok"]
+            )
+    return rows, regressions
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per mode")
+    parser.add_argument("--modes", nargs="+", default=["create", "check", "skip"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=15.0, help="percent")
+    parser.add_argument("--save", action="store_true", help="record the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with 1 on a regression")
+    args = parser.parse_args()
+
+    results = run(args.modes, args.runs)
+    print_table(
+        ["mode", "statements"] + [f"{phase} ms" for phase in PHASES],
+        [[mode, result["statements"]] + [result[phase] for phase in PHASES] for mode, result in results.items()],
+    )
+
+    parameters = {name: getattr(args, name) for name in PARAMETERS}
+    baseline = load_baseline(args.baseline, parameters)
+    regressions = []
+    if baseline:
+        print()
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print_table(["mode", "phase", "baseline ms", "now ms", "change", ""], rows)
+    if args.save:
+        save_baseline(args.baseline, parameters, results)
+    if args.check and regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Benchmark: peak memory of GET /shopcarts, buffered vs. streamed
+
+Measures the peak Python heap (tracemalloc) needed to answer an unpaged
+GET /shopcarts. The buffered variant is the old implementation: serialize
+every cart into a list and jsonify it. The streamed variants read the body
+chunk by chunk the way a WSGI server would, without keeping it.
+
+Usage:
+    python -m benchmarks.bench_streaming --sizes 1000 10000 50000
+"""
+import argparse
+import time
+import tracemalloc
+
+from flask import jsonify
+
+from benchmarks.common import print_table, reset_database, seed, setup_app
+from service.models import Shopcart
+
+
+def buffered(app):
+    """The pre-streaming implementation: build the whole list then encode it"""
+    with app.test_request_context("/shopcarts"):
+        query = Shopcart.with_items(Shopcart.find_by_filters())
+        body = jsonify([shopcart.serialize() for shopcart in query]).get_data()
+    return len(body)
+
+
+def streamed(client, accept):
+    """Reads a streamed response one chunk at a time and discards it"""
+    resp = client.get("/shopcarts", headers={"Accept": accept}, buffered=False)
+    size = sum(len(chunk) for chunk in resp.response)
+    resp.close()
+    return size
+
+
+def peak(func):
+    """Returns the peak traced memory in MiB and elapsed ms of func"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return f"{peak_bytes / 2**20:.1f}", f"{elapsed:.0f}"
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--items", type=int, default=3, help="items per cart")
+    args = parser.parse_args()
+
+    app = setup_app()
+    client = app.test_client()
+    rows = []
+    for size in args.sizes:
+        reset_database()
+        seed(size, args.items)
+        rows.append(
+            [size]
+            + list(peak(lambda: buffered(app)))
+            + list(peak(lambda: streamed(client, "application/json")))
+            + list(peak(lambda: streamed(client, "application/x-ndjson")))
+        )
+
+    print_table(
+        [
+            "carts",
+            "buffered MiB",
+            "ms",
+            "stream json MiB",
+            "ms",
+            "stream ndjson MiB",
+            "ms",
+        ],
+        rows,
+    )
+    reset_database()
+
+
+if __name__ == "__main__":
+    main()
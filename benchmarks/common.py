@@ -0,0 +1,170 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Shared helpers for the benchmark scripts
+
+The benchmarks run the Flask app in-process against the database named by
+the DATABASE_URI environment variable. They DELETE every shopcart before
+seeding so never point them at a database you care about.
+"""
+import logging
+import statistics
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, text
+
+from service.models import db, Shopcart, Item
+
+ITEM_NAMES = ("Milk", "Bread", "Eggs", "Cheese", "Apples", "Bananas", "Carrots")
+
+SEED_BATCH_SIZE = 5000
+
+
+def setup_app():
+    """Pushes an application context and quiets the logs"""
+    # imported here so benchmarks that never touch the database can run
+    # without one: creating the app connects to it
+    from wsgi import app  # pylint: disable=import-outside-toplevel
+
+    app.config["TESTING"] = True
+    app.config["DEBUG"] = False
+    app.logger.setLevel(logging.CRITICAL)
+    logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+    app.app_context().push()
+    return app
+
+
+def reset_database():
+    """Removes all shopcarts and items"""
+    db.session.query(Item).delete()
+    db.session.query(Shopcart).delete()
+    db.session.commit()
+
+
+def seed(carts, items_per_cart, first_customer=1):
+    """Bulk loads carts with items and returns the new shopcart ids
+
+    Rows are written with Core multi-row INSERTs so that seeding a large
+    table takes seconds instead of minutes. Customer ids are sequential
+    starting at first_customer and item names cycle through ITEM_NAMES.
+    """
+    now = datetime.now()
+    shopcart_ids = []
+    for start in range(0, carts, SEED_BATCH_SIZE):
+        # the summary of the items below, which Core INSERTs do not maintain
+        units = items_per_cart * (items_per_cart + 1) // 2
+        rows = [
+            {
+                "customer_id": first_customer + n,
+                "time_atc": now,
+                "item_count": items_per_cart,
+                "unit_count": units,
+                "subtotal": units * 1.5,
+            }
+            for n in range(start, min(start + SEED_BATCH_SIZE, carts))
+        ]
+        result = db.session.execute(
+            insert(Shopcart).returning(Shopcart.id, sort_by_parameter_order=True),
+            rows,
+        )
+        batch_ids = list(result.scalars())
+        shopcart_ids.extend(batch_ids)
+        items = [
+            {
+                "shopcart_id": shopcart_id,
+                "name": item_name(shopcart_id, n),
+                "description": "benchmark item",
+                "quantity": 1 + n,
+                "price": 1.5,
+            }
+            for shopcart_id in batch_ids
+            for n in range(items_per_cart)
+        ]
+        if items:
+            db.session.execute(insert(Item), items)
+        db.session.commit()
+    analyze()
+    return shopcart_ids
+
+
+def item_name(shopcart_id, n):
+    """Returns the name of the nth item of a seeded cart
+
+    The names cycle through ITEM_NAMES and are numbered from the second
+    round on, since a cart holds one item of each name
+    """
+    name = ITEM_NAMES[(shopcart_id + n) % len(ITEM_NAMES)]
+    rounds = n // len(ITEM_NAMES)
+    return f"{name} {rounds + 1}" if rounds else name
+
+
+def analyze():
+    """Refreshes planner statistics so the new rows are costed correctly"""
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("ANALYZE shopcart"))
+        db.session.execute(text("ANALYZE item"))
+        db.session.commit()
+
+
+def measure(func, repeat=20, warmup=2):
+    """Calls func repeatedly and returns latency statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "min": samples[0],
+        "p50": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def pool_capacity():
+    """Returns how many connections the pool can hand out at once"""
+    options = current_app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    return options["pool_size"] + options["max_overflow"]
+
+
+def run_threads(target, count, args=()):
+    """Runs target in count threads and returns the wall time in seconds"""
+    threads = [threading.Thread(target=target, args=args) for _ in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def print_table(headers, rows):
+    """Prints rows as a plain text table"""
+    widths = [
+        max(len(str(value)) for value in column) for column in zip(headers, *rows)
+    ]
+    line = "  ".join(f"{{:>{width}}}" for width in widths)
+    print(line.format(*headers))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print(line.format(*row))
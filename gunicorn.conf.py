@@ -0,0 +1,198 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Gunicorn configuration
+
+gunicorn reads this file from the working directory on startup. The number
+of workers follows the CPUs the process may actually use: the CPU affinity
+mask, capped by the cgroup CPU quota of the container, so a pod limited to
+2 CPUs on a 64 core node starts 2 CPUs worth of workers, not 64. A
+fractional quota is rounded down, and the workers are capped so that they
+and the master fit in the cgroup memory limit.
+
+Every setting can be overridden from the environment:
+
+    GUNICORN_WORKER_CLASS  sync, gthread (default), gevent or any worker
+                           class path, e.g. uvicorn.workers.UvicornWorker
+    GUNICORN_WORKERS       worker processes
+    GUNICORN_WORKER_MEMORY_MB  memory budgeted per process when capping workers
+    GUNICORN_THREADS       threads per gthread worker
+    GUNICORN_WORKER_CONNECTIONS  concurrent requests per gevent worker
+    GUNICORN_PRELOAD       load the app once in the master before forking
+    GUNICORN_KEEPALIVE     seconds to keep an idle connection open
+    GUNICORN_MAX_REQUESTS  requests after which a worker is replaced (0 never)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests so workers restart apart
+    GUNICORN_TIMEOUT       seconds a silent worker lives before it is killed
+    GUNICORN_GRACEFUL_TIMEOUT  seconds workers get to finish on shutdown
+    GUNICORN_BIND          address to listen on (default 0.0.0.0:$PORT)
+    GUNICORN_LOG_LEVEL     gunicorn's log level
+"""
+import glob
+import math
+import os
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().split()
+    except OSError:
+        return None
+
+
+def cpu_quota(root=CGROUP_ROOT):
+    """Returns the CPUs the cgroup of this process may use, or None if unlimited"""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    fields = _read(os.path.join(root, "cpu.max"))
+    if fields is None:
+        # cgroup v1: quota is -1 when unlimited
+        quota = _read(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+        period = _read(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+        fields = quota + period if quota and period else None
+    if not fields or fields[0] in ("max", "-1"):
+        return None
+    return int(fields[0]) / int(fields[1])
+
+
+def cpu_count(root=CGROUP_ROOT):
+    """Returns the whole number of CPUs this process can keep busy, at least 1
+
+    A fractional quota is rounded down: a pod limited to 0.25 CPU is not
+    given the workers of a whole one.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota(root)
+    if quota:
+        cpus = min(cpus, math.floor(quota))
+    return max(cpus, 1)
+
+
+def memory_limit(root=CGROUP_ROOT):
+    """Returns the bytes of memory the cgroup of this process may use, or None if unlimited"""
+    # cgroup v2: a number of bytes or "max"
+    fields = _read(os.path.join(root, "memory.max"))
+    if fields is None:
+        # cgroup v1: a number near 2**63 when unlimited
+        fields = _read(os.path.join(root, "memory", "memory.limit_in_bytes"))
+    if not fields or fields[0] == "max":
+        return None
+    limit = int(fields[0])
+    return limit if limit < 2**62 else None
+
+
+def _env(name, default):
+    return os.getenv(f"GUNICORN_{name}") or default
+
+
+def pool_capacity():
+    """Returns the most database connections one worker's pool opens"""
+    return int(os.getenv("DB_POOL_SIZE", "5")) + max(int(os.getenv("DB_MAX_OVERFLOW", "10")), 0)
+
+
+def default_workers(klass, cpus, memory=None):
+    """Returns the worker processes to start for a worker class
+
+    Args:
+        klass (str): the worker class
+        cpus (int): the whole CPUs the workers may use
+        memory (int): the bytes the master and the workers may use together
+    """
+    if klass == "sync":
+        # a sync worker blocks on I/O, so 2 x CPUs + 1 keeps every CPU busy
+        count = 2 * cpus + 1
+    else:
+        # the threads or the event loop of one worker per CPU overlap the waits
+        count = cpus
+    if memory:
+        # each process holds a copy of the app, the master included
+        per_process = int(_env("WORKER_MEMORY_MB", "96")) * 1024 * 1024
+        count = min(count, max(memory // per_process - 1, 1))
+    return count
+
+
+def default_threads():
+    """Returns the threads per gthread worker
+
+    More threads than pooled connections would only wait for one.
+    """
+    return min(4, pool_capacity())
+
+
+######################################################################
+# S E R V E R   S O C K E T
+######################################################################
+bind = _env("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+keepalive = int(_env("KEEPALIVE", "5"))
+
+######################################################################
+# W O R K E R   P R O C E S S E S
+######################################################################
+worker_class = _env("WORKER_CLASS", "gthread")
+workers = int(_env("WORKERS", str(default_workers(worker_class, cpu_count(), memory_limit()))))
+threads = int(_env("THREADS", str(default_threads()))) if worker_class == "gthread" else 1
+worker_connections = int(_env("WORKER_CONNECTIONS", "1000"))
+
+# Loading the app before forking shares its memory and fails fast on a bad
+# config. gevent patches the standard library only once a worker starts,
+# so an app imported earlier would keep blocking locks; don't preload it.
+preload_app = _env("PRELOAD", "false" if worker_class == "gevent" else "true").lower() == "true"
+
+# Replace workers now and then to bound slow leaks, not all at the same time
+max_requests = int(_env("MAX_REQUESTS", "1000"))
+max_requests_jitter = int(_env("MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+timeout = int(_env("TIMEOUT", "30"))
+graceful_timeout = int(_env("GRACEFUL_TIMEOUT", "30"))
+
+loglevel = _env("LOG_LEVEL", "info")
+
+
+######################################################################
+# S E R V E R   H O O K S
+######################################################################
+def on_starting(server):
+    """Removes the metrics files left by the workers of the last run"""
+    directory = os.getenv("METRICS_MULTIPROC_DIR")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "requests_*.json*")):
+            os.remove(path)
+    server.log.info(
+        "Starting %s %s workers x %s threads", workers, worker_class, threads
+    )
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drops the database connections a preloaded app opened in the master
+
+    A forked worker must not use the sockets it shares with the master and
+    its siblings; it opens its own on first use.
+    """
+    if not server.cfg.preload_app:
+        return
+    app = server.app.wsgi()
+    # the ASGI app only connects once the worker's event loop starts it
+    if hasattr(app, "app_context"):
+        # pylint: disable=import-outside-toplevel
+        from service.models import db
+
+        with app.app_context():
+            db.engine.dispose(close=False)
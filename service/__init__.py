@@ -21,7 +21,16 @@ and SQL database
 import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import (
+    cache,
+    json_provider,
+    log_handlers,
+    metrics,
+    pool_metrics,
+    query_stats,
+    schema,
+    slow_queries,
+)
 
 
 ############################################################
@@ -32,11 +41,13 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    json_provider.init_json(app)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
 
+    pool_metrics.configure_pool(app)
     db.init_app(app)
 
     with app.app_context():
@@ -48,8 +59,24 @@ def create_app():
         # Initialize error handlers
         error_handlers.initialize_error_handlers(app)
 
+        # Count and time the SQL statements run by each request
+        query_stats.init_query_stats(app, db.engine)
+
+        # Capture the plans of slow statements
+        slow_queries.init_slow_queries(app, db.engine)
+
+        # Watch the connection pool for starvation
+        pool_metrics.init_pool_metrics(app, db.engine)
+
+        # Size the read cache
+        cache.init_cache(app)
+
+        # Count the requests of every endpoint and time them
+        metrics.init_metrics(app)
+
         try:
-            db.create_all()
+            # Create the tables, or check that they are current
+            schema.init_schema(app)
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -0,0 +1,653 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Asynchronous Shopcart Service
+
+An ASGI version of the REST API in service/routes.py. While one request
+waits on PostgreSQL the worker goes on serving others, so a single worker
+is no longer limited to one request at a time. Serve it with any ASGI
+server, e.g. uvicorn asgi:app
+
+It answers the same routes with the same JSON, ETags and status codes:
+requests are checked and parsed by the same functions of
+service/common/api.py, and every statement is built with the same model
+methods as the Flask app. Only running the statements and sending the
+responses is done here. The read cache,
+/metrics, Server-Timing and the slow query log are only wired into the
+Flask app.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import partial
+
+from flask import Config
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import delete, update
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException, abort
+from werkzeug.routing import Map, Rule
+from werkzeug.sansio.request import Request as SansIORequest
+from werkzeug.sansio.response import Response as SansIOResponse
+
+from service import config
+from service.common.async_db import init_database
+from service.common.json_provider import init_json
+from service.common import api, schema, status
+from service.common.api import JSON, NDJSON
+from service.common.error_handlers import error_body
+from service.models import db, make_etag, write_error, Shopcart, Item
+from service.models import DataValidationError, ConcurrencyError, DuplicateError
+
+logger = logging.getLogger("flask.app")
+
+URLS = Map(
+    [
+        Rule("/health", endpoint="health_check", methods=["GET"]),
+        Rule("/shopcarts", endpoint="create_shopcart", methods=["POST"]),
+        Rule("/shopcarts", endpoint="list_shopcarts", methods=["GET"]),
+        Rule("/shopcarts/totals", endpoint="list_shopcart_totals", methods=["GET"]),
+        Rule("/shopcarts/<int:shopcart_id>", endpoint="get_shopcarts", methods=["GET"]),
+        Rule("/shopcarts/<int:shopcart_id>", endpoint="update_shopcarts", methods=["PUT"]),
+        Rule("/shopcarts/<int:shopcart_id>", endpoint="delete_shopcarts", methods=["DELETE"]),
+        Rule("/shopcarts/<int:shopcart_id>/totals", endpoint="get_shopcart_totals", methods=["GET"]),
+        Rule("/shopcarts/<int:shopcart_id>/items", endpoint="create_items", methods=["POST"]),
+        Rule("/shopcarts/<int:shopcart_id>/items", endpoint="list_items", methods=["GET"]),
+        Rule("/shopcarts/<int:shopcart_id>/items", endpoint="clear_items", methods=["DELETE"]),
+        Rule("/shopcarts/<int:shopcart_id>/items/<int:item_id>", endpoint="get_items", methods=["GET"]),
+        Rule("/shopcarts/<int:shopcart_id>/items/<int:item_id>", endpoint="update_item", methods=["PUT"]),
+        Rule("/shopcarts/<int:shopcart_id>/items/<int:item_id>", endpoint="delete_items", methods=["DELETE"]),
+    ]
+)
+
+
+class Request(SansIORequest):
+    """An HTTP request built from an ASGI scope and its body"""
+
+    def __init__(self, scope, body=b""):
+        headers = Headers([(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]])
+        super().__init__(
+            method=scope["method"],
+            scheme=scope.get("scheme", "http"),
+            server=scope.get("server"),
+            root_path=scope.get("root_path", ""),
+            path=scope["path"],
+            query_string=scope.get("query_string", b""),
+            headers=headers,
+            remote_addr=(scope.get("client") or (None,))[0],
+        )
+        self.body = body
+        self.urls = URLS.bind(self.host, script_name=self.root_path or None, url_scheme=self.scheme)
+        self.endpoint = None
+        self.view_args = {}
+
+    def url_for(self, endpoint, **values):
+        """Returns the external URL of an endpoint"""
+        return self.urls.build(endpoint, values, force_external=True)
+
+
+class Response(SansIOResponse):
+    """An HTTP response and its body
+
+    The body is bytes, or an async iterator of bytes when it is streamed
+    """
+
+    default_mimetype = JSON
+
+    def __init__(self, body=b"", code=status.HTTP_200_OK, mimetype=None, headers=None):
+        super().__init__(status=code, headers=headers, mimetype=mimetype)
+        self.body = body
+
+
+######################################################################
+#  A S G I   A P P L I C A T I O N
+######################################################################
+class ShopcartApp:  # pylint: disable=too-many-public-methods
+    """The Shopcart REST API as an ASGI application"""
+
+    def __init__(self, settings=None):
+        self.config = Config("")
+        self.config.from_object(config)
+        self.config.update(settings or {})
+        self.json = DefaultJSONProvider(self)
+        init_json(self)
+        self.database = init_database(self.config)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        request = Request(scope)
+        try:
+            request.body = await self.read_body(request, receive)
+        except HTTPException as error:
+            response = self.error_response(error.code, error.description)
+        else:
+            response = await self.dispatch(request)
+        await self.send_response(send, response)
+
+    async def read_body(self, request, receive):
+        """
+        Returns the body of a request, as Flask does up to MAX_CONTENT_LENGTH
+
+        A larger body is refused with 413 Request Entity Too Large as soon as
+        its Content-Length or the bytes received so far go over the limit, so
+        it is never buffered whole
+        """
+        limit = self.config["MAX_CONTENT_LENGTH"]
+        if limit is not None and (request.content_length or 0) > limit:
+            abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            if limit is not None and len(body) > limit:
+                abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            more_body = message.get("more_body", False)
+        return bytes(body)
+
+    async def lifespan(self, receive, send):
+        """Creates the tables on startup and closes the pool on shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.database.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self):
+        """Creates the tables or checks that they are current, see DB_SCHEMA_STARTUP"""
+        mode = schema.startup_mode(self.config)
+        if mode == "create":
+            await self.database.run_sync(db.metadata.create_all)
+        elif mode == "check":
+            # migrations take locks and run outside transactions, on a plain engine
+            await asyncio.to_thread(schema.check_database, self.config["SQLALCHEMY_DATABASE_URI"])
+        logger.info("Async service initialized with %s!", self.database.executor)
+
+    async def dispatch(self, request):
+        """Calls the handler of the route and turns errors into JSON responses"""
+        try:
+            request.endpoint, request.view_args = request.urls.match(request.path, request.method)
+            return await getattr(self, request.endpoint)(request, **request.view_args)
+        except HTTPException as error:
+            return self.error_response(error.code, error.description)
+        except ConcurrencyError as error:
+            return self.error_response(status.HTTP_412_PRECONDITION_FAILED, str(error))
+        except DuplicateError as error:
+            return self.error_response(status.HTTP_409_CONFLICT, str(error))
+        except DataValidationError as error:
+            return self.error_response(status.HTTP_400_BAD_REQUEST, str(error))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error handling %s %s", request.method, request.path)
+            return self.error_response(
+                status.HTTP_500_INTERNAL_SERVER_ERROR, "The server could not handle the request"
+            )
+
+    async def send_response(self, send, response):
+        """Sends a response, one chunk at a time when it is streamed"""
+        streamed = not isinstance(response.body, bytes)
+        if response.status_code in (status.HTTP_204_NO_CONTENT, status.HTTP_304_NOT_MODIFIED):
+            del response.headers["Content-Type"]
+        elif not streamed:
+            response.headers["Content-Length"] = str(len(response.body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in response.headers.items()
+                ],
+            }
+        )
+        if streamed:
+            async for chunk in response.body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await send({"type": "http.response.body", "body": response.body})
+
+    ######################################################################
+    #  U T I L I T Y   F U N C T I O N S
+    ######################################################################
+
+    def dumps(self, data):
+        """Encodes data as compact JSON bytes, as jsonify() does"""
+        return self.json.dumps(data, separators=(",", ":")).encode()
+
+    def json_response(self, data, code=status.HTTP_200_OK, headers=None):
+        """Returns data as a JSON response"""
+        return Response(self.dumps(data) + b"\n", code, headers=headers)
+
+    def error_response(self, code, message):
+        """Returns the JSON error body the Flask error handlers send"""
+        return self.json_response(error_body(code, message), code)
+
+    def get_json(self, request):
+        """Checks the Content-Type and returns the parsed JSON body"""
+        api.check_content_type(request)
+        try:
+            return self.json.loads(request.body)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, "Failed to decode JSON object")
+        return None  # pragma: no cover
+
+    @asynccontextmanager
+    async def writing(self):
+        """A transaction whose database errors are reported as 400 Bad Request
+
+        A unique constraint violation is reported as 409 Conflict instead.
+        The models' create(), update() and delete() do the same
+        """
+        try:
+            async with self.database.begin() as connection:
+                yield connection
+        except SQLAlchemyError as error:
+            logger.error("Error writing records: %s", error)
+            raise write_error(error) from error
+
+    def record_response(self, request, etag, data):
+        """Returns a single serialized record with its ETag, or 304 Not Modified"""
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        return api.revalidated(self.json_response(data), etag)
+
+    async def list_response(self, request, model, statement):
+        """
+        Returns the records of a SELECT as one page or a stream, with an ETag
+
+        Args:
+            request: the request of the list
+            model: the model class being listed
+            statement: the filtered SELECT of records, ordered by id
+        """
+        statement, limit, ndjson = api.list_query(request, self.config, partial(keyset, model), statement)
+
+        async with self.database.begin() as connection:
+            result = await connection.execute(model.etag_statement(statement))
+            etag = api.list_etag(make_etag(*result.one()), ndjson)
+            if etag in request.if_none_match:
+                return not_modified(etag)
+            if limit is not None:
+                records = await read_records(connection, model, statement)
+
+        if limit is not None:
+            response = self.page_response(request, records, limit)
+        else:
+            response = Response(self.stream(model, statement, ndjson), mimetype=NDJSON if ndjson else JSON)
+        return api.revalidated(response, etag, vary="Accept")
+
+    def page_response(self, request, records, limit):
+        """Returns one page of records, linking to the next one if there is more"""
+        response = self.json_response(records[:limit])
+        response.headers.update(api.next_page_headers(request, request.url_for, records, limit))
+        return response
+
+    async def stream(self, model, statement, ndjson=False):
+        """
+        Async generator of every record of a SELECT encoded as JSON
+
+        The records are read one keyset page of STREAM_BATCH_SIZE at a time,
+        each in its own short transaction, so no connection is held while a
+        slow client reads the body. The body is a JSON array, or one JSON
+        document per line when ndjson is set.
+        """
+        batch_size = self.config["STREAM_BATCH_SIZE"]
+        after_id = None
+        first = True
+        if not ndjson:
+            yield b"["
+        while True:
+            async with self.database.begin() as connection:
+                records = await read_records(connection, model, keyset(model, statement, batch_size, after_id))
+            chunk = []
+            for record in records:
+                if ndjson:
+                    chunk.append(self.dumps(record) + b"\n")
+                else:
+                    chunk.append(self.dumps(record) if first else b"," + self.dumps(record))
+                    first = False
+            if chunk:
+                yield b"".join(chunk)
+            if len(records) < batch_size:
+                break
+            after_id = records[-1]["id"]
+        if not ndjson:
+            yield b"]"
+
+    ######################################################################
+    # GET HEALTH CHECK
+    ######################################################################
+    async def health_check(self, request):  # pylint: disable=unused-argument
+        """Let them know our heart is still beating"""
+        return self.json_response({"status": 200, "message": "Healthy", "executor": self.database.executor})
+
+    ######################################################################
+    # CREATE A NEW SHOPCART
+    ######################################################################
+    async def create_shopcart(self, request):
+        """Creates a Shopcart, with the Items in its body if any"""
+        logger.info("Request to create a Shopcart")
+        shopcart = api.new_shopcart(self.get_json(request))
+
+        async with self.writing() as connection:
+            result = await connection.execute(Shopcart.insert_statement(), Shopcart.insert_rows([shopcart]))
+            shopcart_id = result.scalar_one()
+            if shopcart.items:
+                for item in shopcart.items:
+                    item.shopcart_id = shopcart_id
+                await connection.execute(Item.insert_statement(), Item.insert_rows(shopcart.items))
+                await update_summaries(connection, Item.summary_changes(Item.summary_rows(shopcart.items)))
+            _, message = await read_by_id(connection, Shopcart, shopcart_id)
+
+        location_url = request.url_for("get_shopcarts", shopcart_id=shopcart_id)
+        return self.json_response(message, status.HTTP_201_CREATED, {"Location": location_url})
+
+    ######################################################################
+    # READ A SHOPCART
+    ######################################################################
+    async def get_shopcarts(self, request, shopcart_id):
+        """Retrieve a single Shopcart with its Items"""
+        logger.info("Request to Retrieve a Shopcart with id [%s]", shopcart_id)
+        async with self.database.begin() as connection:
+            shopcart = await read_by_id(connection, Shopcart, shopcart_id)
+        if not shopcart:
+            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+        return self.record_response(request, *shopcart)
+
+    ######################################################################
+    # DELETE A SHOPCART
+    ######################################################################
+    async def delete_shopcarts(self, request, shopcart_id):  # pylint: disable=unused-argument
+        """Delete a Shopcart; the database cascades to its Items"""
+        logger.info("Request to delete shopcart with id: %s", shopcart_id)
+        async with self.writing() as connection:
+            await connection.execute(delete(Shopcart).where(Shopcart.id == shopcart_id))
+        return Response(code=status.HTTP_204_NO_CONTENT)
+
+    ######################################################################
+    # LIST ALL SHOPCARTS (W/ FILTERING)
+    ######################################################################
+    async def list_shopcarts(self, request):
+        """Returns all of the shopcarts, optionally filtered by customer_id or item name"""
+        logger.info("Request for shopcart list")
+        customer_id, item_name = api.shopcart_filters(request)
+        statement = db.select(Shopcart).where(*Shopcart.filter_criteria(customer_id, item_name))
+        return await self.list_response(request, Shopcart, statement.order_by(Shopcart.id))
+
+    ######################################################################
+    # UPDATE AN EXISTING SHOPCART
+    ######################################################################
+    async def update_shopcarts(self, request, shopcart_id):
+        """
+        Update a Shopcart
+
+        Only the fields of the Shopcart itself are changed; its Items are
+        changed through the item routes. Send the ETag in If-Match to only
+        update it if nobody else has changed it since.
+        """
+        logger.info("Request to Update a shopcart with id [%s]", shopcart_id)
+        shopcart_json = self.get_json(request)
+
+        async with self.writing() as connection:
+            # the row stays locked until the update is committed
+            found = await read_by_id(connection, Shopcart, shopcart_id, for_update=True)
+            if not found:
+                abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+            api.check_if_match(request, found[0])
+            shopcart = Shopcart().deserialize(api.shopcart_changes(shopcart_json, found[1]["time_atc"]))
+            await update_record(connection, Shopcart, shopcart_id, shopcart)
+            etag, message = await read_by_id(connection, Shopcart, shopcart_id)
+
+        response = self.json_response(message)
+        response.set_etag(etag)
+        return response
+
+    ######################################################################
+    # READ THE TOTALS OF SHOPCARTS
+    ######################################################################
+    async def get_shopcart_totals(self, request, shopcart_id):  # pylint: disable=unused-argument
+        """Returns the item count, unit count and subtotal of a Shopcart"""
+        logger.info("Request for the totals of shopcart with id: %s", shopcart_id)
+        totals = await self.read_totals([shopcart_id])
+        if not totals:
+            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+        return self.json_response(totals[0])
+
+    async def list_shopcart_totals(self, request):
+        """Returns the totals of every Shopcart listed in ids, in one query"""
+        shopcart_ids = api.totals_ids(request, self.config)
+        logger.info("Request for the totals of %d shopcarts", len(shopcart_ids))
+        return self.json_response(await self.read_totals(shopcart_ids))
+
+    async def read_totals(self, shopcart_ids):
+        """Returns the serialized totals of Shopcarts from one aggregate query"""
+        async with self.database.begin() as connection:
+            result = await connection.execute(Shopcart.totals_statement(shopcart_ids))
+            return Shopcart.serialize_totals(result)
+
+    ######################################################################
+    # CREATE A NEW ITEM IN SHOPCART
+    ######################################################################
+    async def create_items(self, request, shopcart_id):
+        """Adds an Item to a Shopcart, or every Item of a JSON array in one INSERT
+
+        With ?merge=true the Items are upserted instead, see Item.upsert()
+        """
+        logger.info("Request to create an items for shopcart with id: %s", shopcart_id)
+        item_json = self.get_json(request)
+
+        with api.unique_item_names(shopcart_id):
+            async with self.writing() as connection:
+                if not await shopcart_exists(connection, shopcart_id):
+                    abort(status.HTTP_404_NOT_FOUND, f"shopcart with id '{shopcart_id}' could not be found.")
+                items, bulk = api.new_items(shopcart_id, item_json, self.config)
+                code = status.HTTP_201_CREATED
+                if api.wants_merge(request):
+                    ids, versions = await upsert_items(connection, items)
+                    code = api.added_status(versions)
+                else:
+                    result = await connection.execute(Item.insert_statement(), Item.insert_rows(items))
+                    ids = result.scalars().all()
+                    await update_summaries(connection, Item.summary_changes(Item.summary_rows(items)))
+                records = await read_records(connection, Item, db.select(Item).where(Item.id.in_(ids)))
+        by_id = {record["id"]: record for record in records}
+        records = [by_id[item_id] for item_id in ids]
+
+        location_url = api.added_location(request.url_for, shopcart_id, ids, bulk)
+        return self.json_response(records if bulk else records[0], code, {"Location": location_url})
+
+    ######################################################################
+    # DELETE AN ITEM FROM SHOPCART
+    ######################################################################
+    async def delete_items(self, request, shopcart_id, item_id):  # pylint: disable=unused-argument
+        """Delete an Item if it is in the Shopcart"""
+        logger.info("Request to delete item %s for shopcart id: %s", item_id, shopcart_id)
+        async with self.writing() as connection:
+            await delete_items(connection, Item.shopcart_id == shopcart_id, Item.id == item_id)
+        return Response(code=status.HTTP_204_NO_CONTENT)
+
+    ######################################################################
+    # DELETE ALL ITEMS IN A SHOPCART
+    ######################################################################
+    async def clear_items(self, request, shopcart_id):  # pylint: disable=unused-argument
+        """Clears all items in a shopcart"""
+        logger.info("Request to clear all items for shopcart with id: %s", shopcart_id)
+        async with self.writing() as connection:
+            if not await shopcart_exists(connection, shopcart_id):
+                abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' not found.")
+            await delete_items(connection, Item.shopcart_id == shopcart_id)
+        return Response(code=status.HTTP_204_NO_CONTENT)
+
+    ######################################################################
+    # READ AN ITEM FROM SHOPCART
+    ######################################################################
+    async def get_items(self, request, shopcart_id, item_id):
+        """Get an Item"""
+        logger.info("Request to retrieve Item %s for Shopcart id: %s", item_id, shopcart_id)
+        async with self.database.begin() as connection:
+            item = await read_by_id(connection, Item, item_id)
+        if not item:
+            abort(status.HTTP_404_NOT_FOUND, f"item with id '{item_id}' could not be found.")
+        return self.record_response(request, *item)
+
+    ######################################################################
+    # LIST ITEMS FROM SHOPCART (W/ FILTERING)
+    ######################################################################
+    async def list_items(self, request, shopcart_id):
+        """Returns all of the items for a Shopping Cart, optionally filtered"""
+        logger.info("Request for all items for shopcart with id: %s", shopcart_id)
+        async with self.database.begin() as connection:
+            if not await shopcart_exists(connection, shopcart_id):
+                abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' could not be found.")
+        name, quantity = api.item_filters(request)
+        statement = db.select(Item).where(*Item.filter_criteria(shopcart_id, name, quantity))
+        return await self.list_response(request, Item, statement.order_by(Item.id))
+
+    ######################################################################
+    # UPDATE AN EXISTING ITEM IN SHOPPING CART
+    ######################################################################
+    async def update_item(self, request, shopcart_id, item_id):
+        """Update an Item in a Shopcart, only if it still matches If-Match when sent"""
+        logger.info("Request to update item %s for shopcart %s", item_id, shopcart_id)
+        item_json = self.get_json(request)
+
+        async with self.writing() as connection:
+            if not await shopcart_exists(connection, shopcart_id):
+                abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' not found.")
+            found = await read_by_id(connection, Item, item_id, for_update=True)
+            if not found or found[1]["shopcart_id"] != shopcart_id:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Item with id '{item_id}' not found in Shopcart {shopcart_id}.",
+                )
+            api.check_if_match(request, found[0])
+            item_json.setdefault("shopcart_id", shopcart_id)
+            item = Item().deserialize(item_json)
+            await update_record(connection, Item, item_id, item)
+            # the Item may have moved to another Shopcart
+            loaded = (found[1]["shopcart_id"], found[1]["quantity"], found[1]["price"])
+            changes = Item.summary_changes([loaded], sign=-1)
+            await update_summaries(connection, Item.summary_changes(Item.summary_rows([item]), changes=changes))
+            etag, message = await read_by_id(connection, Item, item_id)
+
+        response = self.json_response(message)
+        response.set_etag(etag)
+        return response
+
+
+######################################################################
+#  S T A T E M E N T   H E L P E R S
+######################################################################
+
+
+def keyset(model, statement, limit, after_id=None):
+    """Returns the SELECT of up to limit records ordered by id after after_id"""
+    if after_id is not None:
+        statement = statement.where(model.id > after_id)
+    return statement.order_by(None).order_by(model.id).limit(limit)
+
+
+async def read_records(connection, model, statement):
+    """Returns the records of a SELECT serialized straight from row tuples"""
+    result = await connection.execute(statement.with_only_columns(*model.read_columns()))
+    records = model.serialize_rows(result)
+    children = model.children_statement(records)
+    if children is not None:
+        model.add_children(records, await connection.execute(children))
+    return records
+
+
+async def read_by_id(connection, model, by_id, for_update=False):
+    """Returns the ETag and serialized form of a record, or None if not found
+
+    With for_update the row is locked until the transaction ends
+    """
+    statement = model.read_by_id_statement(by_id)
+    if for_update:
+        statement = statement.with_for_update(of=model)
+    result = await connection.execute(statement)
+    return model.read_by_id_rows(result.all())
+
+
+async def shopcart_exists(connection, shopcart_id):
+    """Returns True if the Shopcart exists"""
+    result = await connection.execute(db.select(Shopcart.id).where(Shopcart.id == shopcart_id))
+    return result.first() is not None
+
+
+async def delete_items(connection, *criteria):
+    """Deletes the Items matching the criteria and takes them out of their Shopcart's summary"""
+    result = await connection.execute(delete(Item).where(*criteria).returning(*Item.deleted_columns()))
+    rows = result.all()
+    await update_summaries(connection, Item.summary_changes(Item.summary_rows(rows), sign=-1))
+
+
+async def upsert_items(connection, items):
+    """Upserts Items with one statement like Item.upsert()
+
+    Returns:
+        tuple: the ids of the Items in order, and their versions (1 if created)
+    """
+    items = Item.combine(items)
+    statement = Item.upsert_statement(connection.dialect.name).values(Item.insert_rows(items))
+    result = await connection.execute(
+        statement.returning(Item.id, Item.shopcart_id, Item.name, Item.price, Item.version)
+    )
+    rows = Item.in_order_of(result.all(), items)
+    await update_summaries(connection, Item.upsert_changes(rows, items))
+    return [row.id for row in rows], [row.version for row in rows]
+
+
+async def update_summaries(connection, changes):
+    """Adds summary changes to the Shopcarts, see Item.summary_statements()"""
+    for statement in Item.summary_statements(changes):
+        await connection.execute(statement)
+
+
+async def update_record(connection, model, by_id, record):
+    """Writes the fields of a deserialized record to the row with by_id"""
+    values = model.insert_rows([record])[0]
+    result = await connection.execute(
+        update(model).where(model.id == by_id).values(**values, version=model.version + 1)
+    )
+    if result.rowcount != 1:
+        raise ConcurrencyError(f"{model.__name__} {by_id} was changed by another request")
+
+
+######################################################################
+#  R E Q U E S T   H E L P E R S
+######################################################################
+
+
+def not_modified(etag):
+    """Returns an empty 304 Not Modified response for an ETag"""
+    response = Response(code=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def create_asgi_app(settings=None):
+    """Returns the ASGI application, with settings overriding service/config.py"""
+    return ShopcartApp(settings)
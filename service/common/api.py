@@ -0,0 +1,280 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+API Request Handling
+
+The route logic shared by the Flask app (service/routes.py) and the ASGI
+app (service/async_app.py): checking and parsing what a client sent and
+deciding the status and headers of the answer. The apps only differ in
+how they run statements and send responses, so both call these.
+
+Every function takes the request it works on. Both apps use werkzeug
+requests, which have the same args, headers and conditional headers.
+"""
+import datetime
+import logging
+from contextlib import contextmanager
+
+from werkzeug.exceptions import abort
+
+from service.common import pagination, status
+from service.common.pagination import encode_cursor
+from service.models import Shopcart, Item, DuplicateError
+
+logger = logging.getLogger("flask.app")
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+
+######################################################################
+#  R E Q U E S T   C H E C K S
+######################################################################
+
+
+def check_content_type(request, content_type=JSON):
+    """Checks that the media type is correct"""
+    if "Content-Type" not in request.headers:
+        logger.error("No Content-Type specified.")
+        abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}")
+
+    if request.headers["Content-Type"] == content_type:
+        return
+
+    logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
+    abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}")
+
+
+def check_if_match(request, etag):
+    """Aborts with 412 Precondition Failed if If-Match does not name the ETag"""
+    if request.if_match and etag not in request.if_match:
+        logger.warning("If-Match %s does not match ETag %s", request.if_match, etag)
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The resource was changed by another request, GET it and try again",
+        )
+
+
+######################################################################
+#  Q U E R Y   A R G U M E N T S
+######################################################################
+
+
+def is_paged(request):
+    """Returns True when the request asked for one page of a list"""
+    return "limit" in request.args or "cursor" in request.args
+
+
+def wants_merge(request):
+    """Returns True when new items should be merged into the ones of the same name"""
+    return request.args.get("merge", "").lower() in ("true", "1")
+
+
+def wants_ndjson(request):
+    """Returns True when the client prefers NDJSON over a JSON array"""
+    return request.accept_mimetypes.best_match([JSON, NDJSON]) == NDJSON
+
+
+def page_args(request, config):
+    """
+    Returns the page size and the id to page after from the request arguments
+
+    Returns:
+        tuple: the limit (clamped to PAGE_SIZE_MAX) and the decoded cursor
+    """
+    try:
+        return pagination.page_args(request.args, config["PAGE_SIZE_DEFAULT"], config["PAGE_SIZE_MAX"])
+    except ValueError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
+    return None  # pragma: no cover
+
+
+def list_query(request, config, keyset, query):
+    """
+    Returns the query of a list and how its records are sent back
+
+    Args:
+        keyset: pages a query, called as keyset(query, size, after_id)
+        query: the filtered query of records, ordered by id
+
+    Returns:
+        tuple: the query, the page size (None when the list is streamed)
+            and whether the stream is NDJSON
+    """
+    if not is_paged(request):
+        return query, None, wants_ndjson(request)
+    limit, after_id = page_args(request, config)
+    # Fetch one extra record to find out if there is a next page
+    return keyset(query, limit + 1, after_id), limit, False
+
+
+def totals_ids(request, config):
+    """Returns the Shopcart ids whose totals are asked for, at most TOTALS_BATCH_MAX"""
+    try:
+        return pagination.ids_arg(request.args, config["TOTALS_BATCH_MAX"])
+    except ValueError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
+    return None  # pragma: no cover
+
+
+def shopcart_filters(request):
+    """Returns the customer_id and item_name a list of Shopcarts is filtered by"""
+    return request.args.get("customer_id", type=int), request.args.get("item_name", type=str)
+
+
+def item_filters(request):
+    """Returns the name and quantity a list of Items is filtered by"""
+    return request.args.get("name"), request.args.get("quantity", type=int)
+
+
+######################################################################
+#  R E Q U E S T   B O D I E S
+######################################################################
+
+
+def new_shopcart(shopcart_json):
+    """Validates the body of a new Shopcart and returns it deserialized"""
+    # Validate customer_id is present and is an integer
+    if not shopcart_json or "customer_id" not in shopcart_json:
+        abort(status.HTTP_400_BAD_REQUEST, "Customer ID is required")
+    try:
+        shopcart_json["customer_id"] = int(shopcart_json["customer_id"])
+    except (ValueError, TypeError):
+        abort(status.HTTP_400_BAD_REQUEST, "Customer ID must be an integer")
+    shopcart_json.setdefault("time_atc", datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"))
+    shopcart_json.setdefault("items", [])
+    return Shopcart().deserialize(shopcart_json)
+
+
+def shopcart_changes(shopcart_json, time_atc):
+    """
+    Validates the body of a Shopcart update and fills in what it leaves out
+
+    Only the fields of the Shopcart itself are changed; its Items are
+    changed through the item routes, so a body that lists some is refused.
+
+    Returns:
+        dict: the body with time_atc defaulted and no Items
+    """
+    if not isinstance(shopcart_json, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "A Shopcart must be a JSON object")
+    if shopcart_json.get("items"):
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Items can not be changed by updating a Shopcart, use its items instead",
+        )
+    return {**shopcart_json, "time_atc": shopcart_json.get("time_atc", time_atc), "items": []}
+
+
+def new_items(shopcart_id, item_json, config):
+    """
+    Validates every Item of a POST body before anything is written
+
+    The body is one Item or a JSON array of 1 to BULK_CREATE_MAX of them.
+
+    Returns:
+        tuple: the deserialized Items and whether the body was an array
+    """
+    bulk = isinstance(item_json, list)
+    items_json = item_json if bulk else [item_json]
+    if not items_json:
+        abort(status.HTTP_400_BAD_REQUEST, "At least one item is required")
+    if len(items_json) > config["BULK_CREATE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"No more than {config['BULK_CREATE_MAX']} items can be added at once",
+        )
+    return Item.deserialize_new(shopcart_id, items_json), bulk
+
+
+######################################################################
+#  R E S P O N S E S
+######################################################################
+
+
+def list_etag(etag, ndjson):
+    """Returns the ETag of a list from the ETag of its records"""
+    # NDJSON is a different representation and needs a different ETag
+    return etag + ("-ndjson" if ndjson else "")
+
+
+def revalidated(response, etag, vary=None):
+    """
+    Sets the ETag of a response that clients must revalidate before reuse
+
+    Args:
+        vary (str): the request header the representation depends on
+    """
+    response.set_etag(etag)
+    # clients may keep the response but must revalidate it before reuse
+    response.cache_control.no_cache = True
+    if vary:
+        response.vary.add(vary)
+    return response
+
+
+@contextmanager
+def unique_item_names(shopcart_id):
+    """
+    Answers 409 Conflict when new Items repeat an Item name of the Shopcart
+
+    The unique index on the shopcart_id and name refuses them, and the
+    message tells the client how to add to the quantity instead.
+    """
+    try:
+        yield
+    except DuplicateError:
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"Shopcart {shopcart_id} can only hold one item of each name, "
+            "POST with ?merge=true to add to the quantity of an item instead",
+        )
+
+
+def added_status(versions):
+    """Returns 201 Created if an upsert created an Item (still at version 1), else 200 OK"""
+    return status.HTTP_201_CREATED if 1 in versions else status.HTTP_200_OK
+
+
+def added_location(url_for, shopcart_id, item_ids, bulk):
+    """
+    Returns the Location of the Items added to a Shopcart
+
+    Args:
+        url_for: builds the external URL of an endpoint from its arguments
+        item_ids (list): the ids of the Items, in the order of the request
+        bulk (bool): the Items were sent as a JSON array
+    """
+    if bulk:
+        return url_for("list_items", shopcart_id=shopcart_id)
+    return url_for("get_items", shopcart_id=shopcart_id, item_id=item_ids[0])
+
+
+def next_page_headers(request, url_for, records, limit):
+    """
+    Returns the Link and X-Next-Cursor headers of a page, if there is more
+
+    records holds up to limit + 1 records; when the extra one is there the
+    headers point at the next page.
+    """
+    if len(records) <= limit:
+        return {}
+    next_cursor = encode_cursor(records[limit - 1]["id"])
+    args = request.args.to_dict()
+    args.update(cursor=next_cursor, limit=limit)
+    next_url = url_for(request.endpoint, **request.view_args, **args)
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
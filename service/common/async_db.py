@@ -0,0 +1,140 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Async Database
+
+Runs SQLAlchemy statements for the ASGI app without blocking its event
+loop. With greenlet installed (pip install "sqlalchemy[asyncio]") they go
+through SQLAlchemy's asyncio extension and the async psycopg driver.
+Without it the statements run on a regular engine in a pool of worker
+threads, which keeps the app working at the cost of a thread per
+connection.
+
+Both hand out connections whose execute() is awaited and returns a
+buffered result, so the callers do not know which one they are using.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine
+
+try:
+    import greenlet  # noqa: F401 pylint: disable=unused-import
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # pragma: no cover
+    create_async_engine = None
+
+logger = logging.getLogger("flask.app")
+
+
+class AsyncDatabase:
+    """Runs statements with SQLAlchemy's asyncio extension"""
+
+    executor = "asyncio"
+
+    def __init__(self, uri, **options):
+        self.engine = create_async_engine(uri, **options)
+
+    @asynccontextmanager
+    async def begin(self):
+        """A connection in a transaction that is committed unless the block raises"""
+        async with self.engine.begin() as connection:
+            yield connection
+
+    async def run_sync(self, func):
+        """Calls func with a synchronous connection, e.g. metadata.create_all"""
+        async with self.engine.begin() as connection:
+            await connection.run_sync(func)
+
+    async def dispose(self):
+        """Closes every pooled connection"""
+        await self.engine.dispose()
+
+
+class ThreadedConnection:
+    """A Connection whose statements are run in the database's worker threads"""
+
+    def __init__(self, database, connection):
+        self.database = database
+        self.connection = connection
+
+    async def execute(self, statement, parameters=None):
+        """Executes a statement and returns its buffered result"""
+        return await self.database.run(self.connection.execute, statement, parameters)
+
+
+class ThreadedDatabase:
+    """Runs statements on a synchronous engine in worker threads
+
+    There is one worker thread per connection the pool can open, and no
+    more transactions than that are started at once. Otherwise threads
+    blocked waiting for a free connection could take every worker and
+    leave none to commit and give a connection back.
+    """
+
+    executor = "threads"
+
+    def __init__(self, uri, **options):
+        self.engine = create_engine(uri, **options)
+        capacity = options.get("pool_size", 5) + max(options.get("max_overflow", 10), 0)
+        self.workers = ThreadPoolExecutor(max_workers=capacity, thread_name_prefix="async-db")
+        self.slots = asyncio.Semaphore(capacity)
+
+    async def run(self, func, *args):
+        """Calls func in a worker thread and returns its result"""
+        return await asyncio.get_running_loop().run_in_executor(self.workers, func, *args)
+
+    @asynccontextmanager
+    async def begin(self):
+        """A connection in a transaction that is committed unless the block raises"""
+        async with self.slots:
+            connection = await self.run(self.engine.connect)
+            try:
+                yield ThreadedConnection(self, connection)
+                await self.run(connection.commit)
+            finally:
+                # returning it to the pool rolls back whatever was not committed
+                await self.run(connection.close)
+
+    async def run_sync(self, func):
+        """Calls func with a synchronous connection, e.g. metadata.create_all"""
+        await self.run(self._run_sync, func)
+
+    def _run_sync(self, func):
+        with self.engine.begin() as connection:
+            func(connection)
+
+    async def dispose(self):
+        """Closes every pooled connection"""
+        await self.run(self.engine.dispose)
+
+
+def init_database(config):
+    """Returns the database named by ASYNC_DB_EXECUTOR for an app config"""
+    executor = config.get("ASYNC_DB_EXECUTOR", "auto")
+    if executor not in ("auto", "asyncio", "threads"):
+        raise ValueError(f"ASYNC_DB_EXECUTOR must be auto, asyncio or threads, not {executor!r}")
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    options = config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if executor != "threads" and create_async_engine is None:
+        logger.warning("greenlet is not installed, running statements in worker threads")
+        executor = "threads"
+    if executor == "threads":
+        return ThreadedDatabase(uri, **options)
+    return AsyncDatabase(uri, **options)
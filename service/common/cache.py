@@ -0,0 +1,148 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Read Cache
+
+A bounded, in-process LRU cache whose entries also expire after a TTL. It
+holds serialized resources so repeated reads of the same Shopcart or Item
+skip the database. The models invalidate entries on every write, but the
+cache is per worker process, so a write handled by another worker is only
+seen here once the entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread safe LRU cache with a maximum size and a time to live
+
+    An entry may be stored under a parent key. Invalidating the parent with
+    invalidate_children() drops every entry stored under it, which is how
+    the Items cached under a deleted Shopcart are removed.
+
+    Every invalidation bumps generation. A reader that passes the generation
+    it saw before going to the database to set() never caches a value that a
+    concurrent write has already invalidated.
+    """
+
+    def __init__(self, max_entries=1024, ttl=10.0, enabled=True, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, parent)
+        self._children = {}  # parent key -> set of child keys
+        self._clock = clock
+        self.generation = 0
+        self.configure(max_entries, ttl, enabled)
+
+    def configure(self, max_entries, ttl, enabled=True):
+        """Changes the size, TTL and switch of the cache and empties it"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.clear()
+
+    def clear(self):
+        """Removes every entry and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._children.clear()
+            self.generation += 1
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value for key or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, parent=None, generation=None):
+        """Caches value under key, evicting the least recently used entry when full
+
+        Nothing is cached if generation is given and something was
+        invalidated since, because value may already be out of date
+        """
+        if not self.enabled or self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl, value, parent)
+            if parent is not None:
+                self._children.setdefault(parent, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Removes the entries for the given keys"""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_children(self, *parents):
+        """Removes every entry stored under one of the given parent keys"""
+        with self._lock:
+            self.generation += 1
+            for parent in parents:
+                for key in self._children.pop(parent, set()):
+                    self._remove(key)
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and eviction counters and the current size"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        """Removes one entry; the lock must be held"""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            siblings = self._children.get(entry[2])
+            if siblings is not None:
+                siblings.discard(key)
+                if not siblings:
+                    del self._children[entry[2]]
+
+
+CACHE = LRUCache()
+
+
+def init_cache(app):
+    """Configures the read cache from the application config"""
+    CACHE.configure(
+        max_entries=app.config.get("CACHE_MAX_ENTRIES", 1024),
+        ttl=app.config.get("CACHE_TTL", 10.0),
+        enabled=app.config.get("CACHE_ENABLED", True),
+    )
@@ -16,8 +16,10 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.common import migrations
+from service.models import db, SchemaVersion, Shopcart, SCHEMA_VERSION
 
 
 ######################################################################
@@ -33,4 +35,48 @@ def db_create():
     """
     db.drop_all()
     db.create_all()
+    SchemaVersion.stamp(db.session)
     db.session.commit()
+
+
+######################################################################
+# Command to apply the schema migrations a database is missing
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """Applies the missing schema migrations in order"""
+    version = migrations.upgrade(db.engine)
+    click.echo(f"Schema is at version {version}")
+
+
+######################################################################
+# Command to list the schema migrations and whether they were applied
+# Usage:
+#   flask db-status
+######################################################################
+@app.cli.command("db-status")
+def db_status():
+    """Shows the schema version and the migrations still to apply"""
+    version, steps = migrations.status(db.engine)
+    click.echo(f"Schema is at version {version} of {SCHEMA_VERSION}")
+    for step, applied_at in steps:
+        if step.version > version:
+            state = "pending"
+        else:
+            state = f"applied {applied_at:%Y-%m-%d %H:%M:%S}" if applied_at else "applied"
+        click.echo(f"{step.version:>4}  {state:<27}  {step.description}")
+
+
+######################################################################
+# Command to recompute the shopcart summaries that drifted from their items
+# Usage:
+#   flask db-reconcile [--batch-size 1000]
+######################################################################
+@app.cli.command("db-reconcile")
+@click.option("--batch-size", default=1000, show_default=True, help="Shopcarts checked per transaction")
+def db_reconcile(batch_size):
+    """Resets the item count and subtotal of shopcarts from their items"""
+    checked, fixed = Shopcart.reconcile_summaries(db.engine, batch_size)
+    click.echo(f"Checked {checked} shopcarts, fixed {fixed}")
@@ -15,20 +15,36 @@
 ######################################################################
 """
 Error handlers for RESTful API
+
+The ASGI app (service/async_app.py) sends the same error bodies with
+error_body()
 """
 from flask import jsonify
+from werkzeug.http import HTTP_STATUS_CODES
 from service.common import status
-from service.models import DataValidationError
+from service.models import DataValidationError, ConcurrencyError, DuplicateError
+
+# The error title of each status code
+ERRORS = {
+    status.HTTP_400_BAD_REQUEST: "Bad Request",
+    status.HTTP_404_NOT_FOUND: "Not Found",
+    status.HTTP_405_METHOD_NOT_ALLOWED: "Method not Allowed",
+    status.HTTP_409_CONFLICT: "Conflict",
+    status.HTTP_412_PRECONDITION_FAILED: "Precondition Failed",
+    status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: "Request Entity Too Large",
+    status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: "Unsupported media type",
+}
+
+
+def error_body(code, message) -> dict:
+    """Returns the JSON body of an error response"""
+    return {"status": code, "error": ERRORS.get(code, HTTP_STATUS_CODES.get(code)), "message": message}
 
 
 def not_found(error):
     """Creates a not found error response"""
     return (
-        jsonify(
-            status=status.HTTP_404_NOT_FOUND,
-            error="Not Found",
-            message=error.description,
-        ),
+        jsonify(error_body(status.HTTP_404_NOT_FOUND, error.description)),
         status.HTTP_404_NOT_FOUND,
     )
 
@@ -36,23 +52,31 @@ def not_found(error):
 def method_not_supported(error):
     """Creates a method not supported error response"""
     return (
-        jsonify(
-            status=status.HTTP_405_METHOD_NOT_ALLOWED,
-            error="Method not Allowed",
-            message=error.description,
-        ),
+        jsonify(error_body(status.HTTP_405_METHOD_NOT_ALLOWED, error.description)),
         status.HTTP_405_METHOD_NOT_ALLOWED,
     )
 
 
+def conflict(error):
+    """Creates a conflict error response"""
+    return (
+        jsonify(error_body(status.HTTP_409_CONFLICT, getattr(error, "description", str(error)))),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+def request_entity_too_large(error):
+    """Creates a request entity too large error response"""
+    return (
+        jsonify(error_body(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, error.description)),
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
 def mediator_unsupported(error):
     """Creates a mediator not supported error response"""
     return (
-        jsonify(
-            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            error="Unsupported media type",
-            message=error.description,
-        ),
+        jsonify(error_body(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, error.description)),
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
     )
 
@@ -60,31 +84,38 @@ def mediator_unsupported(error):
 def bad_request(error):
     """Creates a bad request error response"""
     return (
-        jsonify(
-            status=status.HTTP_400_BAD_REQUEST,
-            error="Bad Request",
-            message=error.description,
-        ),
+        jsonify(error_body(status.HTTP_400_BAD_REQUEST, error.description)),
         status.HTTP_400_BAD_REQUEST,
     )
 
 
 def data_validation_error(error):
     """Creates a data validation error response"""
+    return (
+        jsonify(error_body(status.HTTP_400_BAD_REQUEST, str(error))),
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def precondition_failed(error):
+    """Creates a precondition failed error response"""
     return (
         jsonify(
-            status=status.HTTP_400_BAD_REQUEST,
-            error="Bad Request",
-            message=str(error),
+            error_body(status.HTTP_412_PRECONDITION_FAILED, getattr(error, "description", str(error)))
         ),
-        status.HTTP_400_BAD_REQUEST,
+        status.HTTP_412_PRECONDITION_FAILED,
     )
 
 
 def initialize_error_handlers(app):
     """Initialize all error handlers"""
     app.errorhandler(DataValidationError)(data_validation_error)
+    app.errorhandler(ConcurrencyError)(precondition_failed)
+    app.errorhandler(DuplicateError)(conflict)
     app.errorhandler(status.HTTP_400_BAD_REQUEST)(bad_request)
     app.errorhandler(status.HTTP_404_NOT_FOUND)(not_found)
     app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)(method_not_supported)
+    app.errorhandler(status.HTTP_409_CONFLICT)(conflict)
+    app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)(precondition_failed)
+    app.errorhandler(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)(request_entity_too_large)
     app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)(mediator_unsupported)
@@ -0,0 +1,124 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+JSON Provider
+
+Encodes responses and parses request bodies with orjson when it is
+installed, falling back to Flask's stdlib provider when it is not. The
+output is the same JSON Flask produces: keys are sorted and datetimes,
+dates, Decimals and UUIDs go through Flask's own default hook, so
+time_atc stays an HTTP date and price a string. The only difference is
+that non-ASCII text is sent as UTF-8 instead of \\u escapes.
+"""
+import logging
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger("flask.app")
+
+# How Flask's default hook encodes the types every cart and item carries,
+# looked up by exact type before falling back to its chain of isinstance
+ENCODERS = {
+    datetime: http_date,
+    date: http_date,
+    Decimal: str,
+    uuid.UUID: str,
+}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """A JSON provider that uses orjson and behaves like the default one"""
+
+    def _default(self, obj):
+        """Encodes the types orjson leaves to the default hook"""
+        encoder = ENCODERS.get(type(obj))
+        if encoder is not None:
+            return encoder(obj)
+        return self.default(obj)
+
+    def _options(self, indent=False):
+        """Returns the orjson flags matching the provider settings"""
+        # datetimes are handed to the default hook to keep the HTTP date format
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        """Serializes obj to a JSON string
+
+        Keyword arguments orjson has no equivalent for (a custom encoder
+        class, separators other than the compact ones, ...) are passed on
+        to the stdlib provider, as is anything orjson cannot encode such as
+        integers wider than 64 bits.
+        """
+        indent = kwargs.pop("indent", None)
+        if kwargs.pop("separators", (",", ":")) != (",", ":") or kwargs or indent not in (None, 2):
+            return super().dumps(obj, indent=indent, **kwargs)
+        return self._encode(obj, indent=bool(indent)).decode()
+
+    def _encode(self, obj, indent=False):
+        """Serializes obj to JSON bytes"""
+        try:
+            return orjson.dumps(obj, default=self._default, option=self._options(indent))
+        except orjson.JSONEncodeError:
+            layout = {"indent": 2} if indent else {"separators": (",", ":")}
+            return super().dumps(obj, **layout).encode()
+
+    def loads(self, s, **kwargs):
+        """Parses JSON text or UTF-8 bytes"""
+        if kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # the stdlib also accepts NaN, Infinity and integers of any size
+            # and raises the error Flask turns into 400 Bad Request
+            return super().loads(s)
+
+    def response(self, *args, **kwargs):
+        """Returns a JSON response without going through a str"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self._encode(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
+
+
+def init_json(app):
+    """Use the JSON provider named by JSON_PROVIDER for the app"""
+    provider = app.config.get("JSON_PROVIDER", "auto")
+    if provider not in ("auto", "orjson", "stdlib"):
+        raise ValueError(f"JSON_PROVIDER must be auto, orjson or stdlib, not {provider!r}")
+    if provider == "stdlib":
+        return
+    if orjson is None:
+        if provider == "orjson":
+            logger.warning("JSON_PROVIDER is orjson but it is not installed, using the stdlib")
+        return
+    app.json = OrjsonProvider(app)
@@ -0,0 +1,205 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Metrics
+
+Counts the requests of every endpoint by method and status code and keeps
+a latency histogram per endpoint, rendered in the Prometheus text format by
+GET /metrics.
+
+Each gunicorn worker is a separate process with its own counters. When
+METRICS_MULTIPROC_DIR is set every worker periodically writes its counters
+to <dir>/requests_<pid>.json and /metrics adds up all of the files, so the
+numbers cover every worker no matter which one answers the scrape.
+gunicorn.conf.py empties the directory before the workers start.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+
+logger = logging.getLogger("flask.app")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """Thread safe request counters and latency histograms"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.directory = None
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+        self.reset()
+
+    def configure(self, directory=None, flush_interval=1.0):
+        """Turns the multiprocess mode on when directory is set"""
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            # (endpoint, method, status) -> count
+            self._requests = {}
+            # (endpoint, method) -> [per bucket counts..., +Inf count, sum]
+            self._latency = {}
+
+    def observe(self, endpoint, method, status, seconds):
+        """Records one request"""
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get((endpoint, method))
+            if histogram is None:
+                histogram = [0] * (len(self.buckets) + 1) + [0.0]
+                self._latency[(endpoint, method)] = histogram
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        """Returns the counters of this process as a JSON serializable dict"""
+        with self._lock:
+            return {
+                "requests": [[*key, count] for key, count in self._requests.items()],
+                "latency": [[*key, list(hist)] for key, hist in self._latency.items()],
+            }
+
+    def flush(self):
+        """Writes the counters of this process to the multiprocess directory"""
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.directory, f"requests_{os.getpid()}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file)
+        # readers only ever see a complete file
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> dict:
+        """Returns the counters of every worker, or just this one"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "requests_*.json")):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError) as error:
+                logger.warning("Skipping unreadable metrics file %s: %s", path, error)
+        return merge(snapshots)
+
+    def render(self) -> str:
+        """Returns the counters in the Prometheus text exposition format"""
+        data = self.collect()
+        lines = [
+            "# HELP http_requests_total Requests by endpoint, method and status code",
+            "# TYPE http_requests_total counter",
+        ]
+        for endpoint, method, status, count in sorted(data["requests"]):
+            labels = _labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f"http_requests_total{{{labels}}} {count}")
+
+        lines.append(
+            "# HELP http_request_duration_seconds Request latency by endpoint and method"
+        )
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for endpoint, method, histogram in sorted(data["latency"]):
+            labels = _labels(endpoint=endpoint, method=method)
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram):
+                cumulative += count
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram[-1]}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def merge(snapshots) -> dict:
+    """Adds up the counters of several snapshots"""
+    requests = {}
+    latency = {}
+    for snapshot in snapshots:
+        for *key, count in snapshot["requests"]:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + count
+        for endpoint, method, histogram in snapshot["latency"]:
+            total = latency.setdefault((endpoint, method), [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                total[index] += value
+    return {
+        "requests": [[*key, count] for key, count in requests.items()],
+        "latency": [[*key, histogram] for key, histogram in latency.items()],
+    }
+
+
+def _labels(**labels) -> str:
+    """Formats Prometheus labels, escaping the values"""
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _escape(value) -> str:
+    """Escapes a label value as the text format requires"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = RequestMetrics()
+
+
+def _start_timer():
+    """Remembers when the request started"""
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    """Records the endpoint, status and latency of the request"""
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        METRICS.observe(
+            request.endpoint or "unmatched",
+            request.method,
+            response.status_code,
+            time.perf_counter() - start,
+        )
+    return response
+
+
+def init_metrics(app):
+    """Start recording the metrics of every request"""
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    METRICS.configure(
+        directory=app.config.get("METRICS_MULTIPROC_DIR"),
+        flush_interval=app.config.get("METRICS_FLUSH_INTERVAL", 1.0),
+    )
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
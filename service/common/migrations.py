@@ -0,0 +1,240 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Migrations
+
+The ordered changes that bring a database to SCHEMA_VERSION, the version
+of the last one. Each one is recorded in the schema_version table once it
+is applied, and upgrade() applies the ones a database is missing under a
+PostgreSQL advisory lock, so only one process changes the schema at a time.
+
+A new database gets the current tables from migration 1, so every later
+migration must be a no-op when its change is already there (IF NOT EXISTS).
+A database created by db.create_all() before versions were recorded
+counts as version 1.
+
+Migrations that build indexes are not transactional: on PostgreSQL the
+index is built CONCURRENTLY, which keeps the table open for writes but
+cannot run inside a transaction. Neither are migrations that fill in
+every row, which commit one batch at a time.
+"""
+import logging
+from collections import namedtuple
+
+from sqlalchemy import inspect, text
+
+from service.models import db, SchemaVersion, Shopcart
+
+logger = logging.getLogger("flask.app")
+
+# Key of the advisory lock held while the schema is being changed
+SCHEMA_LOCK_ID = 28200001
+
+Migration = namedtuple("Migration", "version description upgrade transactional")
+
+MIGRATIONS = []
+
+
+def migration(version, description, transactional=True):
+    """Registers the decorated function as the migration to version"""
+
+    def register(upgrade_func):
+        MIGRATIONS.append(Migration(version, description, upgrade_func, transactional))
+        return upgrade_func
+
+    return register
+
+
+######################################################################
+# M I G R A T I O N S
+######################################################################
+@migration(1, "Create the shopcart and item tables")
+def create_tables(connection):
+    """Creates every table of the models that is missing"""
+    db.metadata.create_all(connection)
+
+
+@migration(2, "Add updated_at and version to shopcart and item")
+def add_row_versions(connection):
+    """Adds the columns the ETags and optimistic locking are built on"""
+    for table in ("shopcart", "item"):
+        connection.execute(
+            text(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at "
+                "TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP"
+            )
+        )
+        connection.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1")
+        )
+
+
+@migration(3, "Index shopcart.customer_id, item.shopcart_id and item.name", transactional=False)
+def index_hot_queries(connection):
+    """Indexes the columns the list filters and the item lookups search"""
+    create_index(connection, "shopcart", "customer_id")
+    create_index(connection, "item", "shopcart_id")
+    create_index(connection, "item", "name")
+
+
+@migration(4, "Add item_count, unit_count and subtotal to shopcart", transactional=False)
+def add_cart_summaries(connection):
+    """Adds the summary columns and fills them in from the Items
+
+    Adding a column with a constant default does not rewrite the table.
+    The summaries are then computed a batch of Shopcarts at a time, so
+    no Shopcart is locked for longer than its own batch.
+    """
+    for column, column_type in (
+        ("item_count", "INTEGER"),
+        ("unit_count", "INTEGER"),
+        ("subtotal", "DOUBLE PRECISION"),
+    ):
+        connection.execute(
+            text(f"ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS {column} {column_type} NOT NULL DEFAULT 0")
+        )
+    Shopcart.reconcile_summaries(connection.engine)
+
+
+@migration(5, "Merge duplicate Items and index item (shopcart_id, name) as unique", transactional=False)
+def unique_item_names(connection):
+    """Makes the Items of a Shopcart unique by name, which upserts merge on
+
+    Items with the same name in a Shopcart become the one with the lowest
+    id, holding all of their quantity. The Shopcarts they were in get their
+    summaries computed again, since the merged Items keep only one price.
+    """
+    with connection.engine.begin() as merging:
+        merging.execute(
+            text(
+                "UPDATE item SET quantity = (SELECT sum(same.quantity) FROM item AS same "
+                "WHERE same.shopcart_id = item.shopcart_id AND same.name = item.name), "
+                "version = version + 1, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id IN (SELECT min(id) FROM item WHERE name IS NOT NULL "
+                "GROUP BY shopcart_id, name HAVING count(*) > 1)"
+            )
+        )
+        merged = merging.execute(
+            text(
+                "DELETE FROM item WHERE name IS NOT NULL AND id NOT IN "
+                "(SELECT min(id) FROM item WHERE name IS NOT NULL GROUP BY shopcart_id, name)"
+            )
+        ).rowcount
+    if merged:
+        logger.warning("Merged %d duplicate items", merged)
+        Shopcart.reconcile_summaries(connection.engine)
+    create_index(connection, "item", "shopcart_id", "name", unique=True)
+
+
+def create_index(connection, table, *columns, unique=False):
+    """Builds ix_<table>_<columns> without blocking writes on PostgreSQL
+
+    A concurrent build that failed half way leaves an invalid index behind,
+    which IF NOT EXISTS would keep, so it is dropped and built again. That
+    includes a unique index that a duplicate written during its build broke.
+    """
+    name = f"ix_{table}_{'_'.join(columns)}"
+    create = f"CREATE {'UNIQUE ' if unique else ''}INDEX"
+    on = f"{table} ({', '.join(columns)})"
+    if connection.dialect.name != "postgresql":
+        connection.execute(text(f"{create} IF NOT EXISTS {name} ON {on}"))
+        return
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+            "WHERE pg_class.relname = :name AND pg_table_is_visible(pg_class.oid) "
+            "AND NOT pg_index.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        logger.warning("Rebuilding the invalid index %s", name)
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"{create} CONCURRENTLY IF NOT EXISTS {name} ON {on}"))
+
+
+######################################################################
+# R U N N E R
+######################################################################
+def database_version(connection):
+    """Returns the version of the schema in the database, 0 when it is empty"""
+    version = SchemaVersion.current_in_transaction(connection)
+    if version is None:
+        # tables made by db.create_all() before versions were recorded
+        return 1 if inspect(connection).has_table("shopcart") else 0
+    return version
+
+
+def pending(version):
+    """Returns the migrations a database at version is missing"""
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def upgrade(engine):
+    """Applies the missing migrations in order and returns the new version"""
+    with engine.connect() as lock:
+        lock_schema(lock)
+        try:
+            with engine.begin() as connection:
+                version = database_version(connection)
+                # databases from before versions were recorded have no table for them
+                SchemaVersion.__table__.create(connection, checkfirst=True)
+            for step in pending(version):
+                apply(engine, step)
+                version = step.version
+        finally:
+            unlock_schema(lock)
+    return version
+
+
+def apply(engine, step):
+    """Runs one migration and records its version"""
+    logger.info("Migrating the schema to version %s: %s", step.version, step.description)
+    if step.transactional:
+        with engine.begin() as connection:
+            step.upgrade(connection)
+            SchemaVersion.stamp(connection, step.version)
+        return
+    with engine.connect() as connection:
+        step.upgrade(connection.execution_options(isolation_level="AUTOCOMMIT"))
+    with engine.begin() as connection:
+        SchemaVersion.stamp(connection, step.version)
+
+
+def status(engine):
+    """Returns the version of the database and (migration, applied_at or None) pairs"""
+    with engine.connect() as connection:
+        version = database_version(connection)
+        applied = {}
+        if inspect(connection).has_table(SchemaVersion.__tablename__):
+            rows = connection.execute(db.select(SchemaVersion.version, SchemaVersion.applied_at))
+            applied = dict(rows.all())
+    return version, [(m, applied.get(m.version)) for m in MIGRATIONS]
+
+
+def lock_schema(connection):
+    """Waits for and takes the schema lock for the session of connection"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": SCHEMA_LOCK_ID})
+        connection.commit()
+
+
+def unlock_schema(connection):
+    """Releases the schema lock"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": SCHEMA_LOCK_ID})
+        connection.commit()
@@ -0,0 +1,99 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Pagination cursors
+
+Cursors are opaque to clients. They wrap the id of the last record on a page
+so the next page can be fetched with a keyset (id > last id) scan. The
+query arguments of pages and of batches of ids are parsed here as well.
+"""
+import base64
+import binascii
+import json
+
+
+def encode_cursor(last_id: int) -> str:
+    """Creates an opaque cursor that resumes after last_id"""
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Returns the last id held by a cursor
+
+    Raises:
+        ValueError: if the cursor was not created by encode_cursor
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return last_id
+
+
+def page_args(args, default_limit: int, max_limit: int) -> tuple:
+    """Returns the page size and the id to page after from query arguments
+
+    Args:
+        args: the query arguments holding limit and/or cursor
+        default_limit (int): the page size when no limit is given
+        max_limit (int): the largest page size handed out
+
+    Returns:
+        tuple: the limit (clamped to max_limit) and the decoded cursor
+
+    Raises:
+        ValueError: if the limit or the cursor is not valid
+    """
+    limit = args.get("limit")
+    cursor = args.get("cursor")
+    try:
+        limit = int(limit) if limit is not None else default_limit
+    except ValueError as error:
+        raise ValueError(f"Invalid limit: {limit}") from error
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    after_id = decode_cursor(cursor) if cursor else None
+    return min(limit, max_limit), after_id
+
+
+def ids_arg(args, max_ids: int) -> list:
+    """Returns the record ids listed in the ids query argument
+
+    The ids may be comma separated (ids=1,2,3), repeated (ids=1&ids=2) or
+    both; duplicates are dropped and the order is kept.
+
+    Args:
+        args: the query arguments holding ids
+        max_ids (int): the most ids a client may ask for at once
+
+    Raises:
+        ValueError: if there are no ids, too many, or one is not an integer
+    """
+    values = [value for arg in args.getlist("ids") for value in arg.split(",") if value.strip()]
+    if not values:
+        raise ValueError("ids is required")
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except ValueError as error:
+        raise ValueError(f"Invalid ids: {','.join(values)}") from error
+    if len(ids) > max_ids:
+        raise ValueError(f"No more than {max_ids} ids can be asked for at once")
+    return ids
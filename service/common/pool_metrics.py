@@ -0,0 +1,150 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection Pool Metrics
+
+This module instruments the SQLAlchemy connection pool so we can see when
+workers are starved for connections. Counters are fed by pool events and the
+time spent waiting for a connection is timed by InstrumentedQueuePool and
+kept in a histogram.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+# Upper bounds (in seconds) of the connection wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+
+class PoolStats:
+    """Thread safe counters and wait time histogram for a connection pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait_warning = None
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.counters = {
+                "connects": 0,
+                "checkouts": 0,
+                "checkins": 0,
+                "invalidations": 0,
+                "timeouts": 0,
+            }
+            self.wait_buckets = [0] * len(WAIT_BUCKETS)
+            self.wait_count = 0
+            self.wait_sum = 0.0
+
+    def increment(self, name):
+        """Adds one to a counter"""
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe_wait(self, seconds):
+        """Records how long a checkout waited for a connection"""
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_buckets[index] += 1
+                    break
+        if self.wait_warning is not None and seconds > self.wait_warning:
+            logger.warning("Waited %.3fs for a database connection", seconds)
+
+    def snapshot(self, pool=None) -> dict:
+        """Returns the counters, the histogram and the live pool gauges
+
+        Histogram buckets are cumulative like Prometheus: each count includes
+        every wait less than or equal to its bound
+        """
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(WAIT_BUCKETS, self.wait_buckets):
+                cumulative += count
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            stats = dict(self.counters)
+            stats["wait_seconds"] = {
+                "count": self.wait_count,
+                "sum": round(self.wait_sum, 6),
+                "buckets": buckets,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+            )
+        return stats
+
+
+POOL_STATS = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that times how long each checkout waits for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_STATS.increment("timeouts")
+            raise
+        finally:
+            POOL_STATS.observe_wait(time.perf_counter() - start)
+
+
+def configure_pool(app):
+    """Selects the instrumented pool; call this before db.init_app()"""
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # SQLite gets its own pool class from Flask-SQLAlchemy
+        return
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options.setdefault("poolclass", InstrumentedQueuePool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def init_pool_metrics(app, engine):
+    """Listen to the pool events of an engine"""
+    POOL_STATS.wait_warning = app.config.get("DB_POOL_WAIT_WARNING")
+    for name, counter in (
+        ("connect", "connects"),
+        ("checkout", "checkouts"),
+        ("checkin", "checkins"),
+        ("invalidate", "invalidations"),
+    ):
+        event.listen(engine, name, _counter_listener(counter))
+
+
+def _counter_listener(counter):
+    """Returns a pool event listener that increments counter"""
+
+    def listener(*args):  # pylint: disable=unused-argument
+        POOL_STATS.increment(counter)
+
+    return listener
@@ -0,0 +1,196 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Statistics
+
+This module counts the SQL statements each request executes by listening
+to SQLAlchemy cursor events. The count is kept on flask.g and can be sent
+back in an X-Query-Count response header, and QueryCounter can be used to
+count the statements run by any block of code.
+
+With SERVER_TIMING enabled the time spent in the database and serializing
+records is also added up per request; without it the statements are not
+timed at all. It is sent in a Server-Timing header
+and logged in one access log line when the response has been sent.
+"""
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+SERVER_TIMING_HEADER = "Server-Timing"
+
+# Key in Connection.info of the start times of the statements in flight
+_QUERY_START = "query_start"
+
+_active_counters = []
+
+
+class QueryCounter:
+    """Context manager that counts the SQL statements executed inside it"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        _active_counters.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_counters.remove(self)
+
+
+def query_count() -> int:
+    """Returns the number of SQL statements run by the current request"""
+    return g.get("query_count", 0)
+
+
+def _before_cursor_execute(*args):  # pylint: disable=unused-argument
+    """Counts every statement sent to the database"""
+    for counter in _active_counters:
+        counter.count += 1
+    if has_app_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def _start_query_timer(conn, *args):  # pylint: disable=unused-argument
+    """Remembers when a statement was sent"""
+    conn.info.setdefault(_QUERY_START, []).append(time.perf_counter())
+
+
+def _stop_query_timer(conn, *args):  # pylint: disable=unused-argument
+    """Adds the time a statement took to the database time of the request"""
+    elapsed = time.perf_counter() - conn.info[_QUERY_START].pop()
+    if has_app_context():
+        g.db_time = g.get("db_time", 0.0) + elapsed
+
+
+def _drop_query_timer(context):
+    """Forgets the start time of a statement that failed"""
+    if context.connection is not None and context.execution_context is not None:
+        starts = context.connection.info.get(_QUERY_START)
+        if starts:
+            starts.pop()
+
+
+def add_serialize_time(seconds):
+    """Adds time spent serializing records to the current request"""
+    if has_app_context():
+        g.serialize_time = g.get("serialize_time", 0.0) + seconds
+
+
+@contextmanager
+def serialize_timer():
+    """Times the serialization of records done inside the block"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_serialize_time(time.perf_counter() - start)
+
+
+def request_timings(stats=None) -> dict:
+    """Returns the query count and the milliseconds spent so far by a request
+
+    Args:
+        stats: the flask.g of the request (defaults to the current one)
+    """
+    stats = g if stats is None else stats
+    return {
+        "queries": stats.get("query_count", 0),
+        "db_ms": stats.get("db_time", 0.0) * 1000,
+        "serialize_ms": stats.get("serialize_time", 0.0) * 1000,
+        "total_ms": (time.perf_counter() - stats.get("request_start", time.perf_counter())) * 1000,
+    }
+
+
+def server_timing(timings) -> str:
+    """Formats request timings as a Server-Timing header value"""
+    return (
+        f'db;dur={timings["db_ms"]:.2f};desc="{timings["queries"]} queries", '
+        f'serialize;dur={timings["serialize_ms"]:.2f}, '
+        f'total;dur={timings["total_ms"]:.2f}'
+    )
+
+
+def _reset_query_count():
+    """Starts every request with a count of zero"""
+    g.query_count = 0
+    g.db_time = 0.0
+    g.serialize_time = 0.0
+    g.request_start = time.perf_counter()
+
+
+def _add_query_count_header(response):
+    """Reports the statement count of the request when enabled"""
+    if current_app.config.get("SQL_QUERY_COUNT_HEADER"):
+        response.headers[QUERY_COUNT_HEADER] = str(query_count())
+    return response
+
+
+def _add_server_timing(response):
+    """Reports where the time of the request went when enabled
+
+    A streamed body is produced after this runs, so its header only covers
+    the work done up to the first byte; the access log line is written once
+    the response is closed and covers all of it.
+    """
+    if not current_app.config.get("SERVER_TIMING"):
+        return response
+    response.headers[SERVER_TIMING_HEADER] = server_timing(request_timings())
+    logger = current_app.logger
+    method, path, status = request.method, request.full_path.rstrip("?"), response.status_code
+    # the request context may be gone by the time the response is closed
+    stats = g._get_current_object()  # pylint: disable=protected-access
+
+    def log_access():
+        timings = request_timings(stats)
+        logger.info(
+            "%s %s %s queries=%d db_ms=%.2f serialize_ms=%.2f total_ms=%.2f",
+            method,
+            path,
+            status,
+            timings["queries"],
+            timings["db_ms"],
+            timings["serialize_ms"],
+            timings["total_ms"],
+        )
+
+    response.call_on_close(log_access)
+    return response
+
+
+def time_queries(engine):
+    """Start adding the time of every statement of the engine to its request"""
+    if not event.contains(engine, "before_cursor_execute", _start_query_timer):
+        event.listen(engine, "before_cursor_execute", _start_query_timer)
+        event.listen(engine, "after_cursor_execute", _stop_query_timer)
+        event.listen(engine, "handle_error", _drop_query_timer)
+
+
+def init_query_stats(app, engine):
+    """Start counting the SQL statements of every request, and timing them if enabled"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    if app.config.get("SERVER_TIMING"):
+        time_queries(engine)
+    app.before_request(_reset_query_count)
+    app.after_request(_add_query_count_header)
+    app.after_request(_add_server_timing)
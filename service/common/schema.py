@@ -0,0 +1,82 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Startup
+
+What a worker does to the schema when it starts, set by DB_SCHEMA_STARTUP:
+
+    create  runs db.create_all(), which adds missing tables but never
+            changes existing ones
+    check   reads the schema version with one query and, only when it is
+            behind, applies the missing migrations. The workers that find
+            it behind take turns on a PostgreSQL advisory lock, so when
+            many pods roll out at once only the first one changes anything
+    skip    touches nothing, the schema is managed by the deployment
+            (flask db-upgrade)
+"""
+import logging
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from service.common import migrations
+from service.models import db, SchemaVersion, SCHEMA_VERSION
+
+logger = logging.getLogger("flask.app")
+
+MODES = ("create", "check", "skip")
+
+
+def startup_mode(app_config):
+    """Returns the DB_SCHEMA_STARTUP mode of an app config"""
+    mode = app_config.get("DB_SCHEMA_STARTUP", "create")
+    if mode not in MODES:
+        raise ValueError(f"DB_SCHEMA_STARTUP must be create, check or skip, not {mode!r}")
+    return mode
+
+
+def init_schema(app):
+    """Brings the schema up to date the way DB_SCHEMA_STARTUP asks for"""
+    mode = startup_mode(app.config)
+    if mode == "create":
+        db.create_all()
+    elif mode == "check":
+        check_schema(db.engine)
+    else:
+        app.logger.info("Leaving the schema to the deployment")
+
+
+def check_schema(engine):
+    """Migrates the database of engine if it is behind and returns its version"""
+    with engine.connect() as connection:
+        version = SchemaVersion.current(connection)
+    if version is None or version < SCHEMA_VERSION:
+        version = migrations.upgrade(engine)
+    if version > SCHEMA_VERSION:
+        logger.warning("Schema version %s is newer than this code (%s)", version, SCHEMA_VERSION)
+    else:
+        logger.info("Schema is current at version %s", version)
+    return version
+
+
+def check_database(uri):
+    """Runs check_schema on a database with a connection of its own"""
+    engine = create_engine(uri, poolclass=NullPool)
+    try:
+        return check_schema(engine)
+    finally:
+        engine.dispose()
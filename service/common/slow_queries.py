@@ -0,0 +1,148 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Slow Query Log
+
+With SLOW_QUERY_LOG on, times every statement sent by the db engine and
+records the ones slower than SLOW_QUERY_MS as one JSON document per line in a rotating file under
+captures/. Each record has the statement, its bound parameters, the route
+that ran it and, on PostgreSQL, the plan from EXPLAIN (ANALYZE off), so the
+statement is planned again but never executed twice.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+# Records go to their own logger so they never mix with the service logs
+slow_query_logger = logging.getLogger("service.slow_queries")
+slow_query_logger.propagate = False
+
+# Statements that EXPLAIN accepts without running them
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# Longer statements and parameters (e.g. bulk INSERTs) are cut to this size
+MAX_RECORD_CHARS = 4096
+
+
+class SlowQueryRecorder:
+    """Listens to the cursor events of an engine and records slow statements"""
+
+    def __init__(self, threshold_ms, explain=True):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Remembers when the statement was sent"""
+        # pylint: disable=unused-argument, too-many-arguments, too-many-positional-arguments
+        if context is not None:
+            context.slow_query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Records the statement if it was slower than the threshold"""
+        # pylint: disable=unused-argument, too-many-arguments, too-many-positional-arguments
+        start = getattr(context, "slow_query_start", None)
+        if start is None:
+            return
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "statement": _truncate(statement),
+            "parameters": parameters,
+            "route": None,
+            "plan": None,
+        }
+        encoded = json.dumps(parameters, default=str)
+        if len(encoded) > MAX_RECORD_CHARS:
+            record["parameters"] = _truncate(encoded)
+        if has_request_context():
+            record["route"] = f"{request.method} {request.path} ({request.endpoint})"
+        # bulk statements are not worth planning again
+        if self.explain and not executemany and len(statement) <= MAX_RECORD_CHARS:
+            record["plan"] = self.explain_plan(conn, statement, parameters)
+        logger.warning("Slow query took %.1f ms: %s", duration_ms, statement.split("\n")[0])
+        slow_query_logger.warning(json.dumps(record, default=str))
+
+    @staticmethod
+    def explain_plan(conn, statement, parameters):
+        """Returns the plan of a statement without executing it, or None
+
+        EXPLAIN runs on the same DBAPI connection, inside a savepoint so a
+        failure cannot abort the transaction of the request.
+        """
+        if conn.dialect.name != "postgresql":
+            return None
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(f"EXPLAIN (ANALYZE off) {statement}", parameters)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            except Exception as error:  # pylint: disable=broad-except
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                plan = f"EXPLAIN failed: {error}"
+        finally:
+            cursor.close()
+        return plan
+
+
+def _truncate(text):
+    """Cuts text down to MAX_RECORD_CHARS"""
+    if len(text) <= MAX_RECORD_CHARS:
+        return text
+    return f"{text[:MAX_RECORD_CHARS]}... ({len(text)} chars)"
+
+
+def init_slow_queries(app, engine):
+    """Start recording the statements of the engine slower than SLOW_QUERY_MS
+
+    Nothing is listened to and no directory is created unless SLOW_QUERY_LOG is on
+    """
+    threshold_ms = app.config.get("SLOW_QUERY_MS", 0)
+    if not app.config.get("SLOW_QUERY_LOG", False) or threshold_ms <= 0:
+        return None
+    directory = app.config.get("SLOW_QUERY_LOG_DIR", "captures")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "slow_queries.log")
+    if not any(getattr(h, "baseFilename", None) == os.path.abspath(path) for h in slow_query_logger.handlers):
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=app.config.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024),
+            backupCount=app.config.get("SLOW_QUERY_LOG_BACKUPS", 5),
+            delay=True,
+        )
+        slow_query_logger.addHandler(handler)
+    slow_query_logger.setLevel(logging.WARNING)
+
+    recorder = SlowQueryRecorder(threshold_ms, app.config.get("SLOW_QUERY_EXPLAIN", True))
+    event.listen(engine, "before_cursor_execute", recorder.before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", recorder.after_cursor_execute)
+    app.logger.info("Logging queries slower than %s ms to %s", threshold_ms, path)
+    return recorder
@@ -13,7 +13,88 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool tuning, passed straight to create_engine()
+SQLALCHEMY_ENGINE_OPTIONS = {
+    # connections kept open in the pool
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    # extra connections opened under load and closed when returned
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    # seconds to wait for a connection before giving up
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    # seconds after which a connection is replaced (-1 to never recycle)
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    # test each connection with a round trip before handing it out
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+
+# Log a warning whenever a request waits longer than this for a connection
+DB_POOL_WAIT_WARNING = float(os.getenv("DB_POOL_WAIT_WARNING", "0.5"))
+
+# What a worker does to the schema on startup: create runs db.create_all(),
+# check reads the schema version and only migrates the tables when it is
+# behind, skip leaves the schema to whoever deploys it
+DB_SCHEMA_STARTUP = os.getenv("DB_SCHEMA_STARTUP", "create").lower()
+
+# How the list endpoints read records: core builds the JSON straight from
+# row tuples, orm loads model instances and serializes them
+READ_MODEL = os.getenv("READ_MODEL", "core").lower()
+
+# How Shopcart.items is loaded on list endpoints with READ_MODEL=orm:
+# selectin, joined or lazy
+ITEM_LOADER_STRATEGY = os.getenv("ITEM_LOADER_STRATEGY", "selectin")
+
+# Send the number of SQL statements each request ran in X-Query-Count
+SQL_QUERY_COUNT_HEADER = os.getenv("SQL_QUERY_COUNT_HEADER", "false").lower() == "true"
+
+# Send query count, DB and serialization time in Server-Timing and log them
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+# Log statements slower than SLOW_QUERY_MS with their plan to a rotating file
+# in SLOW_QUERY_LOG_DIR (off by default; 0 ms also turns it off)
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+SLOW_QUERY_LOG_DIR = os.getenv("SLOW_QUERY_LOG_DIR", "captures")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+# Encode and parse JSON with orjson when it is installed (auto), always
+# (orjson) or never (stdlib)
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto").lower()
+
+# How the ASGI app (asgi.py) runs its statements: asyncio through SQLAlchemy's
+# asyncio extension, threads on a regular engine, or auto (asyncio when
+# greenlet is installed)
+ASYNC_DB_EXECUTOR = os.getenv("ASYNC_DB_EXECUTOR", "auto").lower()
+
+# Keyset pagination for the list endpoints
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Records read from the server-side cursor per batch when streaming a list
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Most items that can be added to a shopcart in one bulk request
+BULK_CREATE_MAX = int(os.getenv("BULK_CREATE_MAX", "1000"))
+
+# Largest request body in bytes, larger ones get 413 (Flask and ASGI apps)
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(1024 * 1024)))
+
+# Most shopcarts whose totals can be asked for in one request
+TOTALS_BATCH_MAX = int(os.getenv("TOTALS_BATCH_MAX", "500"))
+
+# In-process read cache of serialized shopcarts and items (per worker)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "10"))
+
+# Request counts and latency histograms served by GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Shared directory that gunicorn workers write their counters to, if any
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+# Seconds between writes of a worker's counters to METRICS_MULTIPROC_DIR
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
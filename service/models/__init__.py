@@ -4,6 +4,7 @@ Models for Shopcart
 All of the models are stored in this package
 """
 
-from .persistent_base import db, DataValidationError
+from .persistent_base import db, DataValidationError, ConcurrencyError, DuplicateError, make_etag, write_error
 from .shopcart import Shopcart
 from .item import Item
+from .schema_version import SchemaVersion, SCHEMA_VERSION
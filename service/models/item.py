@@ -19,28 +19,48 @@ Persistent Base class for database CRUD functions
 """
 
 import logging
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes, object_session
+from service.common.cache import CACHE
 from .persistent_base import db, PersistentBase, DataValidationError
 
 logger = logging.getLogger("flask.app")
 
+# Key in Session.info that holds the summary changes of the flush in progress
+SUMMARY_CHANGES = "summary_changes"
+
+# The attributes of an Item that its Shopcart's summary is made of
+SUMMARY_KEYS = ("shopcart_id", "quantity", "price")
+
 
 ######################################################################
 #  A D D R E S S   M O D E L
 ######################################################################
-class Item(db.Model, PersistentBase):
+class Item(db.Model, PersistentBase):  # pylint: disable=too-many-public-methods
     """
     Class that represents an Item
     """
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    shopcart_id = db.Column(
-        db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False
+    # the summary of the Shopcart needs the values these columns had
+    # before an update, even when they were expired, so they are loaded
+    # again before they are changed (active_history)
+    shopcart_id = db.column_property(
+        db.Column(
+            db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"),
+            nullable=False,
+            index=True,
+        ),
+        active_history=True,
     )
-    name = db.Column(db.String(63))
+    name = db.Column(db.String(63), index=True)
     description = db.Column(db.String(63), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    quantity = db.column_property(db.Column(db.Integer, nullable=False), active_history=True)
+    price = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
+
+    # A Shopcart holds one Item of each name, which upsert() merges on
+    __table_args__ = (db.Index("ix_item_shopcart_id_name", "shopcart_id", "name", unique=True),)
 
     def __repr__(self):
         return f"<Item {self.name} id=[{self.id}] shopcart[{self.shopcart_id}]>"
@@ -86,3 +106,274 @@ class Item(db.Model, PersistentBase):
             ) from error
 
         return self
+
+    @classmethod
+    def deserialize_new(cls, shopcart_id, items_json) -> list:
+        """
+        Returns new Items of a Shopcart deserialized from a list of dictionaries
+
+        Every Item is validated before any is returned, so a bad one in the
+        list fails the whole list. Their ids are left to the database.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart the Items are added to
+            items_json (list): the dictionaries of the Items
+        """
+        items = []
+        for item_json in items_json:
+            if isinstance(item_json, dict):
+                item_json["shopcart_id"] = shopcart_id
+                item_json.setdefault("id", None)
+            items.append(cls().deserialize(item_json))
+        return items
+
+    ##################################################
+    # READ CACHE
+    ##################################################
+
+    @classmethod
+    def cache_columns(cls) -> list:
+        """Returns the columns set-based writes need to invalidate the cache"""
+        return [cls.id, cls.shopcart_id]
+
+    @classmethod
+    def invalidate_cache(cls, record) -> None:
+        """Drops the cached Item and the cached Shopcart that embeds it"""
+        CACHE.invalidate(cls.cache_key(record.id), ("Shopcart", record.shopcart_id))
+
+    @classmethod
+    def cache_parent(cls, data):
+        """Items are cached under their Shopcart"""
+        return ("Shopcart", data["shopcart_id"])
+
+    ##################################################
+    # READ MODEL
+    ##################################################
+
+    @classmethod
+    def read_columns(cls) -> list:
+        """Returns the columns serialize() reads, keyed like its dict"""
+        return [cls.id, cls.name, cls.shopcart_id, cls.description, cls.quantity, cls.price]
+
+    ##################################################
+    # CART SUMMARY
+    ##################################################
+
+    @classmethod
+    def summary_changes(cls, rows, sign=1, changes=None) -> dict:
+        """Adds up how Items change the summary of their Shopcarts
+
+        Args:
+            rows: the (shopcart_id, quantity, price) of every Item
+            sign (int): 1 for Items that were added, -1 for removed ones
+            changes (dict): the changes to add to, if any
+
+        Returns:
+            dict: [item_count, unit_count, subtotal] to add, by shopcart id
+        """
+        changes = {} if changes is None else changes
+        for shopcart_id, quantity, price in rows:
+            change = changes.setdefault(shopcart_id, [0, 0, 0.0])
+            change[0] += sign
+            change[1] += sign * quantity
+            change[2] += sign * quantity * float(price)
+        return changes
+
+    @classmethod
+    def summary_statements(cls, changes) -> list:
+        """Returns the UPDATEs that add summary changes to the Shopcarts
+
+        The counters are incremented in SQL, so concurrent writes to one
+        Shopcart add up instead of overwriting each other, and the
+        Shopcarts are updated in id order so two writers never deadlock.
+        """
+        shopcart = db.metadata.tables["shopcart"]
+        return [
+            shopcart.update()
+            .where(shopcart.c.id == shopcart_id)
+            .values(
+                item_count=shopcart.c.item_count + item_count,
+                unit_count=shopcart.c.unit_count + unit_count,
+                subtotal=shopcart.c.subtotal + subtotal,
+                # the summary is bookkeeping, not a change of the Shopcart
+                updated_at=shopcart.c.updated_at,
+            )
+            for shopcart_id, (item_count, unit_count, subtotal) in sorted(changes.items())
+            if item_count or unit_count or subtotal
+        ]
+
+    @classmethod
+    def update_summaries(cls, changes) -> None:
+        """Adds summary changes to the Shopcarts in the current transaction"""
+        for statement in cls.summary_statements(changes):
+            db.session.execute(statement)
+
+    @classmethod
+    def deleted_columns(cls) -> list:
+        """Returns the columns delete_where() reads back from the rows it deletes"""
+        return cls.cache_columns() + [cls.quantity, cls.price]
+
+    @classmethod
+    def summary_rows(cls, records) -> list:
+        """Returns the (shopcart_id, quantity, price) of Items or of rows holding them"""
+        return [tuple(getattr(record, key) for key in SUMMARY_KEYS) for record in records]
+
+    @classmethod
+    def bulk_created(cls, records) -> None:
+        """Adds the Items created by bulk_create() to their Shopcart's summary"""
+        cls.update_summaries(cls.summary_changes(cls.summary_rows(records)))
+
+    @classmethod
+    def bulk_deleted(cls, rows) -> None:
+        """Takes the Items deleted by delete_where() out of their Shopcart's summary"""
+        cls.update_summaries(cls.summary_changes(cls.summary_rows(rows), sign=-1))
+
+    ##################################################
+    # UPSERT
+    ##################################################
+
+    @classmethod
+    def conflict_columns(cls) -> list:
+        """Items are merged with the Item of the same name in their Shopcart"""
+        return [cls.shopcart_id, cls.name]
+
+    @classmethod
+    def merge_values(cls, excluded) -> dict:
+        """Adding an Item that is already there adds to its quantity"""
+        return {"quantity": cls.quantity + excluded.quantity}
+
+    @classmethod
+    def combine(cls, items) -> list:
+        """Returns the Items with the ones of the same Shopcart and name made into one
+
+        The quantities are added up and the first Item of a name keeps its
+        other fields, so upsert() never gets two rows for the same Item
+        """
+        combined = {}
+        for item in items:
+            first = combined.setdefault((item.shopcart_id, item.name), item)
+            if first is not item:
+                first.quantity += item.quantity
+        return list(combined.values())
+
+    @classmethod
+    def upsert_changes(cls, upserted, items) -> dict:
+        """Returns the summary changes of an upsert
+
+        Every Item adds its quantity at the price it has now, but only the
+        ones that were inserted (still at version 1) add to the item count.
+
+        Args:
+            upserted: the Items, or rows holding them, as upsert() left them
+            items: the Items that were asked for
+        """
+        quantities = {(item.shopcart_id, item.name): item.quantity for item in items}
+        changes = cls.summary_changes(
+            (row.shopcart_id, quantities[(row.shopcart_id, row.name)], row.price) for row in upserted
+        )
+        for row in upserted:
+            if row.version > 1:
+                changes[row.shopcart_id][0] -= 1
+        return changes
+
+    @classmethod
+    def bulk_upserted(cls, upserted, records) -> None:
+        """Adds the Items written by upsert() to their Shopcart's summary"""
+        cls.update_summaries(cls.upsert_changes(upserted, records))
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def find_by_shopcart(cls, shopcart_id, name=None, quantity=None):
+        """Returns a query of the Items in a Shopcart, optionally filtered
+
+        Args:
+            shopcart_id (int): the id of the Shopcart that holds the Items
+            name (str): only return Items with this name
+            quantity (int): only return Items with this quantity
+        """
+        logger.info("Processing item query for shopcart %s ...", shopcart_id)
+        # pylint: disable=no-member
+        query = cls.query.filter(*cls.filter_criteria(shopcart_id, name, quantity))
+        return query.order_by(cls.id)
+
+    @classmethod
+    def filter_criteria(cls, shopcart_id, name=None, quantity=None) -> list:
+        """Returns the WHERE criteria of find_by_shopcart()"""
+        criteria = [cls.shopcart_id == shopcart_id]
+        if name:
+            criteria.append(cls.name == name)
+        if quantity:
+            criteria.append(cls.quantity == quantity)
+        return criteria
+
+    @classmethod
+    def delete_by_shopcart(cls, shopcart_id, item_id=None) -> int:
+        """Deletes the Items of a Shopcart with a single DELETE
+
+        Args:
+            shopcart_id (int): the id of the Shopcart that holds the Items
+            item_id (int): only delete the Item with this id
+
+        Returns:
+            int: the number of Items deleted
+        """
+        criteria = [cls.shopcart_id == shopcart_id]
+        if item_id is not None:
+            criteria.append(cls.id == item_id)
+        return cls.delete_where(*criteria)
+
+
+######################################################################
+#  C A R T   S U M M A R Y   E V E N T S
+######################################################################
+# Items written through the session are added up while the session is
+# flushed and every Shopcart they belong to is updated once at its end,
+# in the same transaction
+
+
+def _loaded_value(item, key):
+    """Returns the value an attribute of an Item had before it was changed"""
+    history = attributes.get_history(item, key)
+    return history.deleted[0] if history.deleted else getattr(item, key)
+
+
+def _add_summary_change(item, row, sign):
+    changes = object_session(item).info.setdefault(SUMMARY_CHANGES, {})
+    Item.summary_changes([row], sign, changes)
+
+
+@event.listens_for(Item, "after_insert")
+def _item_inserted(mapper, connection, item):  # pylint: disable=unused-argument
+    _add_summary_change(item, Item.summary_rows([item])[0], 1)
+
+
+@event.listens_for(Item, "after_update")
+def _item_updated(mapper, connection, item):  # pylint: disable=unused-argument
+    loaded = tuple(_loaded_value(item, key) for key in SUMMARY_KEYS)
+    current = Item.summary_rows([item])[0]
+    if loaded != current:
+        _add_summary_change(item, loaded, -1)
+        _add_summary_change(item, current, 1)
+
+
+@event.listens_for(Item, "after_delete")
+def _item_deleted(mapper, connection, item):  # pylint: disable=unused-argument
+    _add_summary_change(item, tuple(_loaded_value(item, key) for key in SUMMARY_KEYS), -1)
+
+
+@event.listens_for(Session, "before_flush")
+def _start_summary_changes(session, flush_context, instances):  # pylint: disable=unused-argument
+    # a flush that failed must not leave its changes to the next one
+    session.info[SUMMARY_CHANGES] = {}
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_summary_changes(session, flush_context):  # pylint: disable=unused-argument
+    changes = session.info.pop(SUMMARY_CHANGES, None)
+    if changes:
+        connection = session.connection()
+        for statement in Item.summary_statements(changes):
+            connection.execute(statement)
@@ -20,23 +20,129 @@ Persistent Base class for database CRUD functions
 
 import logging
 from abc import abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import CACHE
 
 logger = logging.getLogger("flask.app")
 
 db = SQLAlchemy()
 
+# The INSERT of every dialect upsert() can add ON CONFLICT DO UPDATE to
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# The SQLSTATE PostgreSQL reports a unique constraint violation with
+UNIQUE_VIOLATION = "23505"
+
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class ConcurrencyError(DataValidationError):
+    """Used when a record was changed by someone else since it was read"""
+
+
+class DuplicateError(DataValidationError):
+    """Used when a record repeats a value that must be unique"""
+
+
+def write_error(error) -> DataValidationError:
+    """
+    Returns the DataValidationError to raise for an error writing records
+
+    A unique constraint violation becomes a DuplicateError with a message of
+    its own, so the failed statement and its parameters are not sent back
+    """
+    if isinstance(error, IntegrityError) and getattr(error.orig, "sqlstate", None) == UNIQUE_VIOLATION:
+        return DuplicateError("A record with the same unique values already exists")
+    return DataValidationError(error)
+
+
+# Key in Session.info that holds how deeply transaction() blocks are nested
+UNIT_OF_WORK_DEPTH = "unit_of_work_depth"
+# Key in Session.info that holds the records to invalidate once it commits
+PENDING_INVALIDATIONS = "pending_invalidations"
+
+
+def in_transaction() -> bool:
+    """Returns True inside a PersistentBase.transaction() block"""
+    return db.session.info.get(UNIT_OF_WORK_DEPTH, 0) > 0
+
+
+def make_etag(*parts) -> str:
+    """Builds an ETag from ids, counts and timestamps
+
+    Timestamps are reduced to microseconds and every part is written in hex,
+    so the ETag changes whenever any of the parts does
+    """
+    values = []
+    for part in parts:
+        if isinstance(part, datetime):
+            part = int(part.timestamp() * 1_000_000)
+        values.append(format(part or 0, "x"))
+    return "-".join(values)
+
+
+def _commit():
+    """Commits the session, or only flushes it inside a unit of work
+
+    Flushing sends the pending changes and surfaces any errors right away
+    but leaves the single commit to the end of the transaction() block
+    """
+    if in_transaction():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def _rollback():
+    """Rolls the session back unless a unit of work will do it"""
+    if not in_transaction():
+        db.session.rollback()
+
+
+def _invalidate(cls, record):
+    """Drops the cached copy of a record that was just written
+
+    Inside a unit of work the write is not committed yet, so a concurrent
+    request could cache the old version again before it is. The record's
+    cache_columns() are kept and it is dropped once more after the commit.
+    """
+    cls.invalidate_cache(record)
+    if in_transaction():
+        keys = {column.key: getattr(record, column.key) for column in cls.cache_columns()}
+        db.session.info.setdefault(PENDING_INVALIDATIONS, []).append((cls, SimpleNamespace(**keys)))
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
-class PersistentBase:
+class PersistentBase:  # pylint: disable=too-many-public-methods
     """Base class added persistent methods"""
 
+    # Set by the database on every INSERT and UPDATE; the ETags are built on it
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=db.func.current_timestamp(),
+        onupdate=db.func.current_timestamp(),
+    )
+    # Bumped on every UPDATE, which only matches the version that was read
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    @declared_attr.directive
+    def __mapper_args__(cls):  # pylint: disable=no-self-argument
+        """Makes the ORM use version for optimistic concurrency control"""
+        return {"version_id_col": cls.version}
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
@@ -48,6 +154,50 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """
+        Groups create, update and delete calls into one unit of work
+
+        Inside the block those methods flush instead of committing, and the
+        whole block is committed once at the end or rolled back if it raises.
+        Nested blocks run in a SAVEPOINT, so a failing inner block only undoes
+        its own changes. The records written are dropped from the read cache
+        again after the commit. It can also be used as a decorator:
+
+            with PersistentBase.transaction():
+                shopcart.create()
+                item.create()
+        """
+        depth = db.session.info.get(UNIT_OF_WORK_DEPTH, 0)
+        savepoint = db.session.begin_nested() if depth else None
+        db.session.info[UNIT_OF_WORK_DEPTH] = depth + 1
+        try:
+            yield
+            if savepoint:
+                savepoint.commit()
+        except Exception:
+            if savepoint:
+                savepoint.rollback()
+            else:
+                db.session.rollback()
+            raise
+        finally:
+            db.session.info[UNIT_OF_WORK_DEPTH] = depth
+            if not savepoint:
+                pending = db.session.info.pop(PENDING_INVALIDATIONS, [])
+
+        if not savepoint:
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error committing unit of work")
+                raise DataValidationError(e) from e
+            for cls, record in pending:
+                cls.invalidate_cache(record)
+
     def create(self) -> None:
         """
         Creates a Account to the database
@@ -57,36 +207,218 @@ class PersistentBase:
         self.id = None
         try:
             db.session.add(self)
-            db.session.commit()
+            _commit()
         except Exception as e:
-            db.session.rollback()
+            _rollback()
             logger.error("Error creating record: %s", self)
-            raise DataValidationError(e) from e
+            raise write_error(e) from e
+        _invalidate(type(self), self)
 
     def update(self) -> None:
         """
         Updates a Account to the database
+
+        The UPDATE is conditional on the version that was read, so a
+        ConcurrencyError is raised instead of overwriting someone else's change
         """
         logger.info("Updating %s", self)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
         try:
-            db.session.commit()
+            _commit()
+        except StaleDataError as e:
+            _rollback()
+            logger.warning("Concurrent update of record: %s", self)
+            raise ConcurrencyError(
+                f"{type(self).__name__} {self.id} was changed by another request"
+            ) from e
         except Exception as e:
-            db.session.rollback()
+            _rollback()
             logger.error("Error updating record: %s", self)
-            raise DataValidationError(e) from e
+            raise write_error(e) from e
+        _invalidate(type(self), self)
 
     def delete(self) -> None:
         """Removes a Account from the data store"""
         logger.info("Deleting %s", self)
         try:
             db.session.delete(self)
-            db.session.commit()
+            _commit()
         except Exception as e:
-            db.session.rollback()
+            _rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        _invalidate(type(self), self)
+
+    @classmethod
+    def bulk_create(cls, records) -> list:
+        """
+        Creates many records with one multi-row INSERT and a single commit
+
+        Either every record is created or, on error, none of them are. The
+        generated ids are assigned back to the records in order.
+
+        Args:
+            records (list): new records of this class, already deserialized
+        """
+        logger.info("Creating %d %s records", len(records), cls.__name__)
+        try:
+            result = db.session.execute(cls.insert_statement(), cls.insert_rows(records))
+            ids = result.scalars().all()
+            cls.bulk_created(records)
+            _commit()
+        except Exception as e:
+            _rollback()
+            logger.error("Error creating %d %s records", len(records), cls.__name__)
+            raise write_error(e) from e
+        for record, new_id in zip(records, ids):
+            record.id = new_id
+            _invalidate(cls, record)
+        return records
+
+    @classmethod
+    def insert_statement(cls):
+        """Returns the INSERT of bulk_create(), which returns the new ids in order"""
+        return insert(cls).returning(cls.id, sort_by_parameter_order=True)
+
+    @classmethod
+    def insert_rows(cls, records) -> list:
+        """Returns the column values of new records as rows for insert_statement()
+
+        Columns nobody set are left out so their defaults (e.g. updated_at) apply
+        """
+        columns = [
+            column.key
+            for column in cls.__table__.columns
+            if not column.primary_key
+            and (
+                column.default is None
+                or any(getattr(record, column.key) is not None for record in records)
+            )
+        ]
+        return [{key: getattr(record, key) for key in columns} for record in records]
+
+    @classmethod
+    def upsert(cls, records) -> list:
+        """
+        Creates records, merging each one into the record it conflicts with
+
+        One INSERT ... ON CONFLICT DO UPDATE writes them all and a single
+        commit follows, so there is no read-check-write for another request
+        to slip into. A conflict is a record with the same conflict_columns();
+        the SET of merge_values() is applied to it and its version bumped.
+        No two records may share their conflict_columns().
+
+        Args:
+            records (list): new records of this class, already deserialized
+
+        Returns:
+            list: new records holding the rows as written, in the order of records
+        """
+        logger.info("Upserting %d %s records", len(records), cls.__name__)
+        try:
+            statement = cls.upsert_statement(db.session.get_bind().dialect.name)
+            result = db.session.execute(
+                statement.values(cls.insert_rows(records)).returning(*cls.__table__.columns)
+            )
+            # like the records of bulk_create() they stay out of the session
+            upserted = [cls(**row) for row in result.mappings()]
+            cls.bulk_upserted(upserted, records)
+            _commit()
+        except Exception as e:
+            _rollback()
+            logger.error("Error upserting %d %s records", len(records), cls.__name__)
+            raise DataValidationError(e) from e
+        for record in upserted:
+            _invalidate(cls, record)
+        return cls.in_order_of(upserted, records)
+
+    @classmethod
+    def upsert_statement(cls, dialect_name):
+        """Returns the INSERT ... ON CONFLICT DO UPDATE of upsert(), without its rows"""
+        try:
+            statement = UPSERT_INSERTS[dialect_name](cls)
+        except KeyError as error:
+            raise DataValidationError(f"Upserts are not supported on {dialect_name}") from error
+        return statement.on_conflict_do_update(
+            index_elements=cls.conflict_columns(),
+            set_={
+                **cls.merge_values(statement.excluded),
+                "updated_at": func.current_timestamp(),
+                "version": cls.version + 1,
+            },
+        )
+
+    @classmethod
+    def conflict_columns(cls) -> list:
+        """Returns the columns of the unique index upsert() merges records on"""
+        return [cls.id]
+
+    @classmethod
+    def merge_values(cls, excluded) -> dict:
+        """Returns the SET that merges the row upsert() tried to insert (excluded) into a record"""
+        return {column.key: excluded[column.key] for column in cls.__table__.columns if not column.primary_key}
+
+    @classmethod
+    def in_order_of(cls, rows, records) -> list:
+        """Returns rows ordered like the records with the same conflict_columns()"""
+        keys = [column.key for column in cls.conflict_columns()]
+        by_key = {tuple(getattr(row, key) for key in keys): row for row in rows}
+        return [by_key[tuple(getattr(record, key) for key in keys)] for record in records]
+
+    @classmethod
+    def delete_where(cls, *criteria) -> int:
+        """
+        Deletes every record matching the criteria with one DELETE statement
+
+        Nothing is loaded into the session first, so the cost does not depend
+        on how many rows match. Returns the number of records deleted.
+
+        Args:
+            criteria: SQLAlchemy filter expressions such as cls.id == 1
+        """
+        logger.info("Deleting %s records where %s", cls.__name__, criteria)
+        try:
+            # only the columns needed to invalidate the cache come back
+            result = db.session.execute(
+                delete(cls).where(*criteria).returning(*cls.deleted_columns())
+            )
+            rows = result.all()
+            cls.bulk_deleted(rows)
+            _commit()
+        except Exception as e:
+            _rollback()
+            logger.error("Error deleting %s records", cls.__name__)
+            raise DataValidationError(e) from e
+        for row in rows:
+            _invalidate(cls, row)
+        return len(rows)
+
+    @classmethod
+    def deleted_columns(cls) -> list:
+        """Returns the columns delete_where() reads back from the rows it deletes"""
+        return cls.cache_columns()
+
+    @classmethod
+    def bulk_created(cls, records) -> None:  # pylint: disable=unused-argument
+        """Runs in the transaction of bulk_create() once the records are inserted"""
+
+    @classmethod
+    def bulk_deleted(cls, rows) -> None:  # pylint: disable=unused-argument
+        """Runs in the transaction of delete_where() with the deleted_columns() of its rows"""
+
+    @classmethod
+    def bulk_upserted(cls, upserted, records) -> None:  # pylint: disable=unused-argument
+        """Runs in the transaction of upsert() with the records it wrote, as they are now"""
+
+    @classmethod
+    def delete_by_id(cls, by_id) -> int:
+        """Deletes a record by it's ID without loading it first
+
+        Returns:
+            int: 1 if the record was deleted, 0 if it did not exist
+        """
+        return cls.delete_where(cls.id == by_id)
 
     @classmethod
     def all(cls):
@@ -101,3 +433,238 @@ class PersistentBase:
         logger.info("Processing lookup for id %s ...", by_id)
         # pylint: disable=no-member
         return cls.query.session.get(cls, by_id)
+
+    @classmethod
+    def find_serialized(cls, by_id, if_none_match=()):
+        """Returns the ETag and serialized form of a record, reading through the cache
+
+        When the ETag is in if_none_match the client already holds the current
+        version, so the record is not serialized and the data returned is None.
+        The returned dict is shared with the cache and must not be modified.
+
+        Returns:
+            tuple: (etag, data), or None if the record was not found
+        """
+        key = cls.cache_key(by_id)
+        cached = CACHE.get(key)
+        if cached is not None:
+            return cached
+        # a write that lands while we read must not be hidden by a stale entry
+        generation = CACHE.generation
+        cached = cls.read_by_id(by_id)
+        if cached is None:
+            return None
+        # uncommitted changes of a unit of work must not leak into the cache
+        if not in_transaction():
+            CACHE.set(key, cached, parent=cls.cache_parent(cached[1]), generation=generation)
+        etag = cached[0]
+        if etag in if_none_match:
+            return etag, None
+        return cached
+
+    ##################################################
+    # E T A G S
+    ##################################################
+
+    def etag(self) -> str:
+        """Returns a strong ETag that changes whenever the record is written"""
+        return make_etag(self.id, self.updated_at)
+
+    @classmethod
+    def query_etag(cls, query) -> str:
+        """Returns an ETag for all of the records of a query, computed in SQL
+
+        Only the row count, the newest updated_at, the largest id and the sum
+        of the versions are read, so it costs one aggregate instead of a
+        serialization pass. updated_at is the start of the writing
+        transaction, so one that commits late can leave the newest one
+        unchanged; the version it bumped still moves the sum.
+        """
+        return make_etag(*db.session.execute(cls.etag_statement(query.statement)).one())
+
+    @classmethod
+    def etag_statement(cls, statement):
+        """Returns the aggregate SELECT that query_etag() reads
+
+        Args:
+            statement: a SELECT of records of this class
+        """
+        rows = statement.with_only_columns(cls.id, cls.updated_at, cls.version).subquery()
+        return db.select(
+            func.count(),
+            func.max(rows.c.updated_at),
+            func.max(rows.c.id),
+            func.sum(rows.c.version),
+        )
+
+    ##################################################
+    # READ CACHE
+    ##################################################
+
+    @classmethod
+    def cache_key(cls, by_id) -> tuple:
+        """Returns the key a record is cached under"""
+        return (cls.__name__, by_id)
+
+    @classmethod
+    def cache_columns(cls) -> list:
+        """Returns the columns set-based writes need to invalidate the cache"""
+        return [cls.id]
+
+    @classmethod
+    def invalidate_cache(cls, record) -> None:
+        """Drops the cached copy of a record once it has been written
+
+        Args:
+            record: the record itself, or a row holding its cache_columns()
+        """
+        CACHE.invalidate(cls.cache_key(record.id))
+
+    @classmethod
+    def cache_parent(cls, data):  # pylint: disable=unused-argument
+        """Returns the key of the cached resource a serialized record belongs to"""
+        return None
+
+    @classmethod
+    def keyset_query(cls, query=None, limit=100, after_id=None):
+        """Returns a query for up to limit records ordered by id after after_id
+
+        Args:
+            query: the query to page through (defaults to all records)
+            limit (int): the maximum number of records to return
+            after_id (int): only return records with an id greater than this
+        """
+        # pylint: disable=no-member
+        query = cls.query if query is None else query
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(None).order_by(cls.id).limit(limit)
+
+    @classmethod
+    def keyset_page(cls, query=None, limit=100, after_id=None):
+        """Returns up to limit records ordered by id that come after after_id
+
+        Pages are addressed by the last id seen rather than an OFFSET, so
+        every page is an index range scan no matter how deep it is
+
+        Args:
+            query: the query to page through (defaults to all records)
+            limit (int): the maximum number of records to return
+            after_id (int): only return records with an id greater than this
+        """
+        logger.info("Processing keyset page after id %s limit %s ...", after_id, limit)
+        return cls.keyset_query(query, limit, after_id).all()
+
+    @classmethod
+    def keyset_scan(cls, query=None, page_size=500):
+        """Generator that yields every record of a query in id order
+
+        Records are fetched one keyset page at a time so only page_size
+        records are held in memory no matter how large the result is
+
+        Args:
+            query: the query to scan (defaults to all records)
+            page_size (int): the number of records fetched per round trip
+        """
+        after_id = None
+        while True:
+            page = cls.keyset_page(query, page_size, after_id)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_id = page[-1].id
+
+    ##################################################
+    # R E A D   M O D E L
+    ##################################################
+
+    @classmethod
+    @abstractmethod
+    def read_columns(cls) -> list:
+        """Returns the columns serialize() reads, keyed like its dict"""
+
+    @classmethod
+    def serialize_rows(cls, rows) -> list:
+        """Builds the serialize() dicts of records from rows of read_columns()
+
+        Records that embed others are returned without them; read those
+        with children_statement() and add them with add_children()
+        """
+        keys = [column.key for column in cls.read_columns()]
+        return [dict(zip(keys, row)) for row in rows]
+
+    @classmethod
+    def children_statement(cls, records):  # pylint: disable=unused-argument
+        """Returns the SELECT of the records serialized records embed, if any"""
+        return None
+
+    @classmethod
+    def add_children(cls, records, rows) -> list:  # pylint: disable=unused-argument
+        """Adds the rows read by children_statement() to serialized records"""
+        return records
+
+    @classmethod
+    def read_rows(cls, rows) -> list:
+        """Returns the serialized records of rows of read_columns() with their children"""
+        records = cls.serialize_rows(rows)
+        statement = cls.children_statement(records)
+        if statement is not None:
+            cls.add_children(records, db.session.execute(statement))
+        return records
+
+    @classmethod
+    def read_serialized(cls, query) -> list:
+        """Returns the records of a query serialized straight from row tuples
+
+        Only read_columns() are selected and no ORM instance is built, so
+        the identity map and attribute instrumentation are skipped. The
+        dicts are the same as serialize() of every record would return.
+
+        Args:
+            query: the query of records to read
+        """
+        return cls.read_rows(db.session.execute(cls.read_statement(query)))
+
+    @classmethod
+    def stream_serialized(cls, query, batch_size=500):
+        """Generator of the read_serialized() records of a query
+
+        Rows are fetched from a server-side cursor batch_size at a time, so
+        memory is bounded by the batch size rather than the result
+
+        Args:
+            query: the query of records to read
+            batch_size (int): the number of rows fetched per round trip
+        """
+        result = db.session.execute(
+            cls.read_statement(query), execution_options={"yield_per": batch_size}
+        )
+        for rows in result.partitions():
+            yield from cls.read_rows(rows)
+
+    @classmethod
+    def read_statement(cls, query):
+        """Returns a SELECT of the read_columns() of the records of a query"""
+        return query.with_entities(*cls.read_columns()).statement
+
+    @classmethod
+    def read_by_id(cls, by_id):
+        """Returns the ETag and serialized form of a record read as a row
+
+        Returns:
+            tuple: (etag, data), or None if the record was not found
+        """
+        return cls.read_by_id_rows(db.session.execute(cls.read_by_id_statement(by_id)).all())
+
+    @classmethod
+    def read_by_id_statement(cls, by_id):
+        """Returns the SELECT that read_by_id() reads a record with"""
+        return db.select(cls.updated_at, *cls.read_columns()).where(cls.id == by_id)
+
+    @classmethod
+    def read_by_id_rows(cls, rows):
+        """Returns the ETag and serialized record from the rows of read_by_id_statement()"""
+        if not rows:
+            return None
+        data = cls.serialize_rows([rows[0][1:]])[0]
+        return make_etag(data["id"], rows[0][0]), data
@@ -0,0 +1,73 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Version
+
+One row per version of the schema that was applied to the database, so a
+worker can tell with a single query whether the tables are current
+"""
+
+import logging
+from sqlalchemy import func, insert, inspect, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from .persistent_base import db
+
+logger = logging.getLogger("flask.app")
+
+# The version of the tables defined by the models, which is the version of
+# the last migration in service/common/migrations.py
+SCHEMA_VERSION = 5
+
+
+######################################################################
+#  S C H E M A   V E R S I O N   M O D E L
+######################################################################
+class SchemaVersion(db.Model):
+    """
+    Class that represents a version of the schema applied to the database
+    """
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    applied_at = db.Column(db.DateTime, nullable=False, server_default=func.current_timestamp())
+
+    def __repr__(self):
+        return f"<SchemaVersion {self.version} applied_at=[{self.applied_at}]>"
+
+    @classmethod
+    def current(cls, connection):
+        """Returns the newest version applied to the database, or None
+
+        Before the first version the table itself is missing; the caller's
+        transaction is aborted then, so only call this on its own connection.
+        """
+        try:
+            return connection.execute(select(func.max(cls.version))).scalar()
+        except (OperationalError, ProgrammingError):
+            return None
+
+    @classmethod
+    def current_in_transaction(cls, connection):
+        """Returns the newest version like current() without aborting the transaction"""
+        if not inspect(connection).has_table(cls.__tablename__):
+            return None
+        return connection.execute(select(func.max(cls.version))).scalar()
+
+    @classmethod
+    def stamp(cls, connection, version=SCHEMA_VERSION):
+        """Records that the schema is now at version"""
+        logger.info("Schema is now at version %s", version)
+        connection.execute(insert(cls).values(version=version))
@@ -6,13 +6,24 @@ All of the models are stored in this module
 
 import logging
 
-from .persistent_base import db, PersistentBase, DataValidationError
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+
+from service.common.cache import CACHE
+from .persistent_base import db, PersistentBase, DataValidationError, make_etag
 from .item import Item
 
 logger = logging.getLogger("flask.app")
 
+# Ways the items relationship can be loaded when querying many Shopcarts
+ITEM_LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "lazy": lazyload,
+}
+
 
-class Shopcart(db.Model, PersistentBase):
+class Shopcart(db.Model, PersistentBase):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Shopcart
     """
@@ -25,17 +36,35 @@ class Shopcart(db.Model, PersistentBase):
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, nullable=False)
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
     time_atc = db.Column(
         db.DateTime, nullable=True, default=db.func.current_timestamp()
     )
-    items = db.relationship("Item", backref="shopcart", passive_deletes=True)
+    items = db.relationship("Item", backref="shopcart", passive_deletes=True, order_by="Item.id")
+    # Summary of the Items, kept up to date by every write of an Item in the
+    # same transaction (see Item.summary_statements) and by db-reconcile
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    unit_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(db.Float, nullable=False, default=0.0)
 
     def __repr__(self):
         return f"<Shopcart {self.customer_id} id=[{self.id}]>"
 
-    def serialize(self):
-        """Serializes a Shopcart into a dictionary"""
+    def serialize(self, summary=False):
+        """Serializes a Shopcart into a dictionary
+
+        With summary the Items are left out for their count and subtotal,
+        which are read from the Shopcart's own columns without loading them
+        """
+        if summary:
+            return {
+                "id": self.id,
+                "customer_id": self.customer_id,
+                "time_atc": self.time_atc,
+                "item_count": self.item_count or 0,
+                "unit_count": self.unit_count or 0,
+                "subtotal": round(self.subtotal or 0.0, 2),
+            }
         shopcart = {
             "id": self.id,
             "customer_id": self.customer_id,
@@ -86,10 +115,280 @@ class Shopcart(db.Model, PersistentBase):
             ) from error
         return self
 
+    ##################################################
+    # E T A G S
+    ##################################################
+
+    def etag(self) -> str:
+        """Returns a strong ETag for the Shopcart and the Items it embeds
+
+        Adding or changing an Item moves the newest Item updated_at and
+        removing one changes the count, so both invalidate the ETag. The
+        versions are summed too, like etag_statement() does, so a write that
+        commits after a newer one still changes it.
+        """
+        newest = max((item.updated_at for item in self.items), default=None)
+        versions = sum(item.version for item in self.items)
+        return make_etag(self.id, self.updated_at, self.version, len(self.items), newest, versions)
+
+    @classmethod
+    def query_etag(cls, query) -> str:
+        """Returns an ETag for the Shopcarts of a query and their Items, in SQL"""
+        return make_etag(*db.session.execute(cls.etag_statement(query.statement)).one())
+
+    @classmethod
+    def etag_statement(cls, statement):
+        """Returns the aggregate SELECT of the Shopcarts and their Items query_etag() reads
+
+        A Shopcart's version is summed once per joined Item row, which still
+        moves the sum whenever it is bumped
+        """
+        carts = statement.with_only_columns(cls.id, cls.updated_at, cls.version).subquery()
+        return db.select(
+            func.count(func.distinct(carts.c.id)),
+            func.max(carts.c.updated_at),
+            func.max(carts.c.id),
+            func.sum(carts.c.version),
+            func.count(Item.id),
+            func.max(Item.updated_at),
+            func.sum(Item.version),
+        ).select_from(carts.outerjoin(Item, Item.shopcart_id == carts.c.id))
+
+    ##################################################
+    # READ CACHE
+    ##################################################
+
+    @classmethod
+    def invalidate_cache(cls, record) -> None:
+        """Drops the cached Shopcart and every Item cached under it
+
+        Its Items may have been replaced by update() or cascade deleted
+        """
+        key = cls.cache_key(record.id)
+        CACHE.invalidate(key)
+        CACHE.invalidate_children(key)
+
+    ##################################################
+    # READ MODEL
+    ##################################################
+
+    @classmethod
+    def read_columns(cls) -> list:
+        """Returns the columns serialize() reads, keyed like its dict"""
+        return [cls.id, cls.customer_id, cls.time_atc]
+
+    @classmethod
+    def serialize_rows(cls, rows) -> list:
+        """Builds the serialize() dicts of Shopcarts from rows, with no Items yet"""
+        return [
+            {"id": id_, "customer_id": customer_id, "time_atc": time_atc, "items": []}
+            for id_, customer_id, time_atc in rows
+        ]
+
+    @classmethod
+    def children_statement(cls, records):
+        """Returns one SELECT of the Items of all of the serialized Shopcarts"""
+        if not records:
+            return None
+        return (
+            db.select(*Item.read_columns())
+            .where(Item.shopcart_id.in_([shopcart["id"] for shopcart in records]))
+            .order_by(Item.id)
+        )
+
+    @classmethod
+    def add_children(cls, records, rows) -> list:
+        """Adds the Items to their serialized Shopcart in a single pass over the rows"""
+        items = {shopcart["id"]: shopcart["items"] for shopcart in records}
+        for item in Item.serialize_rows(rows):
+            items[item["shopcart_id"]].append(item)
+        return records
+
+    @classmethod
+    def read_by_id_statement(cls, by_id):
+        """Returns one LEFT OUTER JOIN of a Shopcart and its Items"""
+        return (
+            db.select(
+                cls.updated_at, cls.version, *cls.read_columns(), Item.updated_at, Item.version, *Item.read_columns()
+            )
+            .outerjoin(Item, Item.shopcart_id == cls.id)
+            .where(cls.id == by_id)
+            .order_by(Item.id)
+        )
+
+    @classmethod
+    def read_by_id_rows(cls, rows):
+        """Returns the ETag and serialized Shopcart from the joined rows
+
+        The ETag is built from the same parts as etag()
+        """
+        if not rows:
+            return None
+        updated_at, version, id_, customer_id, time_atc = rows[0][:5]
+        # a Shopcart without Items comes back as one row of NULL Item columns
+        item_rows = [row for row in rows if row[7] is not None]
+        items = Item.serialize_rows(row[7:] for row in item_rows)
+        newest = max((row[5] for row in item_rows), default=None)
+        versions = sum(row[6] for row in item_rows)
+        data = {"id": id_, "customer_id": customer_id, "time_atc": time_atc, "items": items}
+        return make_etag(id_, updated_at, version, len(items), newest, versions), data
+
+    ##################################################
+    # T O T A L S
+    ##################################################
+
+    @classmethod
+    def totals_statement(cls, shopcart_ids):
+        """Returns the SELECT of the summary columns of the Shopcarts with these ids
+
+        It reads one row per Shopcart by its primary key, however many Items
+        they hold; ids that are not a Shopcart get no row at all
+        """
+        return (
+            db.select(cls.id, cls.item_count, cls.unit_count, cls.subtotal)
+            .where(cls.id.in_(shopcart_ids))
+            .order_by(cls.id)
+        )
+
+    @classmethod
+    def computed_totals_statement(cls, shopcart_ids):
+        """Returns one aggregate SELECT that computes the totals from the Items
+
+        A Shopcart without Items gets a row of zeros. The columns are named
+        like the summary columns they are checked against.
+        """
+        return (
+            db.select(
+                cls.id,
+                func.count(Item.id).label("item_count"),
+                func.coalesce(func.sum(Item.quantity), 0).label("unit_count"),
+                func.coalesce(func.sum(Item.quantity * Item.price), 0.0).label("subtotal"),
+            )
+            .outerjoin(Item, Item.shopcart_id == cls.id)
+            .where(cls.id.in_(shopcart_ids))
+            .group_by(cls.id)
+            .order_by(cls.id)
+        )
+
+    @classmethod
+    def serialize_totals(cls, rows) -> list:
+        """Builds the totals dicts from the rows of totals_statement()
+
+        The subtotal is rounded to cents, since adding up float prices
+        leaves binary fractions behind
+        """
+        return [
+            {
+                "shopcart_id": id_,
+                "item_count": item_count,
+                "unit_count": unit_count,
+                "subtotal": round(subtotal, 2),
+            }
+            for id_, item_count, unit_count, subtotal in rows
+        ]
+
+    @classmethod
+    def find_totals(cls, shopcart_ids) -> list:
+        """Returns the item count, unit count and subtotal of Shopcarts by id
+
+        They are read from the summary columns of the Shopcarts, so no Item
+        is scanned, loaded or sent back
+
+        Args:
+            shopcart_ids (list): the ids of the Shopcarts
+
+        Returns:
+            list: the totals of the Shopcarts found, ordered by id
+        """
+        logger.info("Processing totals query for %d shopcarts ...", len(shopcart_ids))
+        return cls.serialize_totals(db.session.execute(cls.totals_statement(shopcart_ids)))
+
+    @classmethod
+    def reconcile_statement(cls, shopcart_ids):
+        """Returns the UPDATE that resets the drifted summaries of Shopcarts from their Items
+
+        It returns the ids of the Shopcarts it fixed. Subtotals that differ
+        by less than half a cent are float rounding, not drift.
+        """
+        computed = cls.computed_totals_statement(shopcart_ids).order_by(None).subquery()
+        shopcart = cls.__table__
+        return (
+            shopcart.update()
+            .where(
+                shopcart.c.id == computed.c.id,
+                (shopcart.c.item_count != computed.c.item_count)
+                | (shopcart.c.unit_count != computed.c.unit_count)
+                | (func.abs(shopcart.c.subtotal - computed.c.subtotal) >= 0.005),
+            )
+            .values(
+                item_count=computed.c.item_count,
+                unit_count=computed.c.unit_count,
+                subtotal=computed.c.subtotal,
+                updated_at=shopcart.c.updated_at,
+            )
+            .returning(shopcart.c.id)
+        )
+
+    @classmethod
+    def reconcile_summaries(cls, engine, batch_size=1000) -> tuple:
+        """Recomputes the summary of every Shopcart from its Items
+
+        The Shopcarts are checked batch_size at a time in id order, each
+        batch in a transaction of its own. Its Shopcarts are locked before
+        their Items are added up, so an Item written meanwhile either is
+        counted or updates the summary after the batch, never in between.
+
+        Args:
+            engine: the engine of the database to reconcile
+            batch_size (int): the Shopcarts checked per transaction
+
+        Returns:
+            tuple: the number of Shopcarts checked and of those fixed
+        """
+        checked = fixed = 0
+        after_id = 0
+        while True:
+            with engine.begin() as connection:
+                shopcart_ids = connection.execute(
+                    db.select(cls.id)
+                    .where(cls.id > after_id)
+                    .order_by(cls.id)
+                    .limit(batch_size)
+                    .with_for_update()
+                ).scalars().all()
+                if shopcart_ids:
+                    fixed += len(connection.execute(cls.reconcile_statement(shopcart_ids)).all())
+            checked += len(shopcart_ids)
+            if len(shopcart_ids) < batch_size:
+                logger.info("Reconciled %d shopcarts, %d had drifted", checked, fixed)
+                return checked, fixed
+            after_id = shopcart_ids[-1]
+
     ##################################################
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def with_items(cls, query, strategy="selectin"):
+        """Returns the query with the items relationship loaded by strategy
+
+        Shopcart.items is lazy by default, which suits single Shopcart reads
+        but costs one SELECT per Shopcart when serializing a list. Use
+        "selectin" (one extra SELECT ... WHERE shopcart_id IN (...)) or
+        "joined" (a LEFT OUTER JOIN) to load the items of a whole list at once.
+
+        Args:
+            query: a query of Shopcarts
+            strategy (str): one of "selectin", "joined" or "lazy"
+        """
+        try:
+            loader = ITEM_LOADERS[strategy]
+        except KeyError as error:
+            raise DataValidationError(
+                f"Invalid item loader strategy: {strategy}"
+            ) from error
+        return query.options(loader(cls.items))
+
     @classmethod
     def find_by_customer(cls, customer_id):
         """Returns all Shopcarts with the given customer
@@ -99,3 +398,44 @@ class Shopcart(db.Model, PersistentBase):
         """
         logger.info("Processing name query for %s ...", customer_id)
         return cls.query.filter(cls.customer_id == customer_id)
+
+    @classmethod
+    def find_by_item_name(cls, item_name):
+        """Returns all Shopcarts that contain an Item with the given name
+
+        The match is an EXISTS semi-join on item.name so each Shopcart is
+        returned once no matter how many matching Items it holds
+
+        Args:
+            item_name (str): the name of the Item the Shopcarts must contain
+        """
+        logger.info("Processing item name query for %s ...", item_name)
+        return cls.query.filter(cls.items.any(Item.name == item_name))
+
+    @classmethod
+    def find_by_filters(cls, customer_id=None, item_name=None):
+        """Returns a query of Shopcarts matching all of the given filters
+
+        All filtering happens in the database; filters that are None are
+        ignored so calling it with no arguments returns every Shopcart
+
+        Args:
+            customer_id (int): only return Shopcarts for this customer
+            item_name (str): only return Shopcarts holding an Item with this name
+        """
+        logger.info(
+            "Processing filter query for customer_id=%s item_name=%s ...",
+            customer_id,
+            item_name,
+        )
+        return cls.query.filter(*cls.filter_criteria(customer_id, item_name)).order_by(cls.id)
+
+    @classmethod
+    def filter_criteria(cls, customer_id=None, item_name=None) -> list:
+        """Returns the WHERE criteria of find_by_filters()"""
+        criteria = []
+        if customer_id is not None:
+            criteria.append(cls.customer_id == customer_id)
+        if item_name:
+            criteria.append(cls.items.any(Item.name == item_name))
+        return criteria
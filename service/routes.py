@@ -20,11 +20,16 @@ Shopcart Service
 This service implements a REST API that allows you to Create, Read, Update
 and Delete Shopcart
 """
-import datetime
-from flask import jsonify, request, url_for, abort
+import time
+from flask import Response, jsonify, request, url_for, abort, stream_with_context
 from flask import current_app as app  # Import Flask application
-from service.models import Shopcart, Item
-from service.common import status  # HTTP Status Codes
+from service.models import db, Shopcart, Item
+from service.common import api, status  # HTTP Status Codes
+from service.common.api import JSON, NDJSON
+from service.common.cache import CACHE
+from service.common.metrics import METRICS, PROMETHEUS_CONTENT_TYPE
+from service.common.pool_metrics import POOL_STATS
+from service.common.query_stats import add_serialize_time, serialize_timer
 
 
 ######################################################################
@@ -33,7 +38,24 @@ from service.common import status  # HTTP Status Codes
 @app.route("/health")
 def health_check():
     """Let them know our heart is still beating"""
-    return jsonify(status=200, message="Healthy"), status.HTTP_200_OK
+    return (
+        jsonify(
+            status=200,
+            message="Healthy",
+            pool=POOL_STATS.snapshot(db.engine.pool),
+            cache=CACHE.stats(),
+        ),
+        status.HTTP_200_OK,
+    )
+
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route("/metrics")
+def metrics():
+    """Returns request counts and latencies in the Prometheus text format"""
+    return Response(METRICS.render(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 
 ######################################################################
@@ -60,36 +82,15 @@ def create_shopcart():
     This endpoint will create an Shopcart based the data in the body that is posted
     """
     app.logger.info("Request to create a Shopcart")
-    check_content_type("application/json")
-
-    shopcart_json = request.get_json()
-
-    # Validate customer_id is present and is an integer
-    if not shopcart_json or "customer_id" not in shopcart_json:
-        abort(status.HTTP_400_BAD_REQUEST, "Customer ID is required")
-
-    try:
-        customer_id = int(shopcart_json["customer_id"])
-        shopcart_json["customer_id"] = customer_id
-    except (ValueError, TypeError):
-        abort(status.HTTP_400_BAD_REQUEST, "Customer ID must be an integer")
+    api.check_content_type(request)
 
     # Create the shopcart
-    shopcart = Shopcart()
-
-    if "time_atc" not in shopcart_json:
-        shopcart_json["time_atc"] = datetime.datetime.now().strftime(
-            "%Y-%m-%dT%H:%M:%S"
-        )
-    if "items" not in shopcart_json:
-        shopcart_json["items"] = []
-
-    shopcart.deserialize(shopcart_json)
+    shopcart = api.new_shopcart(request.get_json())
     shopcart.create()
 
     # Create a message to return
     message = shopcart.serialize()
-    location_url = url_for("get_shopcarts", shopcart_id=shopcart.id, _external=True)
+    location_url = external_url("get_shopcarts", shopcart_id=shopcart.id)
 
     return jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
 
@@ -107,14 +108,14 @@ def get_shopcarts(shopcart_id):
     app.logger.info("Request to Retrieve a Shopcart with id [%s]", shopcart_id)
 
     # Attempt to find the Shopcart and abort if not found
-    shopcart = Shopcart.find(shopcart_id)
+    shopcart = Shopcart.find_serialized(shopcart_id, request.if_none_match)
     if not shopcart:
         abort(
             status.HTTP_404_NOT_FOUND,
             f"Shopcart with id '{shopcart_id}' was not found.",
         )
 
-    return jsonify(shopcart.serialize()), status.HTTP_200_OK
+    return record_response(*shopcart)
 
 
 ######################################################################
@@ -129,10 +130,8 @@ def delete_shopcarts(shopcart_id):
     """
     app.logger.info("Request to delete shopcart with id: %s", shopcart_id)
 
-    # Retrieve the account to delete and delete it if it exists
-    shopcart = Shopcart.find(shopcart_id)
-    if shopcart:
-        shopcart.delete()
+    # Delete by key without loading it; the database cascades to its items
+    Shopcart.delete_by_id(shopcart_id)
 
     return "", status.HTTP_204_NO_CONTENT
 
@@ -142,26 +141,28 @@ def delete_shopcarts(shopcart_id):
 ######################################################################
 @app.route("/shopcarts", methods=["GET"])
 def list_shopcarts():
-    """Returns all of the shopcarts, optionally filtered by customer_id or item name"""
-    app.logger.info("Request for shopcart list")
-
-    customer_id = request.args.get("customer_id", type=int)
-    item_name = request.args.get("item_name", type=str)
+    """
+    Returns all of the shopcarts, optionally filtered by customer_id or item name
 
-    shopcarts = Shopcart.all()
+    Pass limit and/or cursor to page through the results; the next page is
+    advertised in the Link and X-Next-Cursor response headers. Without them
+    every shopcart is streamed back as a JSON array (or NDJSON on request)
+    """
+    app.logger.info("Request for shopcart list")
 
-    # Filter by customer_id
-    if customer_id:
-        shopcarts = [sc for sc in shopcarts if sc.customer_id == customer_id]
+    customer_id, item_name = api.shopcart_filters(request)
 
-    # Filter by item_name
-    if item_name:
-        shopcarts = [
-            sc for sc in shopcarts if any(item.name == item_name for item in sc.items)
-        ]
+    # Both filters are applied by the database, not in Python
+    query = Shopcart.find_by_filters(customer_id=customer_id, item_name=item_name)
+    # Load the items of every cart up front instead of one SELECT per cart
+    strategy = app.config["ITEM_LOADER_STRATEGY"]
+    if not api.is_paged(request):
+        # joined eager loads of a collection cannot be combined with yield_per
+        strategy = "selectin" if strategy == "joined" else strategy
 
-    results = [shopcart.serialize() for shopcart in shopcarts]
-    return jsonify(results), status.HTTP_200_OK
+    return list_response(
+        Shopcart, query, lambda query: Shopcart.with_items(query, strategy)
+    )
 
 
 ######################################################################
@@ -174,10 +175,12 @@ def update_shopcarts(shopcart_id):
     """
     Update a Shopcart
 
-    This endpoint will update a Shopcart based the body that is posted
+    This endpoint will update a Shopcart based the body that is posted.
+    Its Items are changed through the item routes. Send the ETag of the Shopcart in If-Match to only update it if nobody
+    else has changed it since; otherwise 412 Precondition Failed is returned
     """
     app.logger.info("Request to Update a shopcart with id [%s]", shopcart_id)
-    check_content_type("application/json")
+    api.check_content_type(request)
 
     # Attempt to find the Shopcart and abort if not found
     shopcart = Shopcart.find(shopcart_id)
@@ -186,41 +189,198 @@ def update_shopcarts(shopcart_id):
             status.HTTP_404_NOT_FOUND,
             f"Shopcart with id '{shopcart_id}' was not found.",
         )
+    api.check_if_match(request, shopcart.etag())
 
-    shopcart_json = request.get_json()
-    if "time_atc" not in shopcart_json:
-        shopcart_json["time_atc"] = shopcart.time_atc
-    if "items" not in shopcart_json:
-        shopcart_json["items"] = shopcart.items
+    shopcart_json = api.shopcart_changes(request.get_json(), shopcart.time_atc)
 
     # Update from the json in the body of the request
     shopcart.deserialize(shopcart_json)
     # shopcart.id = shopcart_id
     shopcart.update()
 
-    return jsonify(shopcart.serialize()), status.HTTP_200_OK
+    response = jsonify(shopcart.serialize())
+    response.set_etag(shopcart.etag())
+    return response
 
 
 ######################################################################
-#  U T I L I T Y   F U N C T I O N S
+# READ THE TOTALS OF A SHOPCART
 ######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/totals", methods=["GET"])
+def get_shopcart_totals(shopcart_id):
+    """
+    Returns the item count, unit count and subtotal of a Shopcart
 
+    They are summed up by the database, so no Item is sent back
+    """
+    app.logger.info("Request for the totals of shopcart with id: %s", shopcart_id)
 
-def check_content_type(content_type):
-    """Checks that the media type is correct"""
-    if "Content-Type" not in request.headers:
-        app.logger.error("No Content-Type specified.")
+    totals = Shopcart.find_totals([shopcart_id])
+    if not totals:
         abort(
-            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {content_type}",
+            status.HTTP_404_NOT_FOUND,
+            f"Shopcart with id '{shopcart_id}' was not found.",
         )
 
-    if request.headers["Content-Type"] == content_type:
-        return
+    return jsonify(totals[0])
+
+
+######################################################################
+# READ THE TOTALS OF MANY SHOPCARTS
+######################################################################
+@app.route("/shopcarts/totals", methods=["GET"])
+def list_shopcart_totals():
+    """
+    Returns the totals of every Shopcart listed in ids, in one query
+
+    Pass the ids comma separated (?ids=1,2,3) or repeated (?ids=1&ids=2).
+    Ids that are not a Shopcart are left out of the list
+    """
+    shopcart_ids = api.totals_ids(request, app.config)
+    app.logger.info("Request for the totals of %d shopcarts", len(shopcart_ids))
+
+    return jsonify(Shopcart.find_totals(shopcart_ids))
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def external_url(endpoint, **values):
+    """Returns the external URL of an endpoint, for the helpers of service/common/api.py"""
+    return url_for(endpoint, **values, _external=True)
+
 
-    app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
-    abort(
-        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}"
+def not_modified(etag):
+    """Returns an empty 304 Not Modified response for an ETag"""
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def record_response(etag, data):
+    """
+    Returns a single serialized record with its ETag
+
+    Answers 304 Not Modified instead when the client sent the same ETag in
+    If-None-Match, which saves encoding and sending the body again
+    """
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    with serialize_timer():
+        response = jsonify(data)
+    return api.revalidated(response, etag)
+
+
+def list_response(model, query, load=None):
+    """
+    Returns the records of a query as one page or a stream, with an ETag
+
+    The ETag is computed by an aggregate query before any record is
+    loaded, so a matching If-None-Match is answered with 304 Not Modified
+    without fetching or serializing the list.
+
+    Args:
+        model: the model class being listed
+        query: the filtered query of records
+        load: an optional function that adds loader options to the query
+    """
+    query, limit, ndjson = api.list_query(request, app.config, model.keyset_query, query)
+    etag = api.list_etag(model.query_etag(query), ndjson)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+
+    records = read_records(model, query, load, limit is not None)
+    if limit is not None:
+        response = page_response(records, limit)
+    else:
+        response = stream_response(records, ndjson)
+    return api.revalidated(response, etag, vary="Accept")
+
+
+def read_records(model, query, load, paged):
+    """
+    Returns the serialized records of a list query
+
+    With READ_MODEL=core the model's read model builds them straight from
+    row tuples. With orm the records are loaded as instances, their Items
+    by the load function, and serialized one by one. Unpaged lists are
+    read lazily, one batch at a time, to be streamed.
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    if app.config["READ_MODEL"] == "core":
+        if paged:
+            return model.read_serialized(query)
+        return model.stream_serialized(query, batch_size)
+
+    if load:
+        query = load(query)
+    if paged:
+        records = query.all()
+        with serialize_timer():
+            return [record.serialize() for record in records]
+    return serialize_stream(query, batch_size)
+
+
+def serialize_stream(query, batch_size):
+    """Generator of the serialized records of a query, loaded batch_size at a time"""
+    try:
+        for record in query.yield_per(batch_size):
+            yield record.serialize()
+    finally:
+        # The session of the view was already removed when the view
+        # returned, so give back the connection the cursor reopened
+        query.session.close()
+
+
+def page_response(records, limit):
+    """
+    Returns one page of serialized records as a JSON array
+
+    records holds up to limit + 1 records; when the extra one is there
+    the Link and X-Next-Cursor headers point at the next page.
+    """
+    with serialize_timer():
+        response = jsonify(records[:limit])
+    response.headers.update(api.next_page_headers(request, external_url, records, limit))
+    return response
+
+
+def stream_response(records, ndjson=False):
+    """
+    Streams serialized records back without building the whole list
+
+    records is read lazily from a server-side cursor STREAM_BATCH_SIZE rows
+    at a time and each record is encoded as it is produced, so memory is
+    bounded by the batch size rather than the size of the result. The body
+    is a JSON array, or one JSON document per line when ndjson is set.
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+
+    def generate():
+        chunk = [] if ndjson else ["["]
+        serialize_time = 0.0
+        for count, record in enumerate(records):
+            start = time.perf_counter()
+            encoded = app.json.dumps(record)
+            serialize_time += time.perf_counter() - start
+            if ndjson:
+                chunk.append(encoded + "\n")
+            else:
+                chunk.append("," + encoded if count else encoded)
+            if len(chunk) >= batch_size:
+                yield "".join(chunk)
+                chunk = []
+        if not ndjson:
+            chunk.append("]")
+        add_serialize_time(serialize_time)
+        yield "".join(chunk)
+
+    return Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype=NDJSON if ndjson else JSON,
     )
 
 
@@ -232,10 +392,12 @@ def create_items(shopcart_id):
     """
     Create an items on an shopcart
 
-    This endpoint will add an items to an shopcart
+    This endpoint will add an items to an shopcart. Posting a JSON array
+    instead of a single item adds all of them in one transaction. With
+    ?merge=true each item is merged into the one of the same name instead
     """
     app.logger.info("Request to create an items for shopcart with id: %s", shopcart_id)
-    check_content_type("application/json")
+    api.check_content_type(request)
 
     # See if the shopcart exists and abort if it doesn't
     shopcart = Shopcart.find(shopcart_id)
@@ -245,25 +407,28 @@ def create_items(shopcart_id):
             f"shopcart with id '{shopcart_id}' could not be found.",
         )
 
-    # Create an items from the json data
-    item = Item()
-    item_json = request.get_json()
-    item_json["shopcart_id"] = shopcart_id
-
-    item.deserialize(item_json)
-
-    # Append the items to the shopcart
-    shopcart.items.append(item)
-    item.create()
-
-    # Prepare a message to return
-    message = item.serialize()
-
-    # Send the location to GET the new item
-    location_url = url_for(
-        "get_items", shopcart_id=shopcart_id, item_id=item.id, _external=True
-    )
-    return jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
+    # Every item is validated before anything is written
+    items, bulk = api.new_items(shopcart_id, request.get_json(), app.config)
+    code = status.HTTP_201_CREATED
+    with api.unique_item_names(shopcart_id):
+        if api.wants_merge(request):
+            # One upsert adds the quantity of an item to the one of the same name
+            app.logger.info("Merging %d items into shopcart %s", len(items), shopcart_id)
+            items = Item.upsert(Item.combine(items))
+            code = api.added_status([item.version for item in items])
+        elif bulk:
+            # One multi-row INSERT and a single commit
+            app.logger.info("Creating %d items for shopcart %s", len(items), shopcart_id)
+            Item.bulk_create(items)
+        else:
+            # Append the item to the shopcart
+            shopcart.items.append(items[0])
+            items[0].create()
+
+    # Send the location to GET the new items
+    location_url = api.added_location(external_url, shopcart_id, [item.id for item in items], bulk)
+    message = [item.serialize() for item in items] if bulk else items[0].serialize()
+    return jsonify(message), code, {"Location": location_url}
 
 
 ######################################################################
@@ -280,10 +445,8 @@ def delete_items(shopcart_id, item_id):
         "Request to delete item %s for shopcart id: %s", (item_id, shopcart_id)
     )
 
-    # See if the item exists and delete it if it does
-    item = Item.find(item_id)
-    if item:
-        item.delete()
+    # Delete the item by key if it exists in this shopcart
+    Item.delete_by_shopcart(shopcart_id, item_id=item_id)
 
     return "", status.HTTP_204_NO_CONTENT
 
@@ -300,9 +463,8 @@ def clear_items(shopcart_id):
     if not shopcart:
         abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' not found.")
 
-    # Delete all items from the shopcart
-    for item in list(shopcart.items):  # Make a copy to avoid modifying during iteration
-        item.delete()
+    # Delete all items from the shopcart with a single DELETE
+    Item.delete_by_shopcart(shopcart_id)
 
     return "", status.HTTP_204_NO_CONTENT
 
@@ -322,14 +484,14 @@ def get_items(shopcart_id, item_id):
     )
 
     # See if the item exists and abort if it doesn't
-    item = Item.find(item_id)
+    item = Item.find_serialized(item_id, request.if_none_match)
     if not item:
         abort(
             status.HTTP_404_NOT_FOUND,
             f"item with id '{item_id}' could not be found.",
         )
 
-    return jsonify(item.serialize()), status.HTTP_200_OK
+    return record_response(*item)
 
 
 ######################################################################
@@ -337,7 +499,13 @@ def get_items(shopcart_id, item_id):
 ######################################################################
 @app.route("/shopcarts/<int:shopcart_id>/items", methods=["GET"])
 def list_items(shopcart_id):
-    """Returns all of the items for a Shopping Cart, optionally filtered"""
+    """
+    Returns all of the items for a Shopping Cart, optionally filtered
+
+    Pass limit and/or cursor to page through the results; the next page is
+    advertised in the Link and X-Next-Cursor response headers. Without them
+    every item is streamed back as a JSON array (or NDJSON on request)
+    """
     app.logger.info("Request for all items for shopcart with id: %s", shopcart_id)
 
     shopcart = Shopcart.find(shopcart_id)
@@ -347,18 +515,10 @@ def list_items(shopcart_id):
             f"Shopcart with id '{shopcart_id}' could not be found.",
         )
 
-    items = shopcart.items
-
-    name = request.args.get("name")
-    quantity = request.args.get("quantity", type=int)
-
-    if name:
-        items = [i for i in items if i.name == name]
-    if quantity:
-        items = [i for i in items if i.quantity == quantity]
+    name, quantity = api.item_filters(request)
 
-    results = [item.serialize() for item in items]
-    return jsonify(results), status.HTTP_200_OK
+    query = Item.find_by_shopcart(shopcart_id, name=name, quantity=quantity)
+    return list_response(Item, query)
 
 
 # ######################################################################
@@ -369,10 +529,12 @@ def update_item(shopcart_id, item_id):
     """
     Update an Item in a Shopcart
 
-    This endpoint will update an Item based on the data in the body that is posted
+    This endpoint will update an Item based on the data in the body that is posted.
+    Send the ETag of the Item in If-Match to only update it if nobody else
+    has changed it since; otherwise 412 Precondition Failed is returned
     """
     app.logger.info("Request to update item %s for shopcart %s", item_id, shopcart_id)
-    check_content_type("application/json")
+    api.check_content_type(request)
 
     # Verify the shopcart exists
     shopcart = Shopcart.find(shopcart_id)
@@ -386,6 +548,7 @@ def update_item(shopcart_id, item_id):
             status.HTTP_404_NOT_FOUND,
             f"Item with id '{item_id}' not found in Shopcart {shopcart_id}.",
         )
+    api.check_if_match(request, item.etag())
 
     item_json = request.get_json()
 
@@ -395,5 +558,9 @@ def update_item(shopcart_id, item_id):
     item.deserialize(item_json)
     item.id = item_id
     item.update()  # Ensure your Item model has an update() that commits changes
+    # The item may have been moved out of this shopcart
+    Shopcart.invalidate_cache(shopcart)
 
-    return jsonify(item.serialize()), status.HTTP_200_OK
+    response = jsonify(item.serialize())
+    response.set_etag(item.etag())
+    return response
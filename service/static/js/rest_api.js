@@ -261,8 +261,9 @@ $(function () {
             "description": description
         };
 
-        // Construct the API endpoint URL
-        let url = `/shopcarts/${shopcart_id}/items`;
+        // Construct the API endpoint URL; adding an item the cart already
+        // holds adds to its quantity instead of failing on the duplicate name
+        let url = `/shopcarts/${shopcart_id}/items?merge=true`;
 
         // Clear flash message and perform AJAX POST
         $("#flash_message").empty();
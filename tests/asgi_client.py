@@ -0,0 +1,113 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test client that calls an ASGI app directly, without a server
+"""
+import asyncio
+import json
+
+from werkzeug.datastructures import Headers
+
+from service.common.json_provider import ENCODERS
+
+
+class AsgiResponse:
+    """The status, headers and body an ASGI app sent back"""
+
+    def __init__(self, messages):
+        start = messages[0]
+        self.status_code = start["status"]
+        self.headers = Headers(
+            [(key.decode("latin-1"), value.decode("latin-1")) for key, value in start["headers"]]
+        )
+        self.chunks = [message.get("body", b"") for message in messages[1:]]
+        self.data = b"".join(self.chunks)
+
+    @property
+    def content_type(self):
+        """The Content-Type header, if any"""
+        return self.headers.get("Content-Type")
+
+    def get_json(self):
+        """Parses the body as JSON"""
+        return json.loads(self.data)
+
+
+class AsgiClient:
+    """Sends requests to an ASGI app on an event loop of its own
+
+    The same loop runs every request, so pooled asyncio connections can be
+    reused from one request to the next
+    """
+
+    def __init__(self, app, host="localhost"):
+        self.app = app
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, coroutine):
+        """Runs a coroutine on the client's event loop"""
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        """Closes the event loop"""
+        self.loop.close()
+
+    async def request(self, method, url, json_body=None, headers=None):
+        """Sends a request and returns the AsgiResponse"""
+        path, _, query_string = url.partition("?")
+        headers = {"Host": self.host, **(headers or {})}
+        body = b""
+        if json_body is not None:
+            body = json.dumps(json_body, default=lambda obj: ENCODERS[type(obj)](obj)).encode()
+            headers.setdefault("Content-Type", "application/json")
+        scope = {
+            "type": "http",
+            "method": method,
+            "scheme": "http",
+            "server": (self.host, 80),
+            "path": path,
+            "query_string": query_string.encode(),
+            "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+        }
+        received = [{"type": "http.request", "body": body}]
+        messages = []
+
+        async def receive():
+            return received.pop() if received else {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        return AsgiResponse(messages)
+
+    def get(self, url, **kwargs):
+        """Sends a GET request"""
+        return self.run(self.request("GET", url, **kwargs))
+
+    def post(self, url, json=None, **kwargs):  # pylint: disable=redefined-outer-name
+        """Sends a POST request with a JSON body"""
+        return self.run(self.request("POST", url, json, **kwargs))
+
+    def put(self, url, json=None, **kwargs):  # pylint: disable=redefined-outer-name
+        """Sends a PUT request with a JSON body"""
+        return self.run(self.request("PUT", url, json, **kwargs))
+
+    def delete(self, url, **kwargs):
+        """Sends a DELETE request"""
+        return self.run(self.request("DELETE", url, **kwargs))
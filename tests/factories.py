@@ -4,9 +4,22 @@ Test Factory to make fake objects for testing
 
 import factory
 from factory import post_generation
-from factory.fuzzy import FuzzyChoice, FuzzyInteger, FuzzyDecimal
+from factory.fuzzy import FuzzyInteger, FuzzyDecimal
 from service.models import Shopcart, Item
 
+GROCERIES = (
+    "Milk",
+    "Bread",
+    "Eggs",
+    "Cheese",
+    "Apples",
+    "Bananas",
+    "Carrots",
+    "Tomatoes",
+    "Chicken",
+    "Beef",
+)
+
 
 class ShopcartFactory(factory.Factory):
     """Creates fake shopcarts that you don't have to feed"""
@@ -46,20 +59,8 @@ class ItemFactory(factory.Factory):
 
     id = factory.Sequence(lambda n: n)
     shopcart_id = None
-    name = FuzzyChoice(
-        choices=[
-            "Milk",
-            "Bread",
-            "Eggs",
-            "Cheese",
-            "Apples",
-            "Bananas",
-            "Carrots",
-            "Tomatoes",
-            "Chicken",
-            "Beef",
-        ]
-    )
+    # a shopcart holds one item of each name, so every name is numbered
+    name = factory.Sequence(lambda n: f"{GROCERIES[n % len(GROCERIES)]} {n}")
     description = factory.Faker("sentence", nb_words=3)
     quantity = FuzzyInteger(1, 20)
     price = FuzzyDecimal(0.50, 20.00, precision=2)
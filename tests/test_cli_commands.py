@@ -20,13 +20,15 @@ CLI Command Extensions for Flask
 
 # pylint: disable=duplicate-code
 import os
+from datetime import datetime
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, db_reconcile, db_status, db_upgrade  # noqa: E402
+from service.common.migrations import Migration
 
 
 class TestFlaskCLI(TestCase):
@@ -42,3 +44,43 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.db")
+    @patch("service.common.cli_commands.migrations")
+    def test_db_upgrade(self, migrations_mock, db_mock):
+        """It should apply the missing migrations"""
+        migrations_mock.upgrade.return_value = 3
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0)
+        migrations_mock.upgrade.assert_called_once_with(db_mock.engine)
+        self.assertIn("Schema is at version 3", result.output)
+
+    @patch("service.common.cli_commands.db")
+    @patch("service.common.cli_commands.migrations")
+    def test_db_status(self, migrations_mock, _):
+        """It should list the applied and pending migrations"""
+        migrations_mock.status.return_value = (
+            2,
+            [
+                (Migration(1, "Create tables", None, True), None),
+                (Migration(2, "Add columns", None, True), datetime(2025, 3, 1, 12, 30)),
+                (Migration(3, "Add indexes", None, False), None),
+            ],
+        )
+        result = self.runner.invoke(db_status)
+        self.assertEqual(result.exit_code, 0)
+        lines = result.output.splitlines()
+        self.assertIn("Schema is at version 2 of", lines[0])
+        self.assertIn("applied", lines[1])
+        self.assertIn("applied 2025-03-01 12:30:00", lines[2])
+        self.assertIn("pending", lines[3])
+
+    @patch("service.common.cli_commands.db")
+    @patch("service.common.cli_commands.Shopcart")
+    def test_db_reconcile(self, shopcart_mock, db_mock):
+        """It should reconcile the shopcart summaries in batches"""
+        shopcart_mock.reconcile_summaries.return_value = (120, 2)
+        result = self.runner.invoke(db_reconcile, ["--batch-size", "50"])
+        self.assertEqual(result.exit_code, 0)
+        shopcart_mock.reconcile_summaries.assert_called_once_with(db_mock.engine, 50)
+        self.assertIn("Checked 120 shopcarts, fixed 2", result.output)
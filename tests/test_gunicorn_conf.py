@@ -0,0 +1,174 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the gunicorn configuration
+"""
+
+import os
+import runpy
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+
+
+def load_conf(**env):
+    """Returns the settings gunicorn.conf.py computes in an environment"""
+    clean = {k: v for k, v in os.environ.items() if not k.startswith("GUNICORN_")}
+    with patch.dict(os.environ, {**clean, **env}, clear=True):
+        return runpy.run_path(CONF_PATH)
+
+
+def write(root, path, content):
+    """Writes a cgroup file under root"""
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content)
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(TestCase):
+    """gunicorn.conf.py Tests"""
+
+    def setUp(self):
+        self.conf = load_conf()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_cpu_quota_v2(self):
+        """It should read the CPU quota of cgroup v2"""
+        write(self.root, "cpu.max", "150000 100000\n")
+        self.assertEqual(self.conf["cpu_quota"](self.root), 1.5)
+        write(self.root, "cpu.max", "max 100000\n")
+        self.assertIsNone(self.conf["cpu_quota"](self.root))
+
+    def test_cpu_quota_v1(self):
+        """It should read the CPU quota of cgroup v1"""
+        write(self.root, "cpu/cpu.cfs_quota_us", "200000\n")
+        write(self.root, "cpu/cpu.cfs_period_us", "100000\n")
+        self.assertEqual(self.conf["cpu_quota"](self.root), 2.0)
+        write(self.root, "cpu/cpu.cfs_quota_us", "-1\n")
+        self.assertIsNone(self.conf["cpu_quota"](self.root))
+
+    def test_cpu_count(self):
+        """It should cap the usable CPUs by the quota, rounding down"""
+        with patch("os.sched_getaffinity", return_value=set(range(64))):
+            self.assertEqual(self.conf["cpu_count"](self.root), 64)
+            write(self.root, "cpu.max", "250000 100000\n")
+            self.assertEqual(self.conf["cpu_count"](self.root), 2)
+            write(self.root, "cpu.max", "25000 100000\n")
+            self.assertEqual(self.conf["cpu_count"](self.root), 1)
+
+    def test_memory_limit(self):
+        """It should read the memory limit of cgroup v2 and v1"""
+        self.assertIsNone(self.conf["memory_limit"](self.root))
+        write(self.root, "memory/memory.limit_in_bytes", "9223372036854771712\n")
+        self.assertIsNone(self.conf["memory_limit"](self.root))
+        write(self.root, "memory/memory.limit_in_bytes", "67108864\n")
+        self.assertEqual(self.conf["memory_limit"](self.root), 64 * 1024 * 1024)
+        write(self.root, "memory.max", "max\n")
+        self.assertIsNone(self.conf["memory_limit"](self.root))
+        write(self.root, "memory.max", "536870912\n")
+        self.assertEqual(self.conf["memory_limit"](self.root), 512 * 1024 * 1024)
+
+    def test_default_workers(self):
+        """It should start 2 x CPUs + 1 sync workers and one per CPU otherwise"""
+        default_workers = self.conf["default_workers"]
+        self.assertEqual(default_workers("gthread", 1), 1)
+        self.assertEqual(default_workers("gthread", 2), 2)
+        self.assertEqual(default_workers("sync", 4), 9)
+        self.assertEqual(default_workers("gevent", 4), 4)
+        self.assertEqual(default_workers("uvicorn.workers.UvicornWorker", 4), 4)
+
+    def test_workers_capped_by_memory(self):
+        """It should start no more workers than fit in the memory limit"""
+        default_workers = self.conf["default_workers"]
+        mib = 1024 * 1024
+        self.assertEqual(default_workers("sync", 4, 64 * mib), 1)
+        self.assertEqual(default_workers("sync", 4, 512 * mib), 4)
+        self.assertEqual(default_workers("gthread", 4, 4096 * mib), 4)
+        with patch.dict(os.environ, {"GUNICORN_WORKER_MEMORY_MB": "64"}):
+            self.assertEqual(default_workers("sync", 4, 512 * mib), 7)
+
+    def test_defaults(self):
+        """It should run preloaded gthread workers by default"""
+        self.assertEqual(self.conf["worker_class"], "gthread")
+        self.assertEqual(self.conf["threads"], 4)
+        self.assertTrue(self.conf["preload_app"])
+        self.assertEqual(self.conf["max_requests_jitter"], self.conf["max_requests"] // 10)
+        self.assertEqual(self.conf["bind"], f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+    def test_environment(self):
+        """It should take every setting from the environment"""
+        conf = load_conf(
+            GUNICORN_WORKER_CLASS="sync",
+            GUNICORN_WORKERS="3",
+            GUNICORN_KEEPALIVE="75",
+            GUNICORN_MAX_REQUESTS="500",
+            GUNICORN_TIMEOUT="60",
+            GUNICORN_GRACEFUL_TIMEOUT="20",
+            GUNICORN_BIND="127.0.0.1:9000",
+        )
+        self.assertEqual(conf["workers"], 3)
+        self.assertEqual(conf["threads"], 1)
+        self.assertEqual(conf["keepalive"], 75)
+        self.assertEqual(conf["max_requests_jitter"], 50)
+        self.assertEqual(conf["timeout"], 60)
+        self.assertEqual(conf["graceful_timeout"], 20)
+        self.assertEqual(conf["bind"], "127.0.0.1:9000")
+
+    def test_threads_capped_by_pool(self):
+        """It should not run more threads than pooled connections"""
+        conf = load_conf(DB_POOL_SIZE="2", DB_MAX_OVERFLOW="0")
+        self.assertEqual(conf["threads"], 2)
+
+    def test_gevent_not_preloaded(self):
+        """It should not preload the app for gevent workers"""
+        self.assertFalse(load_conf(GUNICORN_WORKER_CLASS="gevent")["preload_app"])
+
+    def test_on_starting(self):
+        """It should remove the metrics files of the last run"""
+        write(self.root, "requests_1.json", "{}")
+        write(self.root, "requests_2.json.tmp", "{")
+        write(self.root, "other.txt", "")
+        with patch.dict(os.environ, {"METRICS_MULTIPROC_DIR": self.root}):
+            self.conf["on_starting"](MagicMock())
+        self.assertEqual(os.listdir(self.root), ["other.txt"])
+
+    def test_post_fork(self):
+        """It should drop the pooled connections of a preloaded app"""
+        server = MagicMock()
+        server.cfg.preload_app = False
+        self.conf["post_fork"](server, None)
+        server.app.wsgi.assert_not_called()
+
+        server.cfg.preload_app = True
+        with patch("service.models.db") as db_mock:
+            self.conf["post_fork"](server, None)
+        db_mock.engine.dispose.assert_called_once_with(close=False)
+
+        server.app.wsgi.return_value = object()
+        with patch("service.models.db") as db_mock:
+            self.conf["post_fork"](server, None)
+        db_mock.engine.dispose.assert_not_called()
@@ -22,8 +22,10 @@ Test cases for Item
 import os
 import logging
 from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy.dialects import sqlite
 from wsgi import app
-from service.models import Shopcart, Item, db
+from service.models import Shopcart, Item, DataValidationError, ConcurrencyError, DuplicateError, db
 from .factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -119,6 +121,31 @@ class TestItem(TestCase):
         item = shopcart.items[0]
         self.assertEqual(item.quantity, 10)
 
+    def test_update_stale_item(self):
+        """It should not overwrite an Item that was changed since it was read"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory(id=None)]
+        shopcart.create()
+        item = shopcart.items[0]
+        self.assertEqual(item.version, 1)
+
+        # another request updates the row behind our back
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Item.__table__)
+                .where(Item.id == item.id)
+                .values(quantity=50, version=Item.version + 1)
+            )
+        item.quantity = 10
+        self.assertRaises(ConcurrencyError, item.update)
+        self.assertEqual(Item.find(item.id).quantity, 50)
+
+        # once re-read the update goes through and bumps the version
+        item = Item.find(item.id)
+        item.quantity = 10
+        item.update()
+        self.assertEqual(Item.find(item.id).version, 3)
+
     def test_delete_shopcart_item(self):
         """It should Delete an shopcarts item"""
         shopcarts = Shopcart.all()
@@ -166,6 +193,15 @@ class TestItem(TestCase):
         self.assertEqual(new_item.quantity, item.quantity)
         self.assertEqual(new_item.price, item.price)
 
+    def test_deserialize_new_items(self):
+        """It should deserialize new Items of a Shopcart without ids"""
+        data = ItemFactory().serialize()
+        del data["id"]
+        items = Item.deserialize_new(7, [data, {**data, "id": 3}])
+        self.assertEqual([item.shopcart_id for item in items], [7, 7])
+        self.assertEqual([item.id for item in items], [None, 3])
+        self.assertRaises(DataValidationError, Item.deserialize_new, 7, [data, {"name": "Milk"}])
+
     def test_delete_item_directly(self):
         """It should delete an item using the model's delete()"""
         item = ItemFactory()
@@ -187,3 +223,169 @@ class TestItem(TestCase):
         item_id = item.id
         item.delete()
         self.assertIsNone(Item.find(item_id))
+
+    def test_bulk_create_items(self):
+        """It should create many items with a single INSERT"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        items = [ItemFactory(shopcart_id=shopcart.id, shopcart=None) for _ in range(5)]
+        created = Item.bulk_create(items)
+        self.assertIs(created, items)
+        self.assertTrue(all(item.id for item in items))
+        found = Item.find_by_shopcart(shopcart.id).all()
+        self.assertEqual([item.id for item in found], [item.id for item in items])
+        self.assertEqual([item.name for item in found], [item.name for item in items])
+
+    def test_bulk_create_items_failed(self):
+        """It should not create any items on database error"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        items = [ItemFactory(shopcart_id=shopcart.id, shopcart=None) for _ in range(2)]
+        with patch("service.models.db.session.commit") as exception_mock:
+            exception_mock.side_effect = Exception()
+            self.assertRaises(DataValidationError, Item.bulk_create, items)
+        self.assertEqual(Item.find_by_shopcart(shopcart.id).count(), 0)
+
+    def test_delete_items_by_shopcart(self):
+        """It should delete the items of a shopcart with one statement"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(3)
+        shopcart.create()
+        other = ShopcartFactory()
+        other.items = ItemFactory.create_batch(2)
+        other.create()
+        item_id = shopcart.items[0].id
+
+        self.assertEqual(Item.delete_by_shopcart(other.id, item_id=item_id), 0)
+        self.assertEqual(Item.delete_by_shopcart(shopcart.id, item_id=item_id), 1)
+        self.assertIsNone(Item.find(item_id))
+        self.assertEqual(Item.delete_by_shopcart(shopcart.id), 2)
+        self.assertEqual(Item.find_by_shopcart(shopcart.id).count(), 0)
+        self.assertEqual(Item.find_by_shopcart(other.id).count(), 2)
+
+    def test_delete_where_failed(self):
+        """It should not delete any items on database error"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(2)
+        shopcart.create()
+        with patch("service.models.db.session.commit") as exception_mock:
+            exception_mock.side_effect = Exception()
+            self.assertRaises(DataValidationError, Item.delete_by_shopcart, shopcart.id)
+        self.assertEqual(Item.find_by_shopcart(shopcart.id).count(), 2)
+
+    def _assert_summaries(self, *shopcarts):
+        """Checks the summary columns of shopcarts against their items"""
+        ids = [shopcart.id for shopcart in shopcarts]
+        db.session.expire_all()
+        kept = Shopcart.serialize_totals(db.session.execute(Shopcart.totals_statement(ids)))
+        computed = Shopcart.serialize_totals(db.session.execute(Shopcart.computed_totals_statement(ids)))
+        self.assertEqual(kept, computed)
+        return kept
+
+    def test_summary_follows_item_writes(self):
+        """It should keep the shopcart summary up to date on every item write"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(3, quantity=2, price=1.25)
+        shopcart.create()
+        other = ShopcartFactory()
+        other.create()
+        totals = self._assert_summaries(shopcart, other)
+        self.assertEqual(totals[0]["item_count"], 3)
+        self.assertEqual(totals[0]["unit_count"], 6)
+        self.assertEqual(totals[0]["subtotal"], 7.5)
+
+        item = ItemFactory(shopcart=shopcart)
+        item.create()
+        item.quantity = 5
+        item.update()
+        self._assert_summaries(shopcart, other)
+        item.shopcart = other
+        item.update()
+        self.assertEqual(self._assert_summaries(shopcart, other)[1]["item_count"], 1)
+        item.delete()
+        self._assert_summaries(shopcart, other)
+
+        Item.bulk_create([ItemFactory(shopcart_id=other.id, shopcart=None) for _ in range(4)])
+        self._assert_summaries(shopcart, other)
+        Item.delete_by_shopcart(shopcart.id, item_id=shopcart.items[0].id)
+        self._assert_summaries(shopcart, other)
+        Item.delete_by_shopcart(other.id)
+        totals = self._assert_summaries(shopcart, other)
+        self.assertEqual(totals[1], {"shopcart_id": other.id, "item_count": 0, "unit_count": 0, "subtotal": 0.0})
+
+    def test_summary_rolled_back(self):
+        """It should not change the summary when an item write fails"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(2)
+        shopcart.create()
+        items = [ItemFactory(shopcart_id=shopcart.id, shopcart=None) for _ in range(2)]
+        with patch("service.models.db.session.commit") as exception_mock:
+            exception_mock.side_effect = Exception()
+            self.assertRaises(DataValidationError, Item.bulk_create, items)
+        self.assertEqual(self._assert_summaries(shopcart)[0]["item_count"], 2)
+        # a flush that fails takes its summary changes with it
+        bad = ItemFactory(shopcart=shopcart, description=None)
+        self.assertRaises(DataValidationError, bad.create)
+        ItemFactory(shopcart=shopcart).create()
+        self.assertEqual(self._assert_summaries(shopcart)[0]["item_count"], 3)
+
+    def test_upsert_items(self):
+        """It should create new Items and add to the quantity of the ones already there"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory(name="Milk", quantity=2, price=1.5)]
+        shopcart.create()
+        milk = shopcart.items[0]
+        items = [
+            ItemFactory(shopcart_id=shopcart.id, shopcart=None, id=None, name=name, quantity=quantity, price=3)
+            for name, quantity in (("Milk", 3), ("Eggs", 1))
+        ]
+        upserted = Item.upsert(items)
+        self.assertEqual([item.name for item in upserted], ["Milk", "Eggs"])
+        self.assertEqual(upserted[0].id, milk.id)
+        self.assertEqual((upserted[0].quantity, upserted[0].price, upserted[0].version), (5, 1.5, 2))
+        self.assertEqual((upserted[1].quantity, upserted[1].version), (1, 1))
+        totals = self._assert_summaries(shopcart)
+        self.assertEqual(totals[0], {"shopcart_id": shopcart.id, "item_count": 2, "unit_count": 6, "subtotal": 10.5})
+
+    def test_upsert_items_failed(self):
+        """It should not write any Items when the upsert fails"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        items = [ItemFactory(shopcart_id=shopcart.id, shopcart=None, id=None, name="Milk") for _ in range(2)]
+        # two rows for the same Item in one statement
+        self.assertRaises(DataValidationError, Item.upsert, items)
+        self.assertEqual(Item.find_by_shopcart(shopcart.id).count(), 0)
+        self.assertRaises(DataValidationError, Item.upsert_statement, "mysql")
+
+    def test_combine_items(self):
+        """It should make Items of the same Shopcart and name into one"""
+        items = [
+            ItemFactory(shopcart_id=1, shopcart=None, name="Milk", quantity=1),
+            ItemFactory(shopcart_id=1, shopcart=None, name="Eggs", quantity=2),
+            ItemFactory(shopcart_id=1, shopcart=None, name="Milk", quantity=3),
+            ItemFactory(shopcart_id=2, shopcart=None, name="Milk", quantity=4),
+        ]
+        combined = Item.combine(items)
+        self.assertEqual(combined, [items[0], items[1], items[3]])
+        self.assertEqual([item.quantity for item in combined], [4, 2, 4])
+
+    def test_unique_item_names(self):
+        """It should not create two Items of the same name in a Shopcart"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory(name="Milk")]
+        shopcart.create()
+        item = ItemFactory(shopcart_id=shopcart.id, shopcart=None, name="Milk")
+        self.assertRaises(DuplicateError, Item.bulk_create, [item])
+        item = ItemFactory(shopcart_id=shopcart.id, shopcart=shopcart, name="Milk")
+        self.assertRaises(DuplicateError, item.create)
+        other = ShopcartFactory()
+        other.items = [ItemFactory(name="Milk")]
+        other.create()
+        self.assertEqual(Item.find_by_shopcart(other.id).count(), 1)
+
+    def test_upsert_statement_sqlite(self):
+        """It should build the upsert for SQLite as well"""
+        statement = Item.upsert_statement("sqlite").values(shopcart_id=1, name="Milk", quantity=1)
+        sql = str(statement.compile(dialect=sqlite.dialect()))
+        self.assertIn("ON CONFLICT (shopcart_id, name) DO UPDATE SET", sql)
+        self.assertIn("quantity = (item.quantity + excluded.quantity)", sql)
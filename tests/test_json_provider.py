@@ -0,0 +1,130 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the JSON provider
+"""
+
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
+from service.common import json_provider, status
+from service.common.json_provider import OrjsonProvider, init_json
+
+
+class Html:  # pylint: disable=too-few-public-methods
+    """An object Flask encodes through its __html__ method"""
+
+    def __html__(self):
+        return "<b>fresh</b>"
+
+
+PAYLOAD = {
+    "id": 7,
+    "time_atc": datetime(2025, 3, 1, 12, 30, 5),
+    "day": date(2025, 3, 1),
+    "price": Decimal("4.99"),
+    "token": uuid.UUID(int=1),
+    "note": Html(),
+    "items": [{"quantity": 2, "name": "Milk", "ratio": 0.5, "gift": None, "fresh": True}],
+}
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+@skipUnless(json_provider.orjson, "orjson is not installed")
+class TestJsonProvider(TestCase):
+    """JSON Provider Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.stdlib = DefaultJSONProvider(self.app)
+        self.provider = OrjsonProvider(self.app)
+
+    def test_same_output(self):
+        """It should produce the same JSON as the stdlib provider"""
+        expected = self.stdlib.dumps(PAYLOAD, separators=(",", ":"))
+        self.assertEqual(self.provider.dumps(PAYLOAD), expected)
+        self.assertIn('"time_atc":"Sat, 01 Mar 2025 12:30:05 GMT"', expected)
+        with self.app.app_context():
+            self.assertEqual(self.provider.response(PAYLOAD).get_data(as_text=True), expected + "\n")
+
+    def test_indent(self):
+        """It should indent the responses in debug mode like the stdlib"""
+        self.app.debug = True
+        with self.app.app_context():
+            self.assertEqual(
+                self.provider.response(PAYLOAD).get_data(), self.stdlib.response(PAYLOAD).get_data()
+            )
+
+    def test_stdlib_fallback(self):
+        """It should hand what orjson cannot do to the stdlib"""
+        big = {"big": 2**70}
+        self.assertEqual(self.provider.dumps(big), '{"big":1180591620717411303424}')
+        with self.app.app_context():
+            self.assertEqual(self.provider.response(big).get_json(), big)
+        self.assertEqual(self.provider.dumps([1], separators=(", ", ": "), indent=4), "[\n    1\n]")
+        self.assertEqual(self.provider.loads('{"big": 1180591620717411303424}'), big)
+        self.assertEqual(self.provider.loads("[1.5]", parse_float=Decimal), [Decimal("1.5")])
+        self.assertRaises(ValueError, self.provider.loads, b"{")
+
+    def test_request_body(self):
+        """It should parse request bodies"""
+        self.app.json = self.provider
+
+        @self.app.route("/", methods=["POST"])
+        def echo():
+            return {"received": request.get_json()}
+
+        client = self.app.test_client()
+        resp = client.post("/", data='{"name": "Müsli"}', content_type="application/json")
+        self.assertEqual(resp.get_json(), {"received": {"name": "Müsli"}})
+        resp = client.post("/", data=b"{", content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_init(self):
+        """It should pick the provider from JSON_PROVIDER"""
+        init_json(self.app)
+        self.assertIsInstance(self.app.json, OrjsonProvider)
+
+        stdlib_app = Flask(__name__)
+        stdlib_app.config["JSON_PROVIDER"] = "stdlib"
+        init_json(stdlib_app)
+        self.assertNotIsInstance(stdlib_app.json, OrjsonProvider)
+
+        stdlib_app.config["JSON_PROVIDER"] = "simplejson"
+        self.assertRaises(ValueError, init_json, stdlib_app)
+
+
+######################################################################
+#  S T D L I B   F A L L B A C K   T E S T   C A S E S
+######################################################################
+class TestJsonProviderFallback(TestCase):
+    """JSON Provider Tests without orjson"""
+
+    def test_orjson_missing(self):
+        """It should fall back to the stdlib when orjson is not installed"""
+        app = Flask(__name__)
+        app.config["JSON_PROVIDER"] = "orjson"
+        with patch.object(json_provider, "orjson", None):
+            with self.assertLogs("flask.app", level="WARNING"):
+                init_json(app)
+        self.assertNotIsInstance(app.json, OrjsonProvider)
@@ -18,16 +18,23 @@
 Test Shopcart API Service Test Suite
 """
 
-# pylint: disable=duplicate-code
+# pylint: disable=duplicate-code,too-many-lines
 import os
+import json
 import logging
+import threading
 from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch
+from sqlalchemy import event
+from sqlalchemy.exc import ProgrammingError
 from wsgi import app
 from tests.factories import ShopcartFactory, ItemFactory
-from service.models import db, Shopcart
+from service.models import db, Shopcart, Item, ConcurrencyError
 from service.common import status
+from service.common.cache import CACHE
+from service.common import query_stats
+from service.common.query_stats import QueryCounter, QUERY_COUNT_HEADER, SERVER_TIMING_HEADER
 from service import create_app
 
 DATABASE_URI = os.getenv(
@@ -105,6 +112,7 @@ class TestShopcartService(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.get_json()
         self.assertEqual(data["message"], "Healthy")
+        self.assertIn("hits", data["cache"])
 
     def test_get_shopcart_list(self):
         """It should Get a list of shopcarts"""
@@ -114,6 +122,194 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_shopcart_list_paginated(self):
+        """It should page through shopcarts with limit and cursor"""
+        shopcarts = self._create_shopcarts(5)
+        resp = self.client.get(BASE_URL, query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([sc["id"] for sc in resp.get_json()], [sc.id for sc in shopcarts[:2]])
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        seen = []
+        url = BASE_URL + "?limit=2"
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(sc["id"] for sc in resp.get_json())
+            link = resp.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        self.assertEqual(seen, [sc.id for sc in shopcarts])
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_get_shopcart_list_cursor_only(self):
+        """It should use the default page size when only a cursor is given"""
+        shopcarts = self._create_shopcarts(3)
+        resp = self.client.get(BASE_URL, query_string={"limit": 1})
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get(BASE_URL, query_string={"cursor": cursor})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([sc["id"] for sc in resp.get_json()], [sc.id for sc in shopcarts[1:]])
+
+    def test_get_shopcart_list_page_size_max(self):
+        """It should never return more than PAGE_SIZE_MAX records per page"""
+        self._create_shopcarts(3)
+        with patch.dict(app.config, {"PAGE_SIZE_MAX": 2}):
+            resp = self.client.get(BASE_URL, query_string={"limit": 100})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn("limit=2", resp.headers["Link"])
+
+    def test_get_shopcart_list_bad_page_args(self):
+        """It should not page through shopcarts with a bad limit or cursor"""
+        for args in [
+            {"limit": 0},
+            {"limit": "ten"},
+            {"cursor": "not-a-cursor"},
+            {"cursor": "WzFd"},  # [1]
+            {"cursor": "eyJpZCI6IngifQ"},  # {"id":"x"}
+        ]:
+            resp = self.client.get(BASE_URL, query_string=args)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, args)
+
+    def _list_query_count(self, strategy, **args):
+        """Returns the statements GET /shopcarts ran with an item loader
+
+        The core read model is used when the strategy is "core"
+        """
+        config = {"READ_MODEL": "core"} if strategy == "core" else {
+            "READ_MODEL": "orm", "ITEM_LOADER_STRATEGY": strategy
+        }
+        with patch.dict(app.config, {**config, "SQL_QUERY_COUNT_HEADER": True}):
+            with QueryCounter() as counter:
+                resp = self.client.get(BASE_URL, query_string=args)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        if args:
+            # a single page is not streamed so the header has the full count
+            self.assertEqual(int(resp.headers[QUERY_COUNT_HEADER]), counter.count)
+        return counter.count
+
+    def test_list_shopcarts_constant_queries(self):
+        """It should list shopcarts with a constant number of queries"""
+        for count in (2, 6):
+            for shopcart in self._create_shopcarts(count // 2):
+                for item in ItemFactory.create_batch(2):
+                    self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+            # one aggregate for the ETag, then the list and its items
+            self.assertEqual(self._list_query_count("core"), 3)
+            self.assertEqual(self._list_query_count("core", limit=10), 3)
+            self.assertEqual(self._list_query_count("selectin"), 3)
+            self.assertEqual(self._list_query_count("selectin", limit=10), 3)
+            self.assertEqual(self._list_query_count("joined", limit=10), 2)
+            # streaming falls back to selectin since joined can't use yield_per
+            self.assertEqual(self._list_query_count("joined"), 3)
+        # the lazy loader issues one SELECT per shopcart on top of the list
+        self.assertEqual(self._list_query_count("lazy"), 2 + 4)
+
+    def test_query_count_header_disabled(self):
+        """It should not send the query count unless it is enabled"""
+        with patch.dict(app.config, {"SQL_QUERY_COUNT_HEADER": False}):
+            resp = self.client.get(BASE_URL)
+        self.assertNotIn(QUERY_COUNT_HEADER, resp.headers)
+
+    def test_query_counter(self):
+        """It should count the statements run inside a QueryCounter"""
+        shopcart = self._create_shopcarts(1)[0]
+        with QueryCounter() as counter:
+            self.client.get(f"{BASE_URL}/{shopcart.id}")
+        # one SELECT of the shopcart joined to its items
+        self.assertEqual(counter.count, 1)
+
+    def _time_queries(self):
+        """Times the statements of db.engine as SERVER_TIMING=true does, until the test ends"""
+        query_stats.time_queries(db.engine)
+        for name, listener in (
+            ("before_cursor_execute", query_stats._start_query_timer),
+            ("after_cursor_execute", query_stats._stop_query_timer),
+            ("handle_error", query_stats._drop_query_timer),
+        ):
+            self.addCleanup(event.remove, db.engine, name, listener)
+
+    def test_queries_not_timed_by_default(self):
+        """It should not time the statements unless Server-Timing is enabled"""
+        self.assertFalse(app.config["SERVER_TIMING"])
+        self.assertFalse(event.contains(db.engine, "before_cursor_execute", query_stats._start_query_timer))
+
+    def test_server_timing(self):
+        """It should report query count, DB and serialization time when enabled"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._time_queries()
+        with patch.dict(app.config, {"SERVER_TIMING": True}):
+            with self.assertLogs(app.logger, level="INFO") as logs:
+                resp = self.client.get(BASE_URL, query_string={"limit": 10})
+                resp.close()
+        timing = resp.headers[SERVER_TIMING_HEADER]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="3 queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertRegex(logs.output[-1], r"GET /shopcarts\?limit=10 200 queries=3 db_ms=[\d.]+ serialize_ms=")
+
+        # a streamed list is logged once the whole body has been sent
+        with patch.dict(app.config, {"SERVER_TIMING": True}):
+            with self.assertLogs(app.logger, level="INFO") as logs:
+                resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+                self.assertEqual(resp.get_json(), [])
+                resp.close()
+        self.assertIn("queries=3", logs.output[-1])
+
+        resp = self.client.get(BASE_URL)
+        self.assertNotIn(SERVER_TIMING_HEADER, resp.headers)
+        resp.close()
+
+    def test_failed_query_timing(self):
+        """It should keep timing statements after one of them fails"""
+        self._time_queries()
+        self.assertRaises(
+            ProgrammingError, db.session.execute, db.text("SELECT * FROM no_such_table")
+        )
+        db.session.rollback()
+        connection = db.session.connection()
+        self.assertFalse(connection.info.get("query_start"))
+
+    def test_get_shopcart_list_streamed(self):
+        """It should stream every shopcart as a JSON array in batches"""
+        shopcarts = self._create_shopcarts(5)
+        with patch.dict(app.config, {"STREAM_BATCH_SIZE": 2}):
+            resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual([sc["id"] for sc in resp.get_json()], [sc.id for sc in shopcarts])
+
+    def test_get_shopcart_list_ndjson(self):
+        """It should stream shopcarts as NDJSON when asked to"""
+        shopcarts = self._create_shopcarts(3)
+        with patch.dict(app.config, {"STREAM_BATCH_SIZE": 2}):
+            resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [sc.id for sc in shopcarts])
+
+    def test_streamed_list_releases_connection(self):
+        """It should give the connection of a streamed list back to the pool"""
+        self._create_shopcarts(3)
+        checked_out = db.engine.pool.checkedout()
+
+        def request_list():
+            # outside of the application context the tests run in
+            self.client.get(BASE_URL).get_data()
+
+        thread = threading.Thread(target=request_list)
+        thread.start()
+        thread.join()
+        self.assertEqual(db.engine.pool.checkedout(), checked_out)
+
+    def test_get_empty_shopcart_list(self):
+        """It should stream an empty JSON array when there are no shopcarts"""
+        resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.get_data(as_text=True), "")
+
     def test_get_shopcart_by_customer_id(self):
         """It should Get an shopcart by customer_id"""
         shopcarts = self._create_shopcarts(3)
@@ -135,6 +331,205 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(data["customer_id"], shopcart.customer_id)
 
+    def test_get_shopcart_cached(self):
+        """It should serve a repeated read of a shopcart from the cache"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with QueryCounter() as counter:
+            again = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(again.get_json(), resp.get_json())
+
+        # adding an item through the API invalidates the cached shopcart
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(len(resp.get_json()["items"]), 1)
+
+    def test_update_item_moves_shopcart(self):
+        """It should refresh both shopcarts when an item moves between them"""
+        shopcarts = self._create_shopcarts(2)
+        source, target = shopcarts[0], shopcarts[1]
+        resp = self.client.post(f"{BASE_URL}/{source.id}/items", json=ItemFactory().serialize())
+        item = resp.get_json()
+        self.client.get(f"{BASE_URL}/{source.id}")
+        self.client.get(f"{BASE_URL}/{target.id}")
+
+        item["shopcart_id"] = target.id
+        resp = self.client.put(f"{BASE_URL}/{source.id}/items/{item['id']}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{source.id}").get_json()["items"], [])
+        self.assertEqual(len(self.client.get(f"{BASE_URL}/{target.id}").get_json()["items"]), 1)
+
+    def test_get_shopcart_not_modified(self):
+        """It should answer 304 Not Modified until a shopcart or its items change"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        # a new item changes the ETag of the shopcart
+        resp = self.client.post(f"{url}/items", json=ItemFactory().serialize())
+        item = resp.get_json()
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        etag = resp.headers["ETag"]
+
+        # and so does changing that item
+        item["quantity"] += 1
+        self.client.put(f"{url}/items/{item['id']}", json=item)
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["items"][0]["quantity"], item["quantity"])
+
+    def test_get_item_not_modified(self):
+        """It should answer 304 Not Modified until an item changes"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        item = resp.get_json()
+        url = f"{BASE_URL}/{shopcart.id}/items/{item['id']}"
+        etag = self.client.get(url).headers["ETag"]
+
+        # served from the database, then from the cache
+        for _ in range(2):
+            resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            CACHE.clear()
+
+        item["quantity"] += 1
+        self.client.put(url, json=item)
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_list_not_modified(self):
+        """It should answer 304 Not Modified for a list that has not changed"""
+        shopcarts = self._create_shopcarts(2)
+        items_url = f"{BASE_URL}/{shopcarts[0].id}/items"
+        self.client.post(items_url, json=ItemFactory().serialize())
+        for url, args in ((BASE_URL, {}), (BASE_URL, {"limit": 1}), (items_url, {})):
+            resp = self.client.get(url, query_string=args)
+            resp.get_data()
+            etag = resp.headers["ETag"]
+            self.assertIn("Accept", resp.headers["Vary"])
+            with QueryCounter() as counter:
+                resp = self.client.get(url, query_string=args, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            # only the aggregate for the ETag, the list itself is not loaded
+            self.assertLessEqual(counter.count, 2)
+
+        # NDJSON is a different representation with its own ETag
+        resp = self.client.get(
+            BASE_URL, headers={"Accept": "application/x-ndjson", "If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(resp.get_data(as_text=True).splitlines()), 2)
+
+        # removing an item changes both lists
+        etags = []
+        for url in (BASE_URL, items_url):
+            resp = self.client.get(url)
+            resp.get_data()
+            etags.append(resp.headers["ETag"])
+        self.client.delete(items_url)
+        for url, etag in zip((BASE_URL, items_url), etags):
+            resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertIsInstance(resp.get_json(), list)
+
+    def test_list_etag_late_commit(self):
+        """It should change the list ETags when a write commits with an older updated_at"""
+        shopcart = self._create_shopcarts(2)[0]
+        items_url = f"{BASE_URL}/{shopcart.id}/items"
+        for _ in range(2):
+            self.client.post(items_url, json=ItemFactory().serialize())
+        etags = []
+        for url in (BASE_URL, items_url):
+            resp = self.client.get(url)
+            etags.append(resp.headers["ETag"])
+            resp.close()
+
+        # a transaction that started first keeps its timestamp but commits last
+        db.session.execute(
+            db.update(Item)
+            .where(Item.shopcart_id == shopcart.id)
+            .values(quantity=Item.quantity + 1, version=Item.version + 1, updated_at=Item.updated_at)
+        )
+        db.session.commit()
+        for url, etag in zip((BASE_URL, items_url), etags):
+            resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp.close()
+
+    def test_shopcart_etag_late_commit(self):
+        """It should change a shopcart ETag when a write commits with an older updated_at"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        self.client.post(f"{url}/items", json=ItemFactory().serialize())
+        etag = self.client.get(url).headers["ETag"]
+
+        # a transaction that started first keeps its timestamp but commits last
+        db.session.execute(
+            db.update(Item)
+            .where(Item.shopcart_id == shopcart.id)
+            .values(quantity=Item.quantity + 1, version=Item.version + 1, updated_at=Item.updated_at)
+        )
+        db.session.commit()
+        # the direct UPDATE does not invalidate the read cache
+        CACHE.clear()
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # the ORM ETag a PUT checks If-Match against agrees with the GET
+        db.session.expire_all()
+        self.assertEqual(Shopcart.find(shopcart.id).etag(), resp.headers["ETag"].strip('"'))
+
+    def _put_if_match(self, url, field):
+        """PUTs url with If-Match set to its current ETag and again with a stale one"""
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        body = resp.get_json()
+        body.pop("items", None)
+        body[field] += 1
+        resp = self.client.put(url, json=body, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # the first writer changed the ETag so a second one with it fails
+        body[field] += 1
+        resp = self.client.put(url, json=body, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(resp.get_json()["error"], "Precondition Failed")
+
+        resp = self.client.put(url, json=body, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_update_if_match(self):
+        """It should only Update a shopcart or item whose ETag matches If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._put_if_match(f"{BASE_URL}/{shopcart.id}", "customer_id")
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        self._put_if_match(f"{BASE_URL}/{shopcart.id}/items/{resp.get_json()['id']}", "quantity")
+
+    def test_update_item_conflict(self):
+        """It should return 412 when an item changes while it is being updated"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        item = resp.get_json()
+        with patch.object(Item, "update", side_effect=ConcurrencyError("changed")):
+            resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/{item['id']}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(resp.get_json()["message"], "changed")
+
     def test_get_shopcart_not_found(self):
         """It should not Read an shopcart that is not found"""
         resp = self.client.get(f"{BASE_URL}/0")
@@ -196,6 +591,24 @@ class TestShopcartService(TestCase):
         updated_shopcart = resp.get_json()
         self.assertEqual(updated_shopcart["customer_id"], 1234567)
 
+    def test_update_shopcart_items(self):
+        """It should not change the Items of a Shopcart through its update"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}"
+        self.client.post(f"{url}/items", json=ItemFactory().serialize())
+        items = self.client.get(url).get_json()["items"]
+
+        resp = self.client.put(url, json={"customer_id": 5, "items": [ItemFactory().serialize()]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("items", resp.get_json()["message"])
+        resp = self.client.put(url, json=[])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # leaving the items out keeps them
+        resp = self.client.put(url, json={"customer_id": 5})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["items"], items)
+
     def test_delete_shopcart(self):
         """It should Delete an shopcart"""
         # get the id of an shopcart
@@ -325,6 +738,67 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(data["error"], "Bad Request")
 
+        # Test 413 request entity too large
+        with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 100}):
+            resp = self.client.post(BASE_URL, json={"customer_id": 1, "items": 100 * [{}]})
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        data = resp.get_json()
+        self.assertEqual(data["error"], "Request Entity Too Large")
+
+    def test_get_shopcart_totals(self):
+        """It should sum up the Items of a Shopcart in one query"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [
+            {**ItemFactory().serialize(), "quantity": 2, "price": 1.1},
+            {**ItemFactory().serialize(), "quantity": 3, "price": 0.2},
+        ]
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=items)
+
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}/totals")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(
+            resp.get_json(),
+            {"shopcart_id": shopcart.id, "item_count": 2, "unit_count": 5, "subtotal": 2.8},
+        )
+
+        self.client.delete(f"{BASE_URL}/{shopcart.id}/items")
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/totals")
+        self.assertEqual(
+            resp.get_json(),
+            {"shopcart_id": shopcart.id, "item_count": 0, "unit_count": 0, "subtotal": 0.0},
+        )
+
+        resp = self.client.get(f"{BASE_URL}/0/totals")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_shopcart_totals(self):
+        """It should return the totals of many Shopcarts in one query"""
+        shopcarts = self._create_shopcarts(3)
+        item = {**ItemFactory().serialize(), "quantity": 4, "price": 2.5}
+        self.client.post(f"{BASE_URL}/{shopcarts[1].id}/items", json=item)
+        ids = [shopcart.id for shopcart in shopcarts]
+
+        with QueryCounter() as counter:
+            resp = self.client.get(f"{BASE_URL}/totals?ids={ids[2]},{ids[1]}&ids={ids[0]},0,{ids[1]}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(counter.count, 1)
+        # ordered by id, without the id that is not a shopcart
+        totals = resp.get_json()
+        self.assertEqual([total["shopcart_id"] for total in totals], ids)
+        self.assertEqual(totals[1], {"shopcart_id": ids[1], "item_count": 1, "unit_count": 4, "subtotal": 10.0})
+        self.assertEqual(totals[0]["item_count"], 0)
+
+    def test_list_shopcart_totals_bad_ids(self):
+        """It should not return totals without valid ids"""
+        with patch.dict(app.config, {"TOTALS_BATCH_MAX": 3}):
+            for args in ("", "ids=", "ids=1,x", "ids=1,2,3,4"):
+                resp = self.client.get(f"{BASE_URL}/totals?{args}")
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, args)
+            resp = self.client.get(f"{BASE_URL}/totals?ids=1,2,3,3")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     ######################################################################
     #  ITEM  T E S T   C A S E S
     ######################################################################
@@ -354,6 +828,28 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 2)
 
+    def test_get_item_list_paginated(self):
+        """It should page through the items of a shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        for item in ItemFactory.create_batch(3):
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items", query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first_page = resp.get_json()
+        self.assertEqual(len(first_page), 2)
+        self.assertIn(f"/shopcarts/{shopcart.id}/items?", resp.headers["Link"])
+
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/items",
+            query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]},
+        )
+        second_page = resp.get_json()
+        self.assertEqual(len(second_page), 1)
+        self.assertGreater(second_page[0]["id"], first_page[-1]["id"])
+        self.assertNotIn("Link", resp.headers)
+
     def test_add_item(self):
         """It should Add an item to an shopcart"""
         shopcart = self._create_shopcarts(1)[0]
@@ -387,6 +883,109 @@ class TestShopcartService(TestCase):
             new_item["quantity"], item.quantity, "item quantity does not match"
         )
 
+    def test_add_items_in_bulk(self):
+        """It should Add a list of items to a shopcart in one transaction"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [ItemFactory().serialize() for _ in range(50)]
+        for item in items[:25]:
+            del item["id"]
+
+        with QueryCounter() as counter:
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        # one SELECT for the shopcart, one multi-row INSERT and one UPDATE
+        # of the shopcart summary
+        self.assertEqual(counter.count, 3)
+        self.assertTrue(resp.headers["Location"].endswith(f"/shopcarts/{shopcart.id}/items"))
+
+        data = resp.get_json()
+        self.assertEqual(len(data), 50)
+        self.assertEqual([i["name"] for i in data], [i["name"] for i in items])
+        self.assertTrue(all(i["shopcart_id"] == shopcart.id for i in data))
+        self.assertEqual(len({i["id"] for i in data}), 50)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual([i["id"] for i in resp.get_json()], [i["id"] for i in data])
+
+    def test_add_items_in_bulk_bad_request(self):
+        """It should not Add any item when one item in the list is invalid"""
+        shopcart = self._create_shopcarts(1)[0]
+        good = ItemFactory().serialize()
+        bad = ItemFactory().serialize()
+        del bad["quantity"]
+        for body in ([good, bad], [good, "not an item"], []):
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with patch.dict(app.config, {"BULK_CREATE_MAX": 1}):
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=[good, good])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_merge_items(self):
+        """It should add to the quantity of an item the shopcart already holds"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        milk = ItemFactory(name="Milk", quantity=2, price=1.5).serialize()
+        del milk["id"]
+
+        resp = self.client.post(f"{url}?merge=true", json=milk)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        created = resp.get_json()
+        self.assertTrue(resp.headers["Location"].endswith(f"{url}/{created['id']}"))
+        with QueryCounter() as counter:
+            resp = self.client.post(f"{url}?merge=true", json=milk)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # one SELECT for the shopcart, the upsert and the summary UPDATE
+        self.assertEqual(counter.count, 3)
+        self.assertEqual(resp.get_json(), {**created, "quantity": 4})
+
+        eggs = ItemFactory(name="Eggs", quantity=1, price=3).serialize()
+        resp = self.client.post(f"{url}?merge=1", json=[eggs, milk, eggs])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual([(i["name"], i["quantity"]) for i in data], [("Eggs", 2), ("Milk", 6)])
+        self.assertEqual(data[1]["id"], created["id"])
+        resp = self.client.post(f"{url}?merge=true", json=[milk])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(len(self.client.get(url).get_json()), 2)
+        totals = self.client.get(f"{url[:-len('/items')]}/totals").get_json()
+        self.assertEqual((totals["item_count"], totals["unit_count"], totals["subtotal"]), (2, 10, 18.0))
+
+    def test_merge_items_bad_request(self):
+        """It should not merge items that are invalid, and not create duplicates"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        milk = ItemFactory(name="Milk").serialize()
+        bad = ItemFactory().serialize()
+        del bad["quantity"]
+        for body in ([milk, bad], "not an item", []):
+            resp = self.client.post(f"{url}?merge=true", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).get_json(), [])
+
+        # without merge a second item of the same name is refused
+        resp = self.client.post(url, json=milk)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        for body in (dict(milk, id=None), [ItemFactory().serialize(), milk]):
+            resp = self.client.post(url, json=body)
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+            data = resp.get_json()
+            self.assertEqual(data["error"], "Conflict")
+            self.assertIn("?merge=true", data["message"])
+            self.assertNotIn("INSERT", data["message"])
+        self.assertEqual(len(self.client.get(url).get_json()), 1)
+
+        # renaming an item to the name of another is refused too
+        resp = self.client.post(url, json=ItemFactory(name="Eggs").serialize())
+        eggs = resp.get_json()
+        resp = self.client.put(f"{url}/{eggs['id']}", json=dict(eggs, name="Milk"))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertNotIn("UPDATE", resp.get_json()["message"])
+
     def test_get_item(self):
         """It should Get an item from an shopcart"""
         # create a known item
@@ -519,6 +1118,44 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 0)
 
+    def test_clear_items_constant_queries(self):
+        """It should clear a shopcart with one DELETE no matter its size"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = [ItemFactory().serialize() for _ in range(20)]
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=items)
+
+        with QueryCounter() as counter:
+            resp = self.client.delete(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        # one SELECT to check the shopcart exists, one DELETE and one UPDATE
+        # of the shopcart summary
+        self.assertEqual(counter.count, 3)
+
+    def test_delete_item_from_other_shopcart(self):
+        """It should not Delete an item through a shopcart that does not hold it"""
+        shopcarts = self._create_shopcarts(2)
+        shopcart, other = shopcarts[0], shopcarts[1]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        item_id = resp.get_json()["id"]
+
+        resp = self.client.delete(f"{BASE_URL}/{other.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_delete_shopcart_with_items(self):
+        """It should Delete a shopcart and all of its items"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        item_id = resp.get_json()["id"]
+
+        with QueryCounter() as counter:
+            resp = self.client.delete(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(counter.count, 1)
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_clear_items_shopcart_not_found(self):
         """It should fail to clear items from non-existent shopcart"""
         resp = self.client.delete(f"{BASE_URL}/0/items")
@@ -157,6 +157,81 @@ class TestShopcart(TestCase):
         shopcart = ShopcartFactory()
         self.assertRaises(DataValidationError, shopcart.delete)
 
+    def test_delete_shopcart_by_id(self):
+        """It should delete a shopcart and its items by id without loading it"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory()]
+        shopcart.create()
+        shopcart_id, item_id = shopcart.id, shopcart.items[0].id
+        db.session.expunge_all()
+
+        self.assertEqual(Shopcart.delete_by_id(shopcart_id), 1)
+        self.assertEqual(Shopcart.delete_by_id(shopcart_id), 0)
+        self.assertIsNone(Shopcart.find(shopcart_id))
+        self.assertIsNone(Item.find(item_id))
+
+    def test_transaction_commits_once(self):
+        """It should commit a unit of work once at the end"""
+        shopcarts = ShopcartFactory.create_batch(3)
+        with patch.object(db.session, "commit", wraps=db.session.commit) as commit:
+            with Shopcart.transaction():
+                for shopcart in shopcarts:
+                    shopcart.create()
+                    # ids are assigned by a flush without committing
+                    self.assertIsNotNone(shopcart.id)
+                shopcarts[0].customer_id = 99
+                shopcarts[0].update()
+                shopcarts[1].delete()
+                self.assertEqual(commit.call_count, 0)
+            self.assertEqual(commit.call_count, 1)
+        shopcart_id = shopcarts[0].id
+        db.session.expunge_all()
+        self.assertEqual(len(Shopcart.all()), 2)
+        self.assertEqual(Shopcart.find(shopcart_id).customer_id, 99)
+
+    def test_transaction_rolls_back(self):
+        """It should roll back the whole unit of work when it fails"""
+        with self.assertRaises(RuntimeError):
+            with Shopcart.transaction():
+                ShopcartFactory().create()
+                ShopcartFactory().create()
+                raise RuntimeError("boom")
+        self.assertEqual(Shopcart.all(), [])
+
+    def test_transaction_savepoint(self):
+        """It should only undo a failed nested unit of work"""
+        with Shopcart.transaction():
+            outer = ShopcartFactory()
+            outer.create()
+            with self.assertRaises(DataValidationError):
+                with Shopcart.transaction():
+                    ShopcartFactory().create()
+                    ShopcartFactory(customer_id=None).create()
+            with Shopcart.transaction():
+                ShopcartFactory().create()
+        self.assertEqual(len(Shopcart.all()), 2)
+        self.assertIsNotNone(Shopcart.find(outer.id))
+
+    def test_transaction_decorator(self):
+        """It should be usable as a decorator"""
+
+        @Shopcart.transaction()
+        def create_two():
+            ShopcartFactory().create()
+            ShopcartFactory().create()
+
+        create_two()
+        self.assertEqual(len(Shopcart.all()), 2)
+
+    def test_transaction_commit_failed(self):
+        """It should raise a DataValidationError if the final commit fails"""
+        with patch("service.models.db.session.commit") as exception_mock:
+            exception_mock.side_effect = Exception()
+            with self.assertRaises(DataValidationError):
+                with Shopcart.transaction():
+                    ShopcartFactory().create()
+        self.assertEqual(Shopcart.all(), [])
+
     def test_list_all_shopcarts(self):
         """It should List all shopcarts in the database"""
         shopcarts = Shopcart.all()
@@ -177,6 +252,67 @@ class TestShopcart(TestCase):
         self.assertEqual(same_shopcart.id, shopcart.id)
         self.assertEqual(same_shopcart.customer_id, shopcart.customer_id)
 
+    def test_find_by_item_name(self):
+        """It should Find shopcarts holding an item with a given name"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory(name="Milk"), ItemFactory(name="Eggs")]
+        shopcart.create()
+        other = ShopcartFactory()
+        other.items = [ItemFactory(name="Bread")]
+        other.create()
+
+        found = Shopcart.find_by_item_name("Milk").all()
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0].id, shopcart.id)
+        self.assertEqual(Shopcart.find_by_item_name("Beef").count(), 0)
+
+    def test_find_by_filters(self):
+        """It should Find shopcarts matching customer id and item name together"""
+        carts = []
+        for customer_id, name in [(1, "Milk"), (1, "Eggs"), (2, "Milk")]:
+            shopcart = ShopcartFactory(customer_id=customer_id)
+            shopcart.items = [ItemFactory(name=name)]
+            shopcart.create()
+            carts.append(shopcart)
+
+        self.assertEqual(
+            [sc.id for sc in Shopcart.find_by_filters()], [sc.id for sc in carts]
+        )
+        self.assertEqual(Shopcart.find_by_filters(customer_id=1).count(), 2)
+        self.assertEqual(Shopcart.find_by_filters(item_name="Milk").count(), 2)
+        found = Shopcart.find_by_filters(customer_id=1, item_name="Milk").all()
+        self.assertEqual([sc.id for sc in found], [carts[0].id])
+
+    def test_with_items_bad_strategy(self):
+        """It should not load items with an unknown loader strategy"""
+        self.assertRaises(
+            DataValidationError, Shopcart.with_items, Shopcart.query, "eager"
+        )
+
+    def test_keyset_page(self):
+        """It should return a page of shopcarts after a given id"""
+        for shopcart in ShopcartFactory.create_batch(5):
+            shopcart.create()
+        ids = [sc.id for sc in Shopcart.find_by_filters()]
+
+        page = Shopcart.keyset_page(limit=2)
+        self.assertEqual([sc.id for sc in page], ids[:2])
+        page = Shopcart.keyset_page(limit=2, after_id=ids[1])
+        self.assertEqual([sc.id for sc in page], ids[2:4])
+        page = Shopcart.keyset_page(Shopcart.find_by_customer(-1), limit=2)
+        self.assertEqual(page, [])
+
+    def test_keyset_scan(self):
+        """It should scan every shopcart one page at a time"""
+        for shopcart in ShopcartFactory.create_batch(5):
+            shopcart.create()
+        ids = [sc.id for sc in Shopcart.find_by_filters()]
+
+        self.assertEqual([sc.id for sc in Shopcart.keyset_scan(page_size=2)], ids)
+        self.assertEqual([sc.id for sc in Shopcart.keyset_scan(page_size=5)], ids)
+        query = Shopcart.query.filter(Shopcart.id > ids[2])
+        self.assertEqual([sc.id for sc in Shopcart.keyset_scan(query, page_size=1)], ids[3:])
+
     def test_serialize_an_shopcart(self):
         """It should Serialize an shopcart"""
         shopcart = ShopcartFactory()
@@ -196,6 +332,101 @@ class TestShopcart(TestCase):
         self.assertEqual(items[0]["quantity"], item.quantity)
         self.assertEqual(items[0]["price"], item.price)
 
+    def test_read_serialized(self):
+        """It should serialize shopcarts from rows exactly like serialize()"""
+        for count in (0, 1, 3):
+            shopcart = ShopcartFactory()
+            shopcart.items = ItemFactory.create_batch(count, id=None)
+            shopcart.create()
+        db.session.expire_all()
+        expected = []
+        for shopcart in Shopcart.find_by_filters():
+            data = shopcart.serialize()
+            data["items"].sort(key=lambda item: item["id"])
+            expected.append(data)
+
+        self.assertEqual(Shopcart.read_serialized(Shopcart.find_by_filters()), expected)
+        streamed = Shopcart.stream_serialized(Shopcart.find_by_filters(), batch_size=2)
+        self.assertEqual(list(streamed), expected)
+        self.assertEqual(Shopcart.read_serialized(Shopcart.find_by_customer(-1)), [])
+
+    def test_read_by_id(self):
+        """It should read a shopcart and its ETag as rows"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(2, id=None)
+        shopcart.create()
+        empty = ShopcartFactory()
+        empty.create()
+        for record in (shopcart, empty):
+            etag, data = Shopcart.read_by_id(record.id)
+            self.assertEqual(etag, record.etag())
+            self.assertEqual(data, Shopcart.read_serialized(Shopcart.query.filter_by(id=record.id))[0])
+        self.assertEqual(Shopcart.read_by_id(empty.id)[1]["items"], [])
+        self.assertIsNone(Shopcart.read_by_id(0))
+
+    def test_find_totals(self):
+        """It should sum up the Items of shopcarts like the client would"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(5, id=None)
+        shopcart.create()
+        empty = ShopcartFactory()
+        empty.create()
+
+        totals = Shopcart.find_totals([empty.id, shopcart.id, 0])
+        self.assertEqual([total["shopcart_id"] for total in totals], sorted([shopcart.id, empty.id]))
+        found = totals[0] if totals[0]["shopcart_id"] == shopcart.id else totals[1]
+        self.assertEqual(found["item_count"], 5)
+        self.assertEqual(found["unit_count"], sum(item.quantity for item in shopcart.items))
+        subtotal = sum(item.quantity * float(item.price) for item in shopcart.items)
+        self.assertAlmostEqual(found["subtotal"], subtotal, places=2)
+        self.assertIn({"shopcart_id": empty.id, "item_count": 0, "unit_count": 0, "subtotal": 0.0}, totals)
+        self.assertEqual(Shopcart.find_totals([0]), [])
+
+    def test_items_in_insertion_order(self):
+        """It should load the items of a shopcart in the order they were added"""
+        shopcart = ShopcartFactory()
+        shopcart.items = [ItemFactory(name=name, id=None) for name in ("Zucchini", "Milk", "Apples")]
+        shopcart.create()
+        db.session.expire_all()
+        found = Shopcart.find(shopcart.id)
+        self.assertEqual([item["name"] for item in found.serialize()["items"]], ["Zucchini", "Milk", "Apples"])
+        ids = [item.id for item in found.items]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_serialize_summary(self):
+        """It should serialize the summary of a shopcart without its items"""
+        shopcart = ShopcartFactory()
+        shopcart.items = ItemFactory.create_batch(2, quantity=3, price=0.1)
+        shopcart.create()
+        db.session.expire_all()
+        shopcart = Shopcart.find(shopcart.id)
+        data = shopcart.serialize(summary=True)
+        self.assertNotIn("items", data)
+        self.assertEqual(data["item_count"], 2)
+        self.assertEqual(data["unit_count"], 6)
+        self.assertEqual(data["subtotal"], 0.6)
+        self.assertNotIn("items", shopcart.__dict__)
+        self.assertEqual(Shopcart().serialize(summary=True)["item_count"], 0)
+
+    def test_reconcile_summaries(self):
+        """It should reset the summaries that drifted from the items, in batches"""
+        for count in range(5):
+            shopcart = ShopcartFactory()
+            shopcart.items = ItemFactory.create_batch(count)
+            shopcart.create()
+        ids = [shopcart.id for shopcart in Shopcart.all()]
+        expected = Shopcart.find_totals(ids)
+        table = Shopcart.__table__
+        db.session.execute(table.update().where(table.c.id.in_(ids[1:3])).values(item_count=99))
+        db.session.execute(table.update().where(table.c.id == ids[4]).values(subtotal=table.c.subtotal + 0.01))
+        # float rounding is not drift
+        db.session.execute(table.update().where(table.c.id == ids[3]).values(subtotal=table.c.subtotal + 1e-9))
+        db.session.commit()
+
+        self.assertEqual(Shopcart.reconcile_summaries(db.engine, batch_size=2), (5, 3))
+        self.assertEqual(Shopcart.find_totals(ids), expected)
+        self.assertEqual(Shopcart.reconcile_summaries(db.engine, batch_size=5), (5, 0))
+
     def test_deserialize_an_shopcart(self):
         """It should Deserialize an shopcart"""
         shopcart = ShopcartFactory()